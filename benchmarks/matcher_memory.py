@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Compares the memory used by the item matcher with the pytrie.StringTrie that
+# the parser used to keep.  Run from the repo root with:
+#   PYTHONPATH=. python benchmarks/matcher_memory.py
+
+import csv
+import gc
+import os
+import time
+import tracemalloc
+
+from parse_auctions import parser
+
+try:
+  import pytrie
+except ImportError:
+  pytrie = None
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ITEMS_CSV_PATH = os.path.join(ROOT_PATH, 'get_items', 'items.csv')
+ALIASES_CSV_PATH = os.path.join(ROOT_PATH, 'get_items', 'aliases.csv')
+
+
+def load_tables():
+  with open(ITEMS_CSV_PATH, 'r', newline='') as csv_file:
+    names = [row['name'] for row in csv.DictReader(csv_file)]
+  item_table = dict(
+      (name.lower(), item_id) for item_id, name in enumerate(names, 1))
+  with open(ALIASES_CSV_PATH, 'r', newline='') as csv_file:
+    alias_table = dict(
+        (row['alias'].lower(), item_table[row['name'].lower()])
+        for row in csv.DictReader(csv_file))
+  return item_table, alias_table
+
+
+def measure(build):
+  """Returns the bytes allocated for build's result, and its build time."""
+  start = time.perf_counter()
+  build()
+  elapsed = time.perf_counter() - start
+  # Build again with tracing on, since tracing slows building down a lot.
+  gc.collect()
+  tracemalloc.start()
+  result = build()
+  size, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del result
+  return size, elapsed
+
+
+def main():
+  item_table, alias_table = load_tables()
+  print('{:,} names and {:,} aliases'.format(len(item_table), len(alias_table)))
+  if pytrie:
+    size, elapsed = measure(lambda: pytrie.StringTrie(item_table))
+    print('pytrie.StringTrie: {:6.1f} MB, built in {:.2f}s'.format(
+        size / 1e6, elapsed))
+  size, elapsed = measure(
+      lambda: parser.build_matcher(item_table, alias_table))
+  print('matcher.Matcher:   {:6.1f} MB, built in {:.2f}s'.format(
+      size / 1e6, elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Run from the repo root with: PYTHONPATH=. python benchmarks/run_benchmarks.py
+# Pass --baseline with the results of an earlier commit to compare.
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from benchmarks import stub_db
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ITEMS_CSV_PATH = os.path.join(ROOT_PATH, 'get_items', 'items.csv')
+DEFAULT_OUTPUT_PATH = os.path.join(ROOT_PATH, 'benchmarks', 'results.json')
+
+# The full wiki item and spell list, padded out with made up names so that the
+# matcher is about as big as it would be with aliases loaded.
+ITEM_COUNT = 30000
+MESSAGE_COUNT = 20000
+# Live auctions are mostly the same messages repeated, so the cached benchmark
+# cycles through this many distinct messages.
+REPEATED_MESSAGE_COUNT = 2000
+# Each measurement runs for at least this long.
+MIN_SECONDS = 1.0
+SERVER_WORKERS = 8
+SERVER_CLIENTS = 8
+SERVER_REQUESTS_PER_CLIENT = 200
+SERVER_LINES_PER_BATCH = 100
+
+MADE_UP_SUFFIXES = [
+    'of the Bear', 'of Flame', 'of Frost', 'of the Wolf', 'of Shadows',
+    'of Greed', 'of Storms', 'of the Deep', 'of Thorns', 'of Rage']
+# Message templates modeled on test_logs/, plus a few common shapes.
+MESSAGE_TEMPLATES = [
+    'WTS/T: ►►{0}{p0}◄◄',
+    'WTS {0} ,  {1} , {2} , {3}',
+    'WTS {0} {p0}',
+    'WTB {0} {p0}, {1} {p1}',
+    'Selling {0} {p0} | {1} {p1} | Buying {2}',
+    '*=WTB=* {0} paying {p0}',
+    'WTS {0}: {p0} {1}: {p1} {2}: {p2} PST',
+    'anyone have a port to {0}?',
+]
+
+
+def load_item_names():
+  with open(ITEMS_CSV_PATH, 'r', newline='') as csv_file:
+    names = [row['name'] for row in csv.DictReader(csv_file)]
+  rng = random.Random(0)
+  made_up = set(names)
+  while len(made_up) < ITEM_COUNT:
+    made_up.add('{} {}'.format(
+        rng.choice(names), rng.choice(MADE_UP_SUFFIXES)))
+  return sorted(made_up)
+
+
+def make_item_table(item_names):
+  return dict(
+      (name.lower(), item_id) for item_id, name in enumerate(item_names, 1))
+
+
+def random_price(rng):
+  return rng.choice([
+      '{}k'.format(rng.randint(1, 30)),
+      '{}.{}k'.format(rng.randint(1, 9), rng.randint(1, 9)),
+      '{}pp'.format(rng.randint(5, 999)),
+      '{}'.format(rng.randint(5, 999)),
+      ''])
+
+
+def make_messages(item_names, count):
+  rng = random.Random(1)
+  messages = []
+  for _ in range(count):
+    template = rng.choice(MESSAGE_TEMPLATES)
+    names = [rng.choice(item_names) for _ in range(4)]
+    prices = dict(('p{}'.format(i), random_price(rng)) for i in range(3))
+    messages.append(template.format(*names, **prices))
+  return messages
+
+
+def make_log_lines(messages):
+  start = datetime.datetime(2017, 1, 7, 17, 43, 44)
+  lines = []
+  for i, message in enumerate(messages):
+    timestamp = start + datetime.timedelta(seconds=i // 5)
+    lines.append("[{}] Trader{} auctions, '{}'".format(
+        timestamp.strftime('%a %b %d %H:%M:%S %Y'), i % 500, message))
+  return lines
+
+
+def measure(function, inputs):
+  """Calls function on every input until MIN_SECONDS pass.  Returns calls/sec.
+  """
+  calls = 0
+  start = time.perf_counter()
+  while True:
+    for value in inputs:
+      function(value)
+    calls += len(inputs)
+    elapsed = time.perf_counter() - start
+    if elapsed >= MIN_SECONDS:
+      return calls / elapsed
+
+
+def benchmark_parser(results, item_names, messages, log_lines):
+  from parse_auctions import parser
+  item_table = make_item_table(item_names)
+  start = time.perf_counter()
+  auction_parser = parser.Parser(test_item_table=item_table)
+  results['parser_build_seconds'] = time.perf_counter() - start
+  # More distinct messages than the cache holds, so that every one is a miss.
+  results['parse_auction_per_sec'] = measure(
+      auction_parser.parse_auction, messages)
+  results['parse_auction_repeated_per_sec'] = measure(
+      auction_parser.parse_auction, messages[:REPEATED_MESSAGE_COUNT])
+  # parse_many with more and more processes, to see how it scales with cores.
+  processes = 1
+  while processes <= os.cpu_count():
+    many_parser = parser.Parser(
+        item_matcher=auction_parser.items, processes=processes)
+    batches_per_sec = measure(many_parser.parse_many, [messages])
+    many_parser.close()
+    results['parse_many_{}_processes_per_sec'.format(processes)] = (
+        batches_per_sec * len(messages))
+    processes *= 2
+  results['split_line_per_sec'] = measure(parser.split_line, log_lines)
+  timestamps = [parser.split_line(line)[0] for line in log_lines]
+  results['parse_timestamp_per_sec'] = measure(
+      parser.parse_timestamp, timestamps)
+
+
+def benchmark_server(results, log_lines):
+  from parse_auctions import parser
+  from parse_auctions import server
+  server.PARSER = parser.Parser()
+  httpd = server.PooledHTTPServer(
+      ('127.0.0.1', 0), server.RequestHandler, SERVER_WORKERS)
+  httpd.RequestHandlerClass.log_message = lambda *args: None
+  thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+  thread.start()
+  url = 'http://127.0.0.1:{}'.format(httpd.server_port)
+  now_str = datetime.datetime.now().replace(microsecond=0).isoformat()
+
+  def run_clients(name, make_request):
+    """Returns requests per second, and records how many of them failed."""
+    failures = []
+    errors = []
+
+    def client(client_id):
+      try:
+        session = requests.Session()
+        for i in range(SERVER_REQUESTS_PER_CLIENT):
+          response = make_request(session, client_id, i)
+          if not response.ok:
+            failures.append(response.status_code)
+      except Exception as e:
+        errors.append(e)
+    threads = [
+        threading.Thread(target=client, args=(client_id,))
+        for client_id in range(SERVER_CLIENTS)]
+    start = time.perf_counter()
+    for client_thread in threads:
+      client_thread.start()
+    for client_thread in threads:
+      client_thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+      raise errors[0]
+    results[name + '_failures'] = len(failures)
+    if failures:
+      print('{} of the {} requests failed, with {}'.format(
+          len(failures), name, sorted(set(failures))))
+    return SERVER_CLIENTS * SERVER_REQUESTS_PER_CLIENT / elapsed
+
+  def upload_log(session, client_id, i):
+    line = log_lines[(client_id * SERVER_REQUESTS_PER_CLIENT + i) %
+                     len(log_lines)]
+    return session.post(
+        url + '/upload_log', data=(now_str + ' ' + line).encode())
+
+  def upload_logs(session, client_id, i):
+    start = ((client_id * SERVER_REQUESTS_PER_CLIENT + i) *
+             SERVER_LINES_PER_BATCH % len(log_lines))
+    lines = log_lines[start:start + SERVER_LINES_PER_BATCH]
+    return session.post(
+        url + '/upload_logs', data='\n'.join([now_str] + lines).encode())
+
+  def price_history(session, client_id, i):
+    # A handful of popular items, which should stay in the read cache.
+    return session.get(
+        url + '/price_history?item_id={}'.format(i % 10 + 1))
+
+  try:
+    results['price_history_requests_per_sec'] = run_clients(
+        'price_history', price_history)
+    results['upload_log_requests_per_sec'] = run_clients(
+        'upload_log', upload_log)
+    requests_per_sec = run_clients('upload_logs', upload_logs)
+    results['upload_logs_requests_per_sec'] = requests_per_sec
+    results['upload_logs_lines_per_sec'] = (
+        requests_per_sec * SERVER_LINES_PER_BATCH)
+  finally:
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get_commit():
+  try:
+    return subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=ROOT_PATH,
+        stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare(results, baseline_path):
+  with open(baseline_path, 'r') as f:
+    baseline = json.load(f)['results']
+  print('Compared to {}:'.format(baseline_path))
+  for name, value in sorted(results.items()):
+    if baseline.get(name):
+      change = (value - baseline[name]) / baseline[name] * 100
+      print('  {:<32} {:+.1f}%'.format(name, change))
+
+
+def parse_args():
+  arg_parser = argparse.ArgumentParser(
+      description='Benchmarks parsing and ingest throughput.')
+  arg_parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH)
+  arg_parser.add_argument(
+      '--baseline', help='A results file from an earlier run to compare to.')
+  arg_parser.add_argument(
+      '--real-db', action='store_true',
+      help='Run the server benchmark against the Postgres in '
+           'database-password instead of an in-memory stand-in.  Use a '
+           'throwaway database, since it gets written to.')
+  arg_parser.add_argument(
+      '--skip-server', action='store_true', help='Only benchmark parsing.')
+  return arg_parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  item_names = load_item_names()
+  messages = make_messages(item_names, MESSAGE_COUNT)
+  log_lines = make_log_lines(messages)
+  if not args.real_db:
+    stub_db.ITEMS = list(enumerate(item_names, 1))
+    sys.modules['db'] = stub_db
+  results = {}
+  benchmark_parser(results, item_names, messages, log_lines)
+  if not args.skip_server:
+    benchmark_server(results, log_lines)
+  for name, value in sorted(results.items()):
+    print('{:<32} {:>14,.2f}'.format(name, value))
+  with open(args.output, 'w') as f:
+    json.dump({
+        'commit': get_commit(),
+        'time': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'real_db': args.real_db,
+        'item_count': len(item_names),
+        'results': results,
+    }, f, indent=2, sort_keys=True)
+  print('Saved results to ' + args.output)
+  if args.baseline:
+    compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# An in-memory stand-in for db.py, for benchmarking without Postgres.  It
+# implements just enough of db.py for the server's ingest path.
+
+import contextlib
+import datetime
+import itertools
+import threading
+
+
+CONNECTION_ERRORS = ()
+ROLLBACK_ERRORS = ()
+DUPLICATE_WINDOW = datetime.timedelta(seconds=60)
+
+# (item_id, canonical_name) rows returned by get_all_items.
+ITEMS = []
+
+_lock = threading.Lock()
+_next_id = itertools.count(1)
+_characters = {}
+_raw_auctions = set()
+clean_auction_count = 0
+
+
+def configure_pool(size):
+  pass
+
+
+@contextlib.contextmanager
+def transaction():
+  with _lock:
+    yield None
+
+
+def get_all_items():
+  return list(ITEMS)
+
+
+def get_all_item_names():
+  return []
+
+
+def get_items_version():
+  return str(len(ITEMS))
+
+
+def get_or_create_characters_with_cursor(cur, names):
+  character_ids = {}
+  for name in names:
+    if name not in _characters:
+      _characters[name] = next(_next_id)
+    character_ids[name] = _characters[name]
+  return character_ids
+
+
+def get_or_create_character_with_cursor(cur, name):
+  return get_or_create_characters_with_cursor(cur, [name])[name]
+
+
+def add_raw_auctions_bulk_with_cursor(cur, rows, use_copy=False):
+  raw_ids = []
+  for timestamp, character_id, message in rows:
+    # Close enough to the real one-minute window for benchmarking.
+    key = (character_id, message, timestamp.replace(second=0))
+    if key in _raw_auctions:
+      raw_ids.append(None)
+    else:
+      _raw_auctions.add(key)
+      raw_ids.append(next(_next_id))
+  return raw_ids
+
+
+def add_clean_auctions_bulk_with_cursor(cur, rows):
+  global clean_auction_count
+  clean_auction_count += len(rows)
+
+
+def get_price_rollups(item_id, period, start, end):
+  return []
+
+
+def get_recent_auctions(item_id, limit):
+  return []
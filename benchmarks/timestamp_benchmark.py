@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import timeit
+
+import dateutil.parser
+
+import eqtime
+
+
+# One minute of log lines, several per second, like a busy zone.
+TIMESTAMPS = [
+    'Jan 07 17:46:{:02d} 2017'.format(second)
+    for second in range(60) for _ in range(5)]
+REPEAT = 5
+NUMBER = 20
+
+
+def benchmark(name, parse):
+  def run():
+    for timestamp_str in TIMESTAMPS:
+      parse(timestamp_str)
+  best = min(timeit.repeat(run, repeat=REPEAT, number=NUMBER))
+  per_second = len(TIMESTAMPS) * NUMBER / best
+  print('{:<24} {:>12,.0f} timestamps/sec'.format(name, per_second))
+  return per_second
+
+
+def main():
+  baseline = benchmark('dateutil', dateutil.parser.parse)
+  fixed = benchmark('fixed format', eqtime.parse_fixed_format)
+  cached = benchmark('fixed format + cache', eqtime.parse_timestamp)
+  print('Speedup: {:.0f}x uncached, {:.0f}x cached'.format(
+      fixed / baseline, cached / baseline))
+
+
+if __name__ == '__main__':
+  main()
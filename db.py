@@ -1,17 +1,68 @@
 #!/usr/bin/env python3
 
+import collections
+import contextlib
 import datetime
+import io
 import os
+import queue
+import threading
 
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+import lru
+import rollups
 
 
 ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
 PASSWORD_FILE_PATH = os.path.join(ROOT_PATH, 'database-password')
 DB_NAME = 'p99tunnel'
 DB_USER = 'p99tunnel'
+# Two copies of the same message from the same character this close together
+# are treated as one auction.
+DUPLICATE_WINDOW = datetime.timedelta(seconds=60)
+# The number of rows sent in each multi-row INSERT.
+BULK_PAGE_SIZE = 1000
+# The number of character name to ID mappings kept in memory.
+CHARACTER_CACHE_SIZE = 10000
+# The default maximum number of open database connections.
+DEFAULT_POOL_SIZE = 8
+
+
+def time_bucket_sql(timestamp):
+  """Returns SQL for the DUPLICATE_WINDOW-wide time bucket of timestamp."""
+  return 'floor(extract(epoch FROM {}) / {})::bigint'.format(
+      timestamp, int(DUPLICATE_WINDOW.total_seconds()))
+
+
+# Checks that the row "new" doesn't duplicate an existing raw auction.  Time
+# buckets are as wide as DUPLICATE_WINDOW, so a duplicate can only be in the
+# same bucket or a neighboring one, which keeps this a short scan of the unique
+# (character_id, message_hash, time_bucket) index no matter how big the table
+# gets.  The unique index also catches concurrent inserts into the same bucket.
+NO_DUPLICATE_RAW_AUCTION_SQL = (
+    'NOT EXISTS ( '
+    '  SELECT 1 FROM raw_auctions '
+    '  WHERE raw_auctions.character_id = new.character_id AND '
+    '        raw_auctions.message_hash = md5(new.message)::uuid AND '
+    '        raw_auctions.time_bucket BETWEEN {bucket} - 1 '
+    '                                     AND {bucket} + 1 AND '
+    '        raw_auctions.timestamp > new.timestamp - {window} AND '
+    '        raw_auctions.timestamp < new.timestamp + {window})').format(
+        bucket=time_bucket_sql('new.timestamp'),
+        window="interval '{} seconds'".format(
+            int(DUPLICATE_WINDOW.total_seconds())))
+
+# Errors that mean a connection is broken rather than that a query failed.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+# Errors that mean a transaction lost a deadlock or a serialization conflict.
+# The connection is still good, and running the transaction again will work.
+# These are OperationalErrors too, so catch them first.
+ROLLBACK_ERRORS = (psycopg2.extensions.TransactionRollbackError,)
 
-CACHED_CONNECTION = None
+CHARACTER_CACHE = lru.LruCache(CHARACTER_CACHE_SIZE)
 
 
 def get_db_password():
@@ -26,65 +77,629 @@ def connect():
       host='localhost')
 
 
-def get_or_create_connection():
-  global CACHED_CONNECTION
-  if CACHED_CONNECTION is None:
-    CACHED_CONNECTION = connect()
-  return CACHED_CONNECTION
+class ConnectionPool(object):
+  """A bounded pool of connections shared between threads.
+
+  Connections are opened lazily, up to size of them.  When every connection is
+  checked out, checking out another one blocks until one is returned.
+  Connections that break while checked out are thrown away and replaced the
+  next time one is needed.
+  """
+
+  def __init__(self, size, connect=connect):
+    self.size = size
+    self._connect = connect
+    self._idle = queue.LifoQueue()
+    self._slots = threading.BoundedSemaphore(size)
+
+  @contextlib.contextmanager
+  def connection(self):
+    self._slots.acquire()
+    try:
+      conn = self._idle.get_nowait()
+    except queue.Empty:
+      try:
+        conn = self._connect()
+      except Exception:
+        self._slots.release()
+        raise
+    try:
+      yield conn
+    except ROLLBACK_ERRORS:
+      self._put_back(conn)
+      raise
+    except CONNECTION_ERRORS:
+      self._discard(conn)
+      raise
+    except Exception:
+      self._put_back(conn)
+      raise
+    else:
+      self._put_back(conn)
+
+  def _put_back(self, conn):
+    if conn.closed:
+      self._discard(conn)
+    else:
+      self._idle.put(conn)
+      self._slots.release()
+
+  def _discard(self, conn):
+    try:
+      conn.close()
+    finally:
+      self._slots.release()
+
+  def close(self):
+    """Closes the idle connections."""
+    while True:
+      try:
+        self._idle.get_nowait().close()
+      except queue.Empty:
+        return
+
+
+POOL = ConnectionPool(DEFAULT_POOL_SIZE)
+
+
+def configure_pool(size):
+  """Replaces the connection pool with one that holds up to size connections.
+
+  This should be called before any threads start using the database.
+  """
+  global POOL
+  POOL.close()
+  POOL = ConnectionPool(size)
+
+
+@contextlib.contextmanager
+def transaction():
+  """Yields a cursor whose statements are all committed together.
+
+  If the block raises, everything done with the cursor is rolled back.
+  """
+  try:
+    with POOL.connection() as conn:
+      with conn:
+        with conn.cursor() as cur:
+          yield cur
+  except Exception:
+    # Characters created by the rolled back transaction no longer exist, so
+    # their cached IDs can't be trusted.
+    CHARACTER_CACHE.clear()
+    raise
 
 
 def get_or_create_character(name):
   """Returns the ID associated with name, creating a row if necessary."""
-  with get_or_create_connection() as conn:
-    with conn.cursor() as cur:
-      cur.execute('SELECT id FROM characters WHERE name = %s', (name,))
-      result = cur.fetchone()
-      if result:
-        return result[0]
+  with transaction() as cur:
+    return get_or_create_character_with_cursor(cur, name)
+
+
+def get_or_create_character_with_cursor(cur, name):
+  character_id = CHARACTER_CACHE.get(name)
+  if character_id is None:
+    character_id = get_or_create_characters_with_cursor(cur, [name])[name]
+  return character_id
+
+
+def get_or_create_characters(names):
+  """Returns a dict of name to ID for names, creating rows if necessary."""
+  with transaction() as cur:
+    return get_or_create_characters_with_cursor(cur, names)
+
+
+def get_or_create_characters_with_cursor(cur, names):
+  character_ids = {}
+  missing = []
+  for name in set(names):
+    character_id = CHARACTER_CACHE.get(name)
+    if character_id is None:
+      missing.append(name)
+    else:
+      character_ids[name] = character_id
+  if missing:
+    # Names that already exist don't come back from the INSERT, so look those
+    # up afterwards.  Concurrent uploads insert names in the same order, so
+    # they can't deadlock on each other's rows.
+    missing.sort()
+    results = psycopg2.extras.execute_values(
+        cur,
+        'INSERT INTO characters (name) VALUES %s '
+        'ON CONFLICT (name) DO NOTHING RETURNING name, id',
+        [(name,) for name in missing],
+        page_size=BULK_PAGE_SIZE, fetch=True)
+    if len(results) < len(missing):
       cur.execute(
-          'INSERT INTO characters (name) VALUES (%s) RETURNING id', (name,))
-      result = cur.fetchone()
-      return result[0]
+          'SELECT name, id FROM characters WHERE name = ANY(%s)', (missing,))
+      results += cur.fetchall()
+    for name, character_id in results:
+      CHARACTER_CACHE.put(name, character_id)
+      character_ids[name] = character_id
+  return character_ids
+
 
 def add_raw_auction(timestamp, character_id, message):
   """Adds a raw auction to the db and returns its ID."""
+  with transaction() as cur:
+    return add_raw_auction_with_cursor(cur, timestamp, character_id, message)
+
+
+def add_raw_auction_with_cursor(cur, timestamp, character_id, message):
   # Don't make a new entry if the exact same message has already been seen
-  # within one minute of this message.
-  one_minute = datetime.timedelta(seconds=60)
-  before = timestamp - one_minute
-  after = timestamp + one_minute
-  with get_or_create_connection() as conn:
-    with conn.cursor() as cur:
-      cur.execute(
-          'SELECT id FROM raw_auctions '
-          'WHERE character_id = %s AND timestamp > %s AND timestamp < %s AND '
-          '      message = %s',
-          (character_id, before, after, message))
-      # If we've already processed this auction, then return None without
-      # inserting a new row.
-      if cur.rowcount:
-        return None
-      cur.execute(
-          'INSERT INTO raw_auctions (timestamp, character_id, message) '
-          'VALUES (%s, %s, %s) RETURNING id',
-          (timestamp, character_id, message))
-      result = cur.fetchone()
-      return result[0]
+  # within one minute of this message.  If we've already processed this
+  # auction, then return None without inserting a new row.
+  cur.execute(
+      'WITH new (timestamp, character_id, message) AS ( '
+      '  VALUES (%s::timestamp, %s::integer, %s::varchar)) '
+      'INSERT INTO raw_auctions (timestamp, character_id, message) '
+      'SELECT new.timestamp, new.character_id, new.message FROM new '
+      'WHERE ' + NO_DUPLICATE_RAW_AUCTION_SQL + ' '
+      'ON CONFLICT DO NOTHING '
+      'RETURNING id',
+      (timestamp, character_id, message))
+  result = cur.fetchone()
+  return result[0] if result else None
 
 
 def add_clean_auction(
     raw_auction_id, character_id, item_id, timestamp, is_selling, price):
-  with get_or_create_connection() as conn:
-    with conn.cursor() as cur:
+  with transaction() as cur:
+    add_clean_auction_with_cursor(
+        cur, raw_auction_id, character_id, item_id, timestamp, is_selling,
+        price)
+
+
+def add_clean_auction_with_cursor(
+    cur, raw_auction_id, character_id, item_id, timestamp, is_selling, price):
+  cur.execute(
+      'INSERT INTO clean_auctions ( '
+      '  raw_auction_id, character_id, item_id, timestamp, is_selling, '
+      '  price) '
+      'VALUES (%s, %s, %s, %s, %s, %s)',
+      (raw_auction_id, character_id, item_id, timestamp, is_selling, price))
+  update_rollups_with_cursor(cur, [(item_id, timestamp, is_selling, price)])
+
+
+def add_raw_auctions_bulk(rows, use_copy=False):
+  """Adds many raw auctions and returns their IDs in the same order as rows.
+
+  rows is a list of (timestamp, character_id, message) tuples.  Like
+  add_raw_auction, rows that duplicate an existing auction (or an earlier row
+  in the same list) get None instead of an ID.
+
+  With use_copy, the rows are loaded into a staging table with COPY before
+  being deduplicated, which is faster for very large batches.
+  """
+  with transaction() as cur:
+    return add_raw_auctions_bulk_with_cursor(cur, rows, use_copy)
+
+
+def add_raw_auctions_bulk_with_cursor(cur, rows, use_copy=False):
+  is_new = _dedup_raw_rows(rows)
+  new_rows = [row for row, new in zip(rows, is_new) if new]
+  if not new_rows:
+    return [None] * len(rows)
+  # Reserve the IDs up front so that they line up with the input order no
+  # matter what order the database inserts the rows in.
+  cur.execute(
+      "SELECT nextval(pg_get_serial_sequence('raw_auctions', 'id')) "
+      'FROM generate_series(1, %s)',
+      (len(new_rows),))
+  reserved_ids = [result[0] for result in cur.fetchall()]
+  new_rows = [
+      (raw_id,) + tuple(row) for raw_id, row in zip(reserved_ids, new_rows)]
+  if use_copy:
+    inserted = _copy_raw_auctions(cur, new_rows)
+  else:
+    inserted = psycopg2.extras.execute_values(
+        cur,
+        'WITH new (id, timestamp, character_id, message) AS (VALUES %s) '
+        'INSERT INTO raw_auctions (id, timestamp, character_id, message) '
+        'SELECT new.id, new.timestamp, new.character_id, new.message '
+        'FROM new '
+        'WHERE ' + NO_DUPLICATE_RAW_AUCTION_SQL + ' '
+        'ON CONFLICT DO NOTHING '
+        'RETURNING id',
+        new_rows, page_size=BULK_PAGE_SIZE, fetch=True)
+  inserted_ids = set(result[0] for result in inserted)
+  reserved_ids = iter(reserved_ids)
+  raw_ids = []
+  for new in is_new:
+    raw_id = next(reserved_ids) if new else None
+    raw_ids.append(raw_id if raw_id in inserted_ids else None)
+  return raw_ids
+
+
+def _copy_raw_auctions(cur, rows):
+  """COPYs (id, timestamp, character_id, message) rows into raw_auctions.
+
+  Returns the IDs of the rows that weren't duplicates.
+  """
+  cur.execute(
+      'CREATE TEMPORARY TABLE IF NOT EXISTS raw_auctions_staging ( '
+      '  id integer, timestamp timestamp, character_id integer, '
+      '  message varchar(1024) '
+      ') ON COMMIT DELETE ROWS')
+  _copy_rows(
+      cur, 'raw_auctions_staging',
+      ('id', 'timestamp', 'character_id', 'message'), rows)
+  # Without statistics the planner guesses the staging table is tiny and may
+  # hash the whole of raw_auctions instead of probing its index.
+  cur.execute('ANALYZE raw_auctions_staging')
+  cur.execute(
+      'INSERT INTO raw_auctions (id, timestamp, character_id, message) '
+      'SELECT new.id, new.timestamp, new.character_id, new.message '
+      'FROM raw_auctions_staging AS new '
+      'WHERE ' + NO_DUPLICATE_RAW_AUCTION_SQL + ' '
+      'ON CONFLICT DO NOTHING '
+      'RETURNING id')
+  inserted = cur.fetchall()
+  # Rows are only deleted on commit, so clear them out in case the caller adds
+  # another batch in the same transaction.
+  cur.execute('TRUNCATE raw_auctions_staging')
+  return inserted
+
+
+def _dedup_raw_rows(rows):
+  """Returns whether each row is the first of its kind within the list.
+
+  Like add_raw_auction, a row is only compared with the rows that are kept, so
+  copies at 0, 50 and 100 seconds keep the first and the last.
+  """
+  kept = {}
+  is_new = []
+  for timestamp, character_id, message in rows:
+    timestamps = kept.setdefault((character_id, message), [])
+    new = all(
+        abs(timestamp - other) >= DUPLICATE_WINDOW for other in timestamps)
+    if new:
+      timestamps.append(timestamp)
+    is_new.append(new)
+  return is_new
+
+
+def add_clean_auctions_bulk(rows):
+  """Adds many clean auctions with a single COPY.
+
+  rows is a list of (raw_auction_id, character_id, item_id, timestamp,
+  is_selling, price) tuples.
+  """
+  with transaction() as cur:
+    add_clean_auctions_bulk_with_cursor(cur, rows)
+
+
+def add_clean_auctions_bulk_with_cursor(cur, rows):
+  _copy_rows(
+      cur, 'clean_auctions',
+      ('raw_auction_id', 'character_id', 'item_id', 'timestamp', 'is_selling',
+       'price'),
+      rows)
+  update_rollups_with_cursor(
+      cur,
+      [(item_id, timestamp, is_selling, price)
+       for _, _, item_id, timestamp, is_selling, price in rows])
+
+
+ROLLUP_KEY_COLUMNS = ('item_id', 'is_selling', 'period', 'period_start')
+ROLLUP_COLUMNS = (
+    'auction_count', 'price_count', 'min_price', 'max_price', 'price_sum')
+
+
+def update_rollups_with_cursor(cur, auctions):
+  """Adds (item_id, timestamp, is_selling, price) tuples to the rollups."""
+  if auctions:
+    _upsert_rollups(cur, rollups.aggregate(auctions))
+
+
+def _upsert_rollups(cur, new_rollups):
+  """Adds a dict of rollup key to rollups.Rollup to the rollup tables.
+
+  The rows are COPYed into staging tables and then merged in with one INSERT
+  per table, since a big backfill batch touches tens of thousands of rollups.
+  """
+  cur.execute(
+      'CREATE TEMPORARY TABLE IF NOT EXISTS price_rollups_staging '
+      '(LIKE price_rollups) ON COMMIT DELETE ROWS')
+  cur.execute(
+      'CREATE TEMPORARY TABLE IF NOT EXISTS price_histograms_staging '
+      '(LIKE price_histograms) ON COMMIT DELETE ROWS')
+  # Each key is formatted once and shared by its histogram rows.
+  rollup_lines = []
+  histogram_lines = []
+  for key, rollup in new_rollups.items():
+    key_text = _copy_line(key)
+    rollup_lines.append('{}\t{}'.format(key_text, _copy_line(
+        getattr(rollup, column) for column in ROLLUP_COLUMNS)))
+    for bucket, count in rollup.price_histogram.items():
+      histogram_lines.append('{}\t{}\t{}'.format(key_text, bucket, count))
+  _copy_lines(
+      cur, 'price_rollups_staging', ROLLUP_KEY_COLUMNS + ROLLUP_COLUMNS,
+      rollup_lines)
+  _copy_lines(
+      cur, 'price_histograms_staging',
+      ROLLUP_KEY_COLUMNS + ('bucket', 'price_count'), histogram_lines)
+  # Ordered, so that concurrent uploads lock rollup rows in the same order
+  # instead of deadlocking.
+  columns = ', '.join(ROLLUP_KEY_COLUMNS + ROLLUP_COLUMNS)
+  cur.execute(
+      'INSERT INTO price_rollups ({columns}) '
+      'SELECT {columns} FROM price_rollups_staging '
+      'ORDER BY item_id, period, period_start, is_selling '
+      'ON CONFLICT (item_id, period, period_start, is_selling) DO UPDATE SET '
+      '  auction_count = price_rollups.auction_count + '
+      '    EXCLUDED.auction_count, '
+      '  price_count = price_rollups.price_count + EXCLUDED.price_count, '
+      '  min_price = LEAST(price_rollups.min_price, EXCLUDED.min_price), '
+      '  max_price = GREATEST(price_rollups.max_price, EXCLUDED.max_price), '
+      '  price_sum = price_rollups.price_sum + EXCLUDED.price_sum'.format(
+          columns=columns))
+  columns = ', '.join(ROLLUP_KEY_COLUMNS + ('bucket', 'price_count'))
+  cur.execute(
+      'INSERT INTO price_histograms ({columns}) '
+      'SELECT {columns} FROM price_histograms_staging '
+      'ORDER BY item_id, period, period_start, is_selling, bucket '
+      'ON CONFLICT (item_id, period, period_start, is_selling, bucket) '
+      'DO UPDATE SET '
+      '  price_count = price_histograms.price_count + '
+      '    EXCLUDED.price_count'.format(columns=columns))
+  # Rows are only deleted on commit, so clear them out in case the caller adds
+  # more in the same transaction.
+  cur.execute('TRUNCATE price_rollups_staging, price_histograms_staging')
+
+
+def rebuild_rollups(start, end):
+  """Recomputes the rollups for the whole days from start up to end.
+
+  This is for auctions that were loaded without going through the rollups,
+  like ones loaded before the rollup tables existed.  Uploads wait until it's
+  done, so rebuild big ranges a few days at a time.  Returns the number of
+  auctions rolled up.
+  """
+  start = rollups.period_start(start, 'day')
+  end = rollups.period_start(end, 'day')
+  with transaction() as cur:
+    # Keep uploads from adding to the rollups while they're being recomputed,
+    # or their auctions could be counted twice.
+    cur.execute(
+        'LOCK TABLE price_rollups, price_histograms IN EXCLUSIVE MODE')
+    for table in ('price_rollups', 'price_histograms'):
       cur.execute(
-          'INSERT INTO clean_auctions ( '
-          '  raw_auction_id, character_id, item_id, timestamp, is_selling, '
-          '  price) '
-          'VALUES (%s, %s, %s, %s, %s, %s)',
-          (raw_auction_id, character_id, item_id, timestamp, is_selling, price))
+          'DELETE FROM {} '
+          'WHERE period_start >= %s AND period_start < %s'.format(table),
+          (start, end))
+    # A server-side cursor, so that the auctions are streamed rather than all
+    # loaded into memory.  Only the rollups are kept.
+    with cur.connection.cursor('rebuild_rollups') as auctions:
+      auctions.itersize = BULK_PAGE_SIZE * 10
+      auctions.execute(
+          'SELECT item_id, timestamp, is_selling, price FROM clean_auctions '
+          'WHERE timestamp >= %s AND timestamp < %s',
+          (start, end))
+      new_rollups = rollups.aggregate(auctions)
+    _upsert_rollups(cur, new_rollups)
+  # Every auction is in exactly one daily rollup.  The cursor's rownumber
+  # can't be used, since it starts over with each fetch.
+  return sum(
+      rollup.auction_count
+      for (_, _, period, _), rollup in new_rollups.items() if period == 'day')
+
+
+def recompute_rollups_with_cursor(cur, item_days):
+  """Recomputes the rollups of (item_id, day) pairs from clean_auctions.
+
+  This is for when clean auctions are deleted, since they can't be taken back
+  out of a rollup's min and max.  Uploads that add to the same rollups wait
+  for the deleted rows, and then add their own auctions on top.
+  """
+  if not item_days:
+    return
+  item_ids, days = zip(*sorted(item_days))
+  keys = 'unnest(%s::integer[], %s::timestamp[]) AS keys (item_id, day)'
+  for table in ('price_rollups', 'price_histograms'):
+    cur.execute(
+        'DELETE FROM {table} USING {keys} '
+        'WHERE {table}.item_id = keys.item_id AND '
+        '      {table}.period_start >= keys.day AND '
+        "      {table}.period_start < keys.day + interval '1 day'".format(
+            table=table, keys=keys),
+        (list(item_ids), list(days)))
+  cur.execute(
+      'SELECT clean_auctions.item_id, clean_auctions.timestamp, '
+      '  clean_auctions.is_selling, clean_auctions.price '
+      'FROM clean_auctions JOIN {keys} '
+      'ON clean_auctions.item_id = keys.item_id AND '
+      '   clean_auctions.timestamp >= keys.day AND '
+      "   clean_auctions.timestamp < keys.day + interval '1 day'".format(
+          keys=keys),
+      (list(item_ids), list(days)))
+  _upsert_rollups(cur, rollups.aggregate(cur))
+
+
+def get_price_rollups(item_id, period, start, end):
+  """Returns (is_selling, period_start, Rollup) for item_id in a time range.
+
+  Only periods that start within [start, end) are included.
+  """
+  with transaction() as cur:
+    cur.execute(
+        'SELECT is_selling, period_start, ' + ', '.join(ROLLUP_COLUMNS) + ' '
+        'FROM price_rollups '
+        'WHERE item_id = %s AND period = %s '
+        '  AND period_start >= %s AND period_start < %s '
+        'ORDER BY period_start, is_selling',
+        (item_id, period, start, end))
+    results = collections.OrderedDict(
+        ((period_start, is_selling), rollups.Rollup(*values))
+        for is_selling, period_start, *values in cur.fetchall())
+    cur.execute(
+        'SELECT is_selling, period_start, bucket, price_count '
+        'FROM price_histograms '
+        'WHERE item_id = %s AND period = %s '
+        '  AND period_start >= %s AND period_start < %s',
+        (item_id, period, start, end))
+    for is_selling, period_start, bucket, count in cur.fetchall():
+      rollup = results.get((period_start, is_selling))
+      if rollup:
+        rollup.price_histogram[bucket] = count
+  return [
+      (is_selling, period_start, rollup)
+      for (period_start, is_selling), rollup in results.items()]
+
+
+def _copy_rows(cur, table, columns, rows):
+  _copy_lines(cur, table, columns, [_copy_line(row) for row in rows])
+
+
+def _copy_lines(cur, table, columns, lines):
+  """COPYs lines that were already formatted with _copy_line."""
+  if not lines:
+    return
+  data = io.StringIO()
+  for line in lines:
+    data.write(line)
+    data.write('\n')
+  data.seek(0)
+  cur.copy_expert(
+      'COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns)), data)
+
+
+def _copy_line(values):
+  return '\t'.join(_copy_value(value) for value in values)
+
+
+# Characters that have to be escaped in COPY's text format.
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value):
+  """Formats a value for COPY's text format."""
+  if value is None:
+    return '\\N'
+  if isinstance(value, bool):
+    return 't' if value else 'f'
+  if isinstance(value, datetime.datetime):
+    return value.isoformat(' ')
+  if isinstance(value, str):
+    return value.translate(COPY_ESCAPES)
+  return str(value)
+
+
+def iter_raw_auctions(after_id, names=None, batch_size=BULK_PAGE_SIZE * 10):
+  """Yields lists of raw auctions with IDs above after_id, in ID order.
+
+  Each raw auction is (id, timestamp, character_id, message).  If names are
+  given, only messages that contain one of them, ignoring case, are returned.
+  The auctions are streamed with a server-side cursor, so any number of them
+  can be read.
+  """
+  where = 'id > %s'
+  params = [after_id]
+  if names:
+    where += ' AND message ILIKE ANY(%s)'
+    params.append(['%' + _escape_like(name) + '%' for name in names])
+  with transaction() as cur:
+    with cur.connection.cursor('iter_raw_auctions') as raw_auctions:
+      raw_auctions.itersize = batch_size
+      raw_auctions.execute(
+          'SELECT id, timestamp, character_id, message FROM raw_auctions '
+          'WHERE {} ORDER BY id'.format(where),
+          params)
+      while True:
+        rows = raw_auctions.fetchmany(batch_size)
+        if not rows:
+          return
+        yield rows
+
+
+def _escape_like(text):
+  return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_clean_auctions_with_cursor(cur, raw_auction_ids):
+  """Returns the clean auctions parsed from some raw auctions, in ID order.
+
+  Each clean auction is (id, raw_auction_id, item_id, timestamp, is_selling,
+  price).
+  """
+  cur.execute(
+      'SELECT id, raw_auction_id, item_id, timestamp, is_selling, price '
+      'FROM clean_auctions WHERE raw_auction_id = ANY(%s) ORDER BY id',
+      (list(raw_auction_ids),))
+  return cur.fetchall()
+
+
+def replace_clean_auctions_with_cursor(cur, deleted, added):
+  """Deletes some clean auctions and adds others, keeping the rollups right.
+
+  deleted is a list of rows from get_clean_auctions_with_cursor, and added is
+  a list of rows like add_clean_auctions_bulk_with_cursor takes.
+  """
+  if deleted:
+    cur.execute(
+        'DELETE FROM clean_auctions WHERE id = ANY(%s)',
+        ([row[0] for row in deleted],))
+  _copy_rows(
+      cur, 'clean_auctions',
+      ('raw_auction_id', 'character_id', 'item_id', 'timestamp', 'is_selling',
+       'price'),
+      added)
+  if not deleted:
+    update_rollups_with_cursor(
+        cur,
+        [(item_id, timestamp, is_selling, price)
+         for _, _, item_id, timestamp, is_selling, price in added])
+    return
+  # Everything touched is recomputed, which picks up the added rows too.
+  item_days = set()
+  for _, _, item_id, timestamp, _, _ in deleted + added:
+    item_days.add((item_id, rollups.period_start(timestamp, 'day')))
+  recompute_rollups_with_cursor(cur, item_days)
+
+
+def get_recent_auctions(item_id, limit):
+  """Returns the newest auctions of an item, newest first.
+
+  Each auction is (timestamp, character name, is_selling, price, message).
+  """
+  with transaction() as cur:
+    cur.execute(
+        'SELECT clean_auctions.timestamp, characters.name, '
+        '  clean_auctions.is_selling, clean_auctions.price, '
+        '  raw_auctions.message '
+        'FROM clean_auctions '
+        'JOIN characters ON characters.id = clean_auctions.character_id '
+        'JOIN raw_auctions ON raw_auctions.id = clean_auctions.raw_auction_id '
+        'WHERE clean_auctions.item_id = %s '
+        'ORDER BY clean_auctions.timestamp DESC '
+        'LIMIT %s',
+        (item_id, limit))
+    return cur.fetchall()
+
 
 def get_all_items():
-  with get_or_create_connection() as conn:
-    with conn.cursor() as cur:
-      cur.execute('SELECT id, canonical_name FROM items')
-      return cur.fetchall()
+  with transaction() as cur:
+    cur.execute('SELECT id, canonical_name FROM items')
+    return cur.fetchall()
+
+
+def get_all_item_names():
+  """Returns (item_id, name) for every alternate item name."""
+  with transaction() as cur:
+    cur.execute('SELECT item_id, name FROM item_names')
+    return cur.fetchall()
+
+
+def get_items_version():
+  """Returns a string that changes whenever items or item_names change."""
+  with transaction() as cur:
+    cur.execute("""
+        SELECT
+          (SELECT md5(coalesce(string_agg(
+              id || ':' || coalesce(canonical_name, ''), E'\\n' ORDER BY id),
+              '')) FROM items),
+          (SELECT md5(coalesce(string_agg(
+              id || ':' || item_id || ':' || coalesce(name, ''), E'\\n'
+              ORDER BY id), '')) FROM item_names)""")
+    return '-'.join(cur.fetchone())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import datetime
+import threading
+import unittest
+
+import psycopg2
+import psycopg2.extensions
+
+import db
+
+
+NOW = datetime.datetime(2017, 1, 2, 13, 45, 35)
+
+
+class FakeConnection(object):
+
+  def __init__(self):
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.connections = []
+    self.connect_error = None
+
+  def connect(self):
+    if self.connect_error:
+      raise self.connect_error
+    conn = FakeConnection()
+    self.connections.append(conn)
+    return conn
+
+  def test_reuses_connections(self):
+    pool = db.ConnectionPool(2, connect=self.connect)
+    with pool.connection() as first:
+      pass
+    with pool.connection() as second:
+      self.assertIs(second, first)
+    self.assertEqual(len(self.connections), 1)
+
+  def test_checkout_blocks_at_size(self):
+    pool = db.ConnectionPool(1, connect=self.connect)
+    checked_out = threading.Event()
+    with pool.connection() as first:
+      def check_out():
+        with pool.connection():
+          checked_out.set()
+      thread = threading.Thread(target=check_out)
+      thread.start()
+      self.assertFalse(checked_out.wait(0.1))
+    thread.join()
+    self.assertTrue(checked_out.is_set())
+    self.assertEqual(self.connections, [first])
+
+  def test_broken_connection_is_replaced(self):
+    pool = db.ConnectionPool(1, connect=self.connect)
+    with self.assertRaises(psycopg2.OperationalError):
+      with pool.connection() as first:
+        raise psycopg2.OperationalError('server closed the connection')
+    self.assertTrue(first.closed)
+    with pool.connection() as second:
+      self.assertIsNot(second, first)
+
+  def test_rolled_back_connection_is_kept(self):
+    pool = db.ConnectionPool(1, connect=self.connect)
+    with self.assertRaises(psycopg2.extensions.TransactionRollbackError):
+      with pool.connection() as first:
+        raise psycopg2.extensions.TransactionRollbackError('deadlock')
+    self.assertFalse(first.closed)
+    with pool.connection() as second:
+      self.assertIs(second, first)
+
+  def test_failed_connect_gives_back_its_slot(self):
+    pool = db.ConnectionPool(1, connect=self.connect)
+    self.connect_error = psycopg2.OperationalError('connection refused')
+    with self.assertRaises(psycopg2.OperationalError):
+      with pool.connection():
+        pass
+    self.connect_error = None
+    with pool.connection() as conn:
+      self.assertEqual(self.connections, [conn])
+
+  def test_close(self):
+    pool = db.ConnectionPool(2, connect=self.connect)
+    with pool.connection() as conn:
+      pass
+    pool.close()
+    self.assertTrue(conn.closed)
+
+
+class DedupRawRowsTest(unittest.TestCase):
+
+  def test_duplicates_within_window(self):
+    rows = [
+        (NOW, 1, 'WTS Ale'),
+        (NOW + datetime.timedelta(seconds=59), 1, 'WTS Ale'),
+        (NOW, 2, 'WTS Ale'),
+        (NOW, 1, 'WTB Ale'),
+        (NOW, 1, 'WTS Ale'),
+    ]
+    self.assertEqual(
+        db._dedup_raw_rows(rows), [True, False, True, True, False])
+
+  def test_window_boundary(self):
+    rows = [
+        (NOW, 1, 'WTS Ale'),
+        (NOW + db.DUPLICATE_WINDOW, 1, 'WTS Ale'),
+        (NOW - db.DUPLICATE_WINDOW, 1, 'WTS Ale'),
+        (NOW + datetime.timedelta(seconds=30), 1, 'WTS Ale'),
+    ]
+    self.assertEqual(db._dedup_raw_rows(rows), [True, True, True, False])
+
+  def test_compares_with_kept_rows_only(self):
+    # Like add_raw_auction: the last row is a minute after the only one kept.
+    rows = [
+        (NOW, 1, 'WTS Ale'),
+        (NOW + datetime.timedelta(seconds=50), 1, 'WTS Ale'),
+        (NOW + datetime.timedelta(seconds=100), 1, 'WTS Ale'),
+    ]
+    self.assertEqual(db._dedup_raw_rows(rows), [True, False, True])
+
+
+class CopyValueTest(unittest.TestCase):
+
+  def test_escapes(self):
+    self.assertEqual(
+        db._copy_value('WTS\tAle\\5\nCoS\r'), 'WTS\\tAle\\\\5\\nCoS\\r')
+
+  def test_values(self):
+    self.assertEqual(db._copy_value(None), '\\N')
+    self.assertEqual(db._copy_value('\\N'), '\\\\N')
+    self.assertEqual(db._copy_value(True), 't')
+    self.assertEqual(db._copy_value(False), 'f')
+    self.assertEqual(db._copy_value(5000), '5000')
+    self.assertEqual(db._copy_value(NOW), '2017-01-02 13:45:35')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import datetime
+import locale
+import re
+
+import dateutil.parser
+
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+# Log files are named after the character, like eqlog_Toon_project1999.txt.
+LOG_NAMES_REGEX = re.compile(r'eqlog_(.*)_project1999.txt')
+# The game writes its logs in the system's encoding.
+LOG_ENCODING = locale.getpreferredencoding(False)
+# Log lines come in bursts that share a timestamp, so only a handful of recent
+# results are worth keeping.
+CACHE_SIZE = 16
+
+_CACHE = {}
+
+
+def parse_timestamp(timestamp_str):
+  """Parses an EQ log timestamp like 'Jan 01 13:45:35 2017' into a datetime.
+
+  Anything that isn't in exactly that format is handed to dateutil instead.
+  """
+  result = _CACHE.get(timestamp_str)
+  if result is None:
+    try:
+      result = parse_fixed_format(timestamp_str)
+    except (KeyError, ValueError):
+      result = dateutil.parser.parse(timestamp_str)
+    if len(_CACHE) >= CACHE_SIZE:
+      _CACHE.clear()
+    _CACHE[timestamp_str] = result
+  return result
+
+
+def parse_fixed_format(timestamp_str):
+  """Parses 'Jan 01 13:45:35 2017' or raises ValueError or KeyError."""
+  s = timestamp_str
+  if (len(s) != 20 or s[3] != ' ' or s[6] != ' ' or s[9] != ':' or
+      s[12] != ':' or s[15] != ' '):
+    raise ValueError('Not an EQ timestamp: ' + s)
+  return datetime.datetime(
+      int(s[16:20]), MONTHS[s[0:3]], int(s[4:6]),
+      int(s[7:9]), int(s[10:12]), int(s[13:15]))
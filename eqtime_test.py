@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import datetime
+import unittest
+
+import eqtime
+
+
+class EqTimeTest(unittest.TestCase):
+
+  def test_parse_timestamp(self):
+    expected = datetime.datetime(2017, 1, 2, 13, 45, 35)
+    self.assertEqual(eqtime.parse_timestamp('Jan 02 13:45:35 2017'), expected)
+    # The second call is served from the cache.
+    self.assertEqual(eqtime.parse_timestamp('Jan 02 13:45:35 2017'), expected)
+
+  def test_parse_timestamp_falls_back_to_dateutil(self):
+    expected = datetime.datetime(2017, 1, 2, 13, 45, 35)
+    self.assertEqual(eqtime.parse_timestamp('Jan 2 13:45:35 2017'), expected)
+    self.assertEqual(eqtime.parse_timestamp('2017-01-02 13:45:35'), expected)
+
+  def test_parse_fixed_format_rejects_other_formats(self):
+    with self.assertRaises(ValueError):
+      eqtime.parse_fixed_format('Jan 2 13:45:35 2017')
+    with self.assertRaises(KeyError):
+      eqtime.parse_fixed_format('Foo 02 13:45:35 2017')
+    with self.assertRaises(ValueError):
+      eqtime.parse_fixed_format('Feb 30 13:45:35 2017')
+
+  def test_cache_is_bounded(self):
+    for second in range(eqtime.CACHE_SIZE * 2):
+      eqtime.parse_timestamp('Jan 02 13:45:{:02d} 2017'.format(second % 60))
+    self.assertLessEqual(len(eqtime._CACHE), eqtime.CACHE_SIZE)
+
+
+if __name__ == '__main__':
+  unittest.main()
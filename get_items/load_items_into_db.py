@@ -14,6 +14,16 @@ def main():
           cur.execute(
               'INSERT INTO items (wiki_link, canonical_name) VALUES (%s, %s)',
               (row['wiki_link'], row['name']))
+  # Short names that people use in auctions, like CoS for Cloak of Shadows.
+  with open('aliases.csv', 'r', newline='') as csv_file:
+    csv_reader = csv.DictReader(csv_file)
+    with db.connect() as conn:
+      with conn.cursor() as cur:
+        for row in csv_reader:
+          cur.execute(
+              'INSERT INTO item_names (item_id, name) '
+              'SELECT id, %s FROM items WHERE canonical_name = %s',
+              (row['alias'], row['name']))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+
+
+class LruCache(object):
+  """A bounded, thread-safe mapping that evicts the least recently used key."""
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key, default=None):
+    with self._lock:
+      try:
+        value = self._entries[key]
+      except KeyError:
+        self.misses += 1
+        return default
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import lru
+
+
+class LruCacheTest(unittest.TestCase):
+
+  def test_get_and_put(self):
+    cache = lru.LruCache(2)
+    cache.put('a', 1)
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(cache.get('b'), None)
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+  def test_evicts_least_recently_used(self):
+    cache = lru.LruCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(cache.get('b'), None)
+    self.assertEqual(cache.get('c'), 3)
+    self.assertEqual(len(cache), 2)
+
+  def test_clear(self):
+    cache = lru.LruCache(2)
+    cache.put('a', 1)
+    cache.clear()
+    self.assertEqual(cache.get('a'), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
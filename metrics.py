@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import bisect
+import threading
+import time
+
+
+# Latency buckets in seconds, from 10us to 10s.
+LATENCY_BUCKETS = (
+    0.00001, 0.00003, 0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1,
+    3, 10)
+
+
+def format_labels(label_names, label_values, extra=''):
+  labels = [
+      '{}="{}"'.format(name, escape_label(str(value)))
+      for name, value in zip(label_names, label_values)]
+  if extra:
+    labels.append(extra)
+  if not labels:
+    return ''
+  return '{' + ','.join(labels) + '}'
+
+
+def escape_label(value):
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return str(value)
+
+
+class Metric(object):
+  """A metric family, with one child per combination of label values.
+
+  Children are created under a lock the first time they're used, and are
+  updated without one.  Updates are plain += under the GIL, so in the rare
+  case that two threads race on the same child an increment can be lost,
+  which is fine for monitoring.
+  """
+
+  type_name = None
+
+  def __init__(self, name, help_text, label_names=()):
+    self.name = name
+    self.help_text = help_text
+    self.label_names = tuple(label_names)
+    self._children = {}
+    self._lock = threading.Lock()
+    if not self.label_names:
+      self._children[()] = self._new_child()
+
+  def labels(self, *label_values):
+    child = self._children.get(label_values)
+    if child is None:
+      with self._lock:
+        child = self._children.setdefault(label_values, self._new_child())
+    return child
+
+  def _new_child(self):
+    raise NotImplementedError
+
+  def render(self):
+    lines = [
+        '# HELP {} {}'.format(self.name, self.help_text),
+        '# TYPE {} {}'.format(self.name, self.type_name),
+    ]
+    for label_values, child in sorted(self._children.items()):
+      lines.extend(self._render_child(label_values, child))
+    return lines
+
+
+class CounterChild(object):
+  __slots__ = ('value',)
+
+  def __init__(self):
+    self.value = 0
+
+  def inc(self, amount=1):
+    self.value += amount
+
+
+class Counter(Metric):
+  type_name = 'counter'
+
+  def _new_child(self):
+    return CounterChild()
+
+  def inc(self, amount=1):
+    self._children[()].value += amount
+
+  def _render_child(self, label_values, child):
+    yield '{}{} {}'.format(
+        self.name, format_labels(self.label_names, label_values),
+        format_number(child.value))
+
+
+class HistogramChild(object):
+  __slots__ = ('bounds', 'counts', 'sum')
+
+  def __init__(self, bounds):
+    self.bounds = bounds
+    # One count per bucket, plus one for everything above the last bound.
+    self.counts = [0] * (len(bounds) + 1)
+    self.sum = 0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.sum += value
+
+  def time(self):
+    return Timer(self)
+
+
+class Histogram(Metric):
+  type_name = 'histogram'
+
+  def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+    self.buckets = tuple(buckets)
+    super().__init__(name, help_text, label_names)
+
+  def _new_child(self):
+    return HistogramChild(self.buckets)
+
+  def observe(self, value):
+    self._children[()].observe(value)
+
+  def time(self):
+    return Timer(self._children[()])
+
+  def _render_child(self, label_values, child):
+    cumulative = 0
+    for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+      cumulative += count
+      yield '{}_bucket{} {}'.format(
+          self.name,
+          format_labels(
+              self.label_names, label_values,
+              'le="{}"'.format(format_number(bound))),
+          cumulative)
+    labels = format_labels(self.label_names, label_values)
+    yield '{}_sum{} {}'.format(self.name, labels, format_number(child.sum))
+    yield '{}_count{} {}'.format(self.name, labels, cumulative)
+
+
+class Gauge(Metric):
+  """A value that is read from a function whenever the metrics are scraped.
+
+  type_name can be 'counter' for values that only go up, like the hit count
+  of a cache.
+  """
+
+  def __init__(self, name, help_text, function, type_name='gauge'):
+    self.function = function
+    self.type_name = type_name
+    super().__init__(name, help_text)
+
+  def _new_child(self):
+    return None
+
+  def _render_child(self, label_values, child):
+    yield '{} {}'.format(self.name, format_number(self.function()))
+
+
+class Timer(object):
+  """Observes how long a with block takes, in seconds."""
+
+  __slots__ = ('histogram', 'start')
+
+  def __init__(self, histogram):
+    self.histogram = histogram
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry(object):
+
+  def __init__(self):
+    self._metrics = []
+
+  def register(self, metric):
+    self._metrics.append(metric)
+    return metric
+
+  def counter(self, name, help_text, label_names=()):
+    return self.register(Counter(name, help_text, label_names))
+
+  def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+    return self.register(Histogram(name, help_text, label_names, buckets))
+
+  def gauge(self, name, help_text, function, type_name='gauge'):
+    return self.register(Gauge(name, help_text, function, type_name))
+
+  def render(self):
+    """Returns every metric in the Prometheus text format."""
+    lines = []
+    for metric in self._metrics:
+      lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
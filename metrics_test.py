@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = metrics.Registry()
+
+  def test_counter(self):
+    counter = self.registry.counter('requests_total', 'Requests.', ['path'])
+    counter.labels('/a').inc()
+    counter.labels('/a').inc(2)
+    counter.labels('/b"').inc()
+    self.assertEqual(self.registry.render(), '\n'.join([
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{path="/a"} 3',
+        'requests_total{path="/b\\""} 1',
+    ]) + '\n')
+
+  def test_histogram(self):
+    histogram = self.registry.histogram(
+        'seconds', 'Time.', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+    lines = self.registry.render().splitlines()
+    self.assertEqual(lines[2:], [
+        'seconds_bucket{le="0.1"} 2',
+        'seconds_bucket{le="1"} 2',
+        'seconds_bucket{le="+Inf"} 3',
+        'seconds_sum 5.15',
+        'seconds_count 3',
+    ])
+
+  def test_timer(self):
+    histogram = self.registry.histogram('seconds', 'Time.', ['stage'])
+    with histogram.labels('parse').time():
+      pass
+    self.assertEqual(sum(histogram.labels('parse').counts), 1)
+
+  def test_gauge(self):
+    self.registry.gauge('depth', 'Queue depth.', lambda: 7)
+    self.assertIn('depth 7\n', self.registry.render())
+
+
+if __name__ == '__main__':
+  unittest.main()
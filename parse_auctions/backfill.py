@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import time
+
+import db
+import eqtime
+from parse_auctions import parser
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROGRESS_PATH = os.path.join(SCRIPT_DIR, '.backfill-progress.json')
+
+# The number of log lines parsed and written in each batch.
+DEFAULT_BATCH_LINES = 20000
+# Each batch is split into chunks of this many messages for the workers.
+PARSE_CHUNK_SIZE = 500
+# How often to print throughput.
+REPORT_INTERVAL_SECONDS = 5
+
+WORKER_PARSER = None
+
+
+def init_worker():
+  # Each worker builds its own matcher once, rather than having one pickled
+  # and sent along with every batch.
+  global WORKER_PARSER
+  WORKER_PARSER = parser.Parser()
+
+
+def parse_auctions(auctions):
+  """Parses a list of auction messages in a worker process.
+
+  Returns a list with one list of (item_id, is_selling, price) per message.
+  """
+  return [
+      [(item.item_id, item.is_selling, item.price) for item in items]
+      for items in WORKER_PARSER.parse_many(auctions)]
+
+
+class Progress(object):
+  """Remembers which log files have been completely loaded.
+
+  A file that was only partly loaded gets loaded again from the start, which
+  is safe because duplicate auctions are skipped just like they are for
+  uploads.
+  """
+
+  def __init__(self, path=PROGRESS_PATH):
+    self.path = path
+    self.done = {}
+    if os.path.isfile(path):
+      with open(path, 'r') as f:
+        self.done = json.load(f)
+
+  def is_done(self, path):
+    stat = os.stat(path)
+    return self.done.get(path) == [stat.st_size, stat.st_mtime]
+
+  def mark_done(self, path):
+    stat = os.stat(path)
+    self.done[path] = [stat.st_size, stat.st_mtime]
+    temp_path = self.path + '.tmp'
+    with open(temp_path, 'w') as f:
+      json.dump(self.done, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp_path, self.path)
+
+
+class Stats(object):
+
+  def __init__(self):
+    self.start = time.monotonic()
+    self.last_report = self.start
+    self.lines = 0
+    self.auctions = 0
+    self.added = 0
+
+  def maybe_report(self, force=False):
+    now = time.monotonic()
+    if not force and now - self.last_report < REPORT_INTERVAL_SECONDS:
+      return
+    self.last_report = now
+    elapsed = max(now - self.start, 1e-9)
+    print('{:,} lines ({:,.0f} lines/sec), {:,} auctions, {:,} new'.format(
+        self.lines, self.lines / elapsed, self.auctions, self.added))
+
+
+def read_auctions(path, character, time_offset):
+  """Yields (timestamp, character, message) for each auction line in the log.
+
+  Lines that aren't auctions yield None, so that they can still be counted.
+  """
+  with open(path, 'rb') as f:
+    for line in f:
+      line = line.decode(eqtime.LOG_ENCODING, errors='replace').rstrip('\r\n')
+      # Lines like: [Sun Jan 01 13:45:35 2017] You auction, 'WTS Ale'
+      line = line.replace(
+          ' You auction, ', ' {} auctions, '.format(character), 1)
+      log_timestamp, seller, auction = parser.split_line(line)
+      if not log_timestamp:
+        yield None
+        continue
+      try:
+        timestamp = parser.parse_timestamp_normalized(
+            log_timestamp, time_offset)
+      except (ValueError, OverflowError):
+        yield None
+        continue
+      yield timestamp, seller, auction
+
+
+def batches(iterable, size):
+  batch = []
+  for value in iterable:
+    batch.append(value)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def write_batch(auctions, parsed_items):
+  """Writes one batch of auctions and their parsed items in a transaction.
+
+  Returns the number of auctions that weren't already in the db.
+  """
+  with db.transaction() as cur:
+    character_ids = db.get_or_create_characters_with_cursor(
+        cur, [character for _, character, _ in auctions])
+    raw_rows = [
+        (timestamp, character_ids[character], auction)
+        for timestamp, character, auction in auctions]
+    raw_ids = db.add_raw_auctions_bulk_with_cursor(cur, raw_rows, use_copy=True)
+    clean_rows = []
+    for (timestamp, character_id, _), raw_id, items in zip(
+        raw_rows, raw_ids, parsed_items):
+      if not raw_id:
+        continue
+      for item_id, is_selling, price in items:
+        clean_rows.append(
+            (raw_id, character_id, item_id, timestamp, is_selling, price))
+    db.add_clean_auctions_bulk_with_cursor(cur, clean_rows)
+  return sum(1 for raw_id in raw_ids if raw_id)
+
+
+def backfill_file(pool, path, character, time_offset, batch_lines, stats):
+  """Loads a log file, parsing each batch while the last one is written."""
+  pending = None
+  for batch in batches(
+      read_auctions(path, character, time_offset), batch_lines):
+    stats.lines += len(batch)
+    auctions = [auction for auction in batch if auction]
+    messages = [message for _, _, message in auctions]
+    chunks = list(batches(messages, PARSE_CHUNK_SIZE))
+    current = (auctions, pool.map_async(parse_auctions, chunks))
+    if pending:
+      write_parsed(pending, stats)
+    pending = current
+  if pending:
+    write_parsed(pending, stats)
+
+
+def write_parsed(pending, stats):
+  auctions, result = pending
+  parsed_items = [items for chunk in result.get() for items in chunk]
+  stats.auctions += len(auctions)
+  stats.added += write_batch(auctions, parsed_items)
+  stats.maybe_report()
+
+
+def parse_args():
+  arg_parser = argparse.ArgumentParser(
+      description='Loads auctions from old eqlog files into the db.')
+  arg_parser.add_argument('log_dir', help='A directory of eqlog files.')
+  arg_parser.add_argument(
+      '--workers', type=int, default=os.cpu_count(),
+      help='The number of parser processes.')
+  arg_parser.add_argument(
+      '--batch-lines', type=int, default=DEFAULT_BATCH_LINES,
+      help='The number of log lines written per transaction.')
+  arg_parser.add_argument(
+      '--time-offset-minutes', type=float, default=0,
+      help='Added to log times to get server time, like the offset the '
+           'server computes for live uploads.')
+  arg_parser.add_argument('--progress-file', default=PROGRESS_PATH)
+  return arg_parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  time_offset = datetime.timedelta(minutes=args.time_offset_minutes)
+  progress = Progress(args.progress_file)
+  stats = Stats()
+  with multiprocessing.Pool(args.workers, initializer=init_worker) as pool:
+    for name in sorted(os.listdir(args.log_dir)):
+      match = eqtime.LOG_NAMES_REGEX.match(name)
+      if not match:
+        continue
+      path = os.path.abspath(os.path.join(args.log_dir, name))
+      if progress.is_done(path):
+        print('Already loaded: ' + name)
+        continue
+      print('Loading: ' + name)
+      backfill_file(
+          pool, path, match.group(1), time_offset, args.batch_lines, stats)
+      progress.mark_done(path)
+  stats.maybe_report(force=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from parse_auctions import backfill
+
+
+class ReadAuctionsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+    self.path = os.path.join(self.temp_dir.name, 'eqlog_Me_project1999.txt')
+
+  def test_read_auctions(self):
+    with open(self.path, 'w') as f:
+      f.write(
+          "[Sat Jan 07 17:43:44 2017] You say, 'Hail'\n"
+          "[Sat Jan 07 17:46:44 2017] Junque auctions, 'WTS Swarmcaller'\r\n"
+          "[Sat Jan 07 17:46:44 2017] You auction, 'WTS Ale 5k'\n"
+          "[Thu Feb 30 17:47:00 2017] Toon auctions, 'WTB Ale'\n"
+          "[Sat Jxn 07 17:47:00 2017] Toon auctions, 'WTB Ale'\n")
+    offset = datetime.timedelta(minutes=1)
+    self.assertEqual(
+        list(backfill.read_auctions(self.path, 'Me', offset)), [
+            None,
+            (datetime.datetime(2017, 1, 7, 17, 47, 44), 'Junque',
+             'WTS Swarmcaller'),
+            (datetime.datetime(2017, 1, 7, 17, 47, 44), 'Me', 'WTS Ale 5k'),
+            None,
+            None,
+        ])
+
+
+class BatchesTest(unittest.TestCase):
+
+  def test_batches(self):
+    self.assertEqual(
+        list(backfill.batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+    self.assertEqual(list(backfill.batches(range(4), 2)), [[0, 1], [2, 3]])
+    self.assertEqual(list(backfill.batches([], 2)), [])
+
+
+class ProgressTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+    self.progress_path = os.path.join(self.temp_dir.name, 'progress.json')
+    self.log_path = os.path.join(self.temp_dir.name, 'eqlog_Me_project1999.txt')
+    with open(self.log_path, 'w') as f:
+      f.write("[Sat Jan 07 17:46:44 2017] You auction, 'WTS Ale 5k'\n")
+
+  def test_mark_done(self):
+    progress = backfill.Progress(self.progress_path)
+    self.assertFalse(progress.is_done(self.log_path))
+    progress.mark_done(self.log_path)
+    self.assertTrue(progress.is_done(self.log_path))
+    self.assertTrue(
+        backfill.Progress(self.progress_path).is_done(self.log_path))
+
+  def test_changed_file_is_not_done(self):
+    progress = backfill.Progress(self.progress_path)
+    progress.mark_done(self.log_path)
+    with open(self.log_path, 'a') as f:
+      f.write("[Sat Jan 07 17:47:00 2017] Toon auctions, 'WTB Ale'\n")
+    self.assertFalse(
+        backfill.Progress(self.progress_path).is_done(self.log_path))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import array
+import bisect
+import struct
+
+
+# The tables of a matcher are stored one after another in a single buffer of
+# native 32-bit ints, after a header, so that a matcher can be written to a file
+# and memory-mapped by many processes at once.  The tables are, in order:
+#   chars: the character leading to each node's first child, or NO_CHILD
+#   fail, length, output, value: one entry per node
+#   branch_start: for each node, where its other children start in the branch
+#     tables, plus one final entry for the end of the last node's
+#   branch_chars, branch_nodes: the other children, sorted by character
+MAGIC = b'P99M'
+LAYOUT_VERSION = 1
+HEADER = struct.Struct('=4sIII')
+NODE_TABLES = 5
+NO_CHILD = -1
+
+
+class Matcher(object):
+  """An Aho-Corasick automaton that finds many patterns in a single pass.
+
+  Patterns are plain strings mapped to 32-bit ints.  The automaton is built
+  once and can then scan any number of strings in time linear in the length of
+  the string plus the number of matches, no matter how many patterns there
+  are.
+
+  Nodes are numbered depth first, so the first child of node n is always node
+  n + 1.  Most nodes in a dictionary of item names have exactly one child, so
+  that transition is stored as a single character, and only the few nodes with
+  more children have entries in the branch tables.  Everything is kept in flat
+  tables in one buffer, which from_buffer can use without copying.
+  """
+
+  def __init__(self, patterns):
+    # Build a plain trie of dicts first, then pack it.
+    goto = [{}]
+    length = [0]
+    value = {}
+    for pattern, pattern_value in patterns.items():
+      if pattern:
+        node = self._add_pattern(goto, length, pattern)
+        length[node] = len(pattern)
+        value[node] = pattern_value
+    fail, output = self._build_links(goto, length)
+    self._load(self._pack(goto, length, value, fail, output))
+
+  @classmethod
+  def from_buffer(cls, buffer):
+    """Returns a matcher that uses the tables in buffer, like an mmap."""
+    item_matcher = cls.__new__(cls)
+    item_matcher._load(buffer)
+    return item_matcher
+
+  def to_bytes(self):
+    return self._buffer.tobytes()
+
+  def __getstate__(self):
+    return self.to_bytes()
+
+  def __setstate__(self, state):
+    self._load(state)
+
+  @staticmethod
+  def _add_pattern(goto, length, pattern):
+    node = 0
+    for c in pattern:
+      next_node = goto[node].get(c)
+      if next_node is None:
+        next_node = len(goto)
+        goto.append({})
+        length.append(0)
+        goto[node][c] = next_node
+      node = next_node
+    return node
+
+  @staticmethod
+  def _build_links(goto, length):
+    # Each node has a failure link, and a link to the next node on the failure
+    # chain that ends a pattern.  Breadth first, so that every failure link
+    # points at a node that already has its own links computed.
+    fail = [0] * len(goto)
+    output = [0] * len(goto)
+    queue = list(goto[0].values())
+    for node in queue:
+      for c, child in goto[node].items():
+        child_fail = fail[node]
+        while child_fail and c not in goto[child_fail]:
+          child_fail = fail[child_fail]
+        child_fail = goto[child_fail].get(c, 0)
+        fail[child] = child_fail
+        output[child] = child_fail if length[child_fail] else output[child_fail]
+        queue.append(child)
+    return fail, output
+
+  @staticmethod
+  def _pack(goto, length, value, fail, output):
+    # Renumber the nodes depth first.
+    order = []
+    stack = [0]
+    while stack:
+      node = stack.pop()
+      order.append(node)
+      stack.extend(reversed(list(goto[node].values())))
+    new_ids = [0] * len(order)
+    for new_id, node in enumerate(order):
+      new_ids[node] = new_id
+    chars = array.array('i')
+    branch_start = array.array('i')
+    branch_chars = array.array('i')
+    branch_nodes = array.array('i')
+    for node in order:
+      children = list(goto[node].items())
+      if children:
+        chars.append(ord(children[0][0]))
+      else:
+        chars.append(NO_CHILD)
+      branch_start.append(len(branch_chars))
+      for c, child in sorted(children[1:]):
+        branch_chars.append(ord(c))
+        branch_nodes.append(new_ids[child])
+    branch_start.append(len(branch_chars))
+    tables = [
+        chars,
+        array.array('i', [new_ids[fail[node]] for node in order]),
+        array.array('i', [length[node] for node in order]),
+        array.array('i', [new_ids[output[node]] for node in order]),
+        array.array('i', [value.get(node, 0) for node in order]),
+        branch_start, branch_chars, branch_nodes,
+    ]
+    header = HEADER.pack(MAGIC, LAYOUT_VERSION, len(order), len(branch_chars))
+    return header + b''.join(table.tobytes() for table in tables)
+
+  def _load(self, buffer):
+    buffer = memoryview(buffer).cast('B')
+    magic, version, node_count, branch_count = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != LAYOUT_VERSION:
+      raise ValueError('Not a matcher')
+    sizes = [node_count] * NODE_TABLES + [node_count + 1] + [branch_count] * 2
+    end = HEADER.size + 4 * sum(sizes)
+    if len(buffer) < end:
+      raise ValueError('Truncated matcher')
+    self._buffer = buffer[:end]
+    tables = []
+    offset = HEADER.size
+    for size in sizes:
+      tables.append(buffer[offset:offset + 4 * size].cast('i'))
+      offset += 4 * size
+    (self._chars, self._fail, self._length, self._output, self._value,
+     self._branch_start, self._branch_chars, self._branch_nodes) = tables
+
+  def find_all(self, text):
+    """Yields (start, end, value) for every pattern occurrence in text."""
+    chars = self._chars
+    fail = self._fail
+    length = self._length
+    value = self._value
+    output = self._output
+    branch_start = self._branch_start
+    branch_chars = self._branch_chars
+    branch_nodes = self._branch_nodes
+    node = 0
+    for i, c in enumerate(map(ord, text)):
+      while True:
+        if c == chars[node]:
+          node += 1
+          break
+        lo = branch_start[node]
+        hi = branch_start[node + 1]
+        if lo != hi:
+          j = bisect.bisect_left(branch_chars, c, lo, hi)
+          if j != hi and branch_chars[j] == c:
+            node = branch_nodes[j]
+            break
+        if not node:
+          break
+        node = fail[node]
+      match = node if length[node] else output[node]
+      while match:
+        yield i + 1 - length[match], i + 1, value[match]
+        match = output[match]
+
+  def find_longest(self, text, accept=None):
+    """Returns the leftmost-longest non-overlapping matches in text.
+
+    Scanning goes left to right.  When several patterns start at the same
+    position, the longest one wins, so "yaulp iv" is preferred over "yaulp".
+    If accept is given, only matches for which accept(start, end, value) is
+    true are considered.  The result is a list of (start, end, value) tuples in
+    order of start.
+    """
+    return longest_matches(self.find_all(text), accept)
+
+
+def longest_matches(matches, accept=None):
+  """Picks the leftmost-longest matches, like Matcher.find_longest.
+
+  matches is any iterable of (start, end, value) tuples from find_all.
+  """
+  longest = {}
+  for start, end, value in matches:
+    if accept is not None and not accept(start, end, value):
+      continue
+    if start not in longest or end > longest[start][0]:
+      longest[start] = (end, value)
+  selected = []
+  position = 0
+  for start in sorted(longest):
+    if start < position:
+      continue
+    end, value = longest[start]
+    selected.append((start, end, value))
+    position = end
+  return selected
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import pickle
+import unittest
+
+from parse_auctions import matcher
+
+
+class MatcherTest(unittest.TestCase):
+
+  def setUp(self):
+    self.matcher = matcher.Matcher({'he': 1, 'she': 2, 'his': 3, 'hers': 4})
+
+  def test_find_all(self):
+    actual = sorted(self.matcher.find_all('ushers'))
+    self.assertEqual(actual, [(1, 4, 2), (2, 4, 1), (2, 6, 4)])
+
+  def test_find_all_no_matches(self):
+    self.assertEqual(list(self.matcher.find_all('xyz')), [])
+
+  def test_find_longest_prefers_leftmost(self):
+    self.assertEqual(self.matcher.find_longest('ushers'), [(1, 4, 2)])
+
+  def test_find_longest_prefers_longest(self):
+    actual = self.matcher.find_longest('hers his')
+    self.assertEqual(actual, [(0, 4, 4), (5, 8, 3)])
+
+  def test_empty_pattern_is_ignored(self):
+    m = matcher.Matcher({'': 1, 'a': 2})
+    self.assertEqual(m.find_longest('aa'), [(0, 1, 2), (1, 2, 2)])
+
+  def test_find_longest_accept(self):
+    actual = self.matcher.find_longest(
+        'hers', accept=lambda start, end, value: value != 4)
+    self.assertEqual(actual, [(0, 2, 1)])
+
+  def test_nul_characters(self):
+    m = matcher.Matcher({'a\0b': 1, 'a': 2})
+    self.assertEqual(m.find_longest('a\0b'), [(0, 3, 1)])
+    self.assertEqual(m.find_longest('\0a\0'), [(1, 2, 2)])
+
+  def test_matches_brute_force(self):
+    patterns = {'ab': 1, 'abc': 2, 'bca': 3, 'c': 4, 'cab': 5, 'bb': 6}
+    m = matcher.Matcher(patterns)
+    text = 'abcabbcabcbbab'
+    expected = sorted(
+        (start, start + len(pattern), value)
+        for pattern, value in patterns.items()
+        for start in range(len(text))
+        if text.startswith(pattern, start))
+    self.assertEqual(sorted(m.find_all(text)), expected)
+
+  def test_from_buffer(self):
+    m = matcher.Matcher.from_buffer(bytearray(self.matcher.to_bytes()))
+    self.assertEqual(m.find_longest('hers his'), [(0, 4, 4), (5, 8, 3)])
+
+  def test_from_buffer_rejects_other_data(self):
+    with self.assertRaises(ValueError):
+      matcher.Matcher.from_buffer(b'not a matcher at all')
+    with self.assertRaises(ValueError):
+      matcher.Matcher.from_buffer(self.matcher.to_bytes()[:-4])
+
+  def test_pickle(self):
+    m = pickle.loads(pickle.dumps(self.matcher))
+    actual = sorted(m.find_all('ushers'))
+    self.assertEqual(actual, [(1, 4, 2), (2, 4, 1), (2, 6, 4)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,29 +1,35 @@
 #!/usr/bin/env python3
 
-
+import collections
+import concurrent.futures
 import re
-
-import dateutil.parser
-import pytrie
+import threading
 
 import db
+import eqtime
+import lru
+from parse_auctions import matcher
 
 
-IS_SELLING_TRIE = pytrie.StringTrie(
-    wts=True, selling=True, wtb=False, buying=False)
+IS_SELLING_KEYWORDS = {
+    'wts': True, 'selling': True, 'wtb': False, 'buying': False}
 # TODO: support things like WTS CoS 10 k (space between number and k)
 PRICE_REGEX = re.compile(r'^(\d*\.?\d*)(k|p|pp)?$')
-USELESS_PUNCTUATION_REGEX = re.compile(r'^[^\d\w]*(.*?)$')
+# Skips punctuation and spaces after an item name, then grabs the longest run of
+# characters that still looks like a price.
+PRICE_AFTER_ITEM_REGEX = re.compile(r'^[^\w.]*(\d*\.?\d*(?:k|pp|p)?)')
 SPLIT_REGEX = re.compile(r"^\[[^ ]+ ([^]]+)] ([^ ]+) auctions, '(.+)'$")
 DIGIT_REGEX = re.compile(r'\d')
-
-DEBUG = False
-
-
-def debug_print(message):
-  if DEBUG:
-    print(message)
-
+# The number of distinct auction messages whose parse results are kept.  Traders
+# repeat the same message every few minutes, and every uploader in the zone
+# sends it again, so most messages are seen many times.
+PARSE_CACHE_SIZE = 10000
+# parse_many only uses worker processes for batches with at least this many
+# messages that need parsing, since sending them back and forth costs about as
+# much as parsing a few hundred messages.  Messages go to the workers in chunks
+# of PARALLEL_CHUNK_SIZE.
+PARALLEL_THRESHOLD = 2000
+PARALLEL_CHUNK_SIZE = 500
 
 def split_line(line):
   """Parses text and returns a timestamp, character, and message."""
@@ -36,8 +42,7 @@ def split_line(line):
 
 def parse_timestamp(timestamp_str):
   """Parses the timestamp_str and returns a datetime."""
-  timestamp = dateutil.parser.parse(timestamp_str)
-  return timestamp
+  return eqtime.parse_timestamp(timestamp_str)
 
 
 def parse_timestamp_normalized(timestamp_str, client_time_offset):
@@ -79,28 +84,127 @@ def parse_price(price_str):
     return int(amount) * factor
 
 
-def clean_useless_punctuation(s, matches1, matches2):
-  if matches1 or matches2 or is_price(s):
-    return s
-  match = USELESS_PUNCTUATION_REGEX.match(s).group(1)
-  return match
+def parse_price_after_item(text):
+  """Parses the price at the start of the text that follows an item name."""
+  price_str = PRICE_AFTER_ITEM_REGEX.match(text).group(1)
+  return parse_price(price_str)
 
 
-class Item(object):
+def alias_value(item_id):
+  """Returns the matcher value for an alternate name of an item.
 
-  def __init__(self, item_id, is_selling, price=None):
-    self.item_id = item_id
-    self.is_selling = is_selling
-    self.price = price
+  Alternate names come from the item_names table.  Matcher values are ints, so
+  aliases get negative values to tell them apart from item IDs.  Aliases are
+  often short, like "cos" for Cloak of Shadows, so unlike canonical names they
+  only match whole words; otherwise "cost" would be a cloak.
+  """
+  return -1 - item_id
 
-  def __eq__(self, other):
-    if self.item_id != other.item_id:
-      return False
-    if self.is_selling != other.is_selling:
-      return False
-    if self.price != other.price:
-      return False
-    return True
+
+def is_alias_value(value):
+  return value < 0
+
+
+def build_matcher(item_table, alias_table=None):
+  """Builds a matcher for dicts of lowercase item names to item IDs.
+
+  item_table has canonical names, and alias_table has alternate names.  A
+  canonical name wins over an alias with the same name.
+  """
+  patterns = {}
+  if alias_table:
+    for name, item_id in alias_table.items():
+      patterns[name] = alias_value(item_id)
+  patterns.update(item_table)
+  patterns.update(IS_SELLING_KEYWORDS)
+  return matcher.Matcher(patterns)
+
+
+def follows_alnum(text, start):
+  """Returns whether a letter or digit comes right before text[start]."""
+  return start > 0 and text[start - 1].isalnum()
+
+
+def precedes_letter(text, end):
+  """Returns whether a letter comes right after text[:end]."""
+  return end < len(text) and text[end].isalpha()
+
+
+def find_glued_names(text, matches):
+  """Returns the item names in matches that are glued into a longer word.
+
+  matches are (start, end, value) tuples from find_all.  A name can be glued to
+  a price, like "Pouch12.5k", to a keyword, or to another name that isn't
+  glued itself, like "Cloak of ShadowsAle".  But names that are only glued to
+  each other within one word, like Ration and Ale in "rationale", are just
+  part of the word.  Keywords and aliases are never returned.
+  """
+  keywords = set()
+  names = []
+  for match in matches:
+    start, end, value = match
+    if text[start:end] in IS_SELLING_KEYWORDS:
+      keywords.add(match)
+    elif not is_alias_value(value):
+      names.append(match)
+  glued = set(
+      match for match in names
+      if follows_alnum(text, match[0]) or precedes_letter(text, match[1]))
+  if not glued:
+    return glued
+  by_start = collections.defaultdict(list)
+  by_end = collections.defaultdict(list)
+  for match in keywords.union(names):
+    by_start[match[0]].append(match)
+    by_end[match[1]].append(match)
+
+  def joined(left, right):
+    # At least one side has to be a keyword, or a name of more than one word.
+    return (left in keywords or right in keywords or
+            not text[left[0]:left[1]].isalnum() or
+            not text[right[0]:right[1]].isalnum())
+
+  # Start by accepting every glued name, and take back the ones that aren't
+  # joined to an accepted neighbour until nothing changes.
+  rejected = set()
+  changed = True
+  while changed:
+    changed = False
+    for match in glued - rejected:
+      start, end, _ = match
+      if follows_alnum(text, start) and not any(
+          other not in rejected and joined(other, match)
+          for other in by_end[start]):
+        rejected.add(match)
+        changed = True
+      elif precedes_letter(text, end) and not any(
+          other not in rejected and joined(match, other)
+          for other in by_start[end]):
+        rejected.add(match)
+        changed = True
+  return rejected
+
+
+def is_whole_word(text, start, end):
+  """Returns whether text[start:end] isn't part of a longer word."""
+  if start > 0 and text[start - 1].isalnum():
+    return False
+  if end < len(text) and text[end].isalnum():
+    return False
+  return True
+
+
+ItemTuple = collections.namedtuple(
+    'ItemTuple', ['item_id', 'is_selling', 'price'])
+
+
+class Item(ItemTuple):
+  """An item in an auction.  Immutable, so that cached results can be shared."""
+
+  __slots__ = ()
+
+  def __new__(cls, item_id, is_selling, price=None):
+    return super().__new__(cls, item_id, is_selling, price)
 
   def __repr__(self):
     message = ''
@@ -114,80 +218,244 @@ class Item(object):
     return message
 
 
+def load_item_table():
+  """Loads a dict of lowercase item names to item IDs from the db."""
+  all_items_list = db.get_all_items()
+  all_items_dict = {}
+  for item_id, item_name in all_items_list:
+    lowercase_name = item_name.lower()
+    all_items_dict[lowercase_name] = item_id
+  return all_items_dict
+
+
+def load_alias_table():
+  """Loads a dict of lowercase alternate item names to item IDs from the db."""
+  return dict(
+      (name.lower(), item_id) for item_id, name in db.get_all_item_names())
+
+
+def load_matcher():
+  """Builds a matcher for every item name and alias in the db."""
+  return build_matcher(load_item_table(), load_alias_table())
+
+
 class Parser(object):
 
-  def __init__(self, test_item_table=None):
-    if test_item_table:
-      self.items = pytrie.StringTrie(**test_item_table)
+  def __init__(
+      self, test_item_table=None, cache_size=PARSE_CACHE_SIZE,
+      item_matcher=None, test_alias_table=None, processes=1):
+    self.cache = lru.LruCache(cache_size)
+    # A tracing.Tracer, set to record how some messages get parsed.
+    self.tracer = None
+    # The number of processes parse_many uses for big batches.  The pool is
+    # started the first time it's needed, and again whenever the items change.
+    self.processes = processes
+    self._pool = None
+    self._pool_items = None
+    self._pool_lock = threading.Lock()
+    if item_matcher is not None:
+      self.set_matcher(item_matcher)
+    elif test_item_table:
+      self.set_items(test_item_table, test_alias_table)
     else:
-      all_items_list = db.get_all_items()
-      all_items_dict = {}
-      for item_id, item_name in all_items_list:
-        lowercase_name = item_name.lower()
-        all_items_dict[lowercase_name] = item_id
-      self.items = pytrie.StringTrie(**all_items_dict)
+      self.reload_items()
+
+  def reload_items(self):
+    """Reloads the item names and aliases from the db."""
+    self.set_matcher(load_matcher())
+
+  def set_items(self, item_table, alias_table=None):
+    """Replaces the item table and forgets results parsed with the old one."""
+    self.set_matcher(build_matcher(item_table, alias_table))
+
+  def set_matcher(self, item_matcher):
+    """Swaps in a matcher built by build_matcher.
+
+    The matcher must be completely built first.  parse_auction reads
+    self.items once per message, so each message is parsed entirely with
+    either the old matcher or the new one.
+    """
+    self.items = item_matcher
+    self.cache.clear()
 
   def parse_auction(self, auction_message):
     """Parses an auction message and returns a list of items.
 
+    Results are cached by message, so repeated messages are only parsed once.
+    The returned list is a new list each time, but the items in it are shared.
+    """
+    # Parsing only depends on the lowercase message.  Each entry remembers the
+    # matcher it was parsed with, so that a result parsed by another thread
+    # while the items were being replaced is never used with the new items.
+    lowercase_message = auction_message.lower()
+    items = self.items
+    tracer = self.tracer
+    if tracer is not None and tracer.should_trace(lowercase_message):
+      # Traced messages skip the cache, so that every decision gets recorded.
+      events = []
+      result = self._parse(items, lowercase_message, events)
+      tracer.write(auction_message, events, result)
+      return result
+    cached = self.cache.get(lowercase_message)
+    if cached is not None and cached[0] is items:
+      return list(cached[1])
+    result = self._parse(items, lowercase_message)
+    self.cache.put(lowercase_message, (items, tuple(result)))
+    return result
+
+  def parse_many(self, auction_messages):
+    """Parses a list of auction messages and returns a list of items for each.
+
+    The results are the same as calling parse_auction on each message, in the
+    same order, but each distinct message is only parsed once.  If the parser
+    has several processes, big batches are parsed in parallel.
+    """
+    items = self.items
+    tracer = self.tracer
+    lowercase_messages = [message.lower() for message in auction_messages]
+    results = {}
+    to_parse = []
+    for message, lowercase_message in zip(
+        auction_messages, lowercase_messages):
+      if lowercase_message in results:
+        continue
+      if tracer is not None and tracer.should_trace(lowercase_message):
+        events = []
+        result = self._parse(items, lowercase_message, events)
+        tracer.write(message, events, result)
+        results[lowercase_message] = tuple(result)
+        continue
+      cached = self.cache.get(lowercase_message)
+      if cached is not None and cached[0] is items:
+        results[lowercase_message] = cached[1]
+      else:
+        results[lowercase_message] = None
+        to_parse.append(lowercase_message)
+    if self.processes > 1 and len(to_parse) >= PARALLEL_THRESHOLD:
+      parsed = self._parse_in_pool(items, to_parse)
+    else:
+      parsed = (tuple(self._parse(items, message)) for message in to_parse)
+    for lowercase_message, result in zip(to_parse, parsed):
+      results[lowercase_message] = result
+      self.cache.put(lowercase_message, (items, result))
+    return [
+        list(results[lowercase_message])
+        for lowercase_message in lowercase_messages]
+
+  def _parse_in_pool(self, items, lowercase_messages):
+    with self._pool_lock:
+      if self._pool_items is not items:
+        # Each worker gets the matcher once when it starts, rather than with
+        # every chunk.
+        self._close_pool()
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self.processes, initializer=init_worker, initargs=(items,))
+        self._pool_items = items
+      pool = self._pool
+    chunks = [
+        lowercase_messages[i:i + PARALLEL_CHUNK_SIZE]
+        for i in range(0, len(lowercase_messages), PARALLEL_CHUNK_SIZE)]
+    for results in pool.map(parse_in_worker, chunks):
+      yield from results
+
+  def close(self):
+    """Stops the worker processes, if parse_many started any."""
+    with self._pool_lock:
+      self._close_pool()
+
+  def _close_pool(self):
+    if self._pool is not None:
+      self._pool.shutdown()
+    self._pool = None
+    self._pool_items = None
+
+  def _parse(self, items, lowercase_message, events=None):
+    """Parses a lowercase auction message with the given matcher.
+
+    If events is a list, a dict describing each decision is appended to it.
+
     Parsing strategy:
-    - Go one character at a time.
+    - Scan the message once with the matcher to find every item name, alias,
+      and WTS/WTB keyword, preferring the longest name at each position so
+      that Yaulp IV beats Yaulp.  Aliases only count as whole words, and item
+      names only count when they aren't part of a longer word.
     - Start in WTS mode (since some people just say /auc Ale)
     - If we see WTB or "Buying" then switch to buying mode
     - If we see WTS or "Selling" then switch to selling mode
-    - After consuming each character, check the items trie to see if anything
-      matches
-    - If the current characters aren't a prefix for anything, then throw away
-      the current characters and start processing again.
-    - If the current characters are a full match for an item, then register that
-      item.
-    - After finding an item, try to process the next characters as a price.
-
-    TODO: it's hard to reason about the matching strategy.  Make it simpler.
+    - For each item, try to read a price from the text between the item name
+      and the next match.
+
     TODO: this doesn't support quantities like 'WTS Diamond x8 100pp each' or
           'WTS Diamond (8) 8k'.  A quantity without an 'x' will be interpreted
           as a price.
-    TODO: this does greedy matches, which means that it'll think things like
-          Yaulp IV are just plain old Yaulp.
     """
+    all_matches = list(items.find_all(lowercase_message))
+    glued = find_glued_names(lowercase_message, all_matches)
+
+    def accept(start, end, value):
+      name = lowercase_message[start:end]
+      if name in IS_SELLING_KEYWORDS:
+        return True
+      if is_alias_value(value):
+        if is_whole_word(lowercase_message, start, end):
+          return True
+        event = 'alias_in_word'
+      else:
+        # "stuff for sale" isn't Ale.
+        if (start, end, value) not in glued:
+          return True
+        event = 'item_in_word'
+      if events is not None:
+        events.append({'event': event, 'start': start, 'name': name})
+      return False
+
     all_items = []
-    lowercase_message = auction_message.lower()
     is_selling = True
-    item = None
-    message_so_far = ''
-    for c in lowercase_message:
-      message_so_far += c
-      debug_print(message_so_far)
-      is_selling_matches = IS_SELLING_TRIE.items(prefix=message_so_far)
-      matches = self.items.items(prefix=message_so_far)
-      # If there's useless punctuation in the buffer, ditch it.
-      message_so_far = clean_useless_punctuation(
-          message_so_far, matches, is_selling_matches)
-      # If one item is done, finish it.
-      if item and item.price and not is_price(message_so_far):
-        debug_print('Finish item with price')
-        item = None
-        message_so_far = c
-      elif item and not is_price(message_so_far):
-        debug_print('Finish item without price')
-        item = None
-      # Try to find the price of the previous item or the next item.
-      if item and is_price(message_so_far):
-        debug_print('Update price')
-        item.price = parse_price(message_so_far)
-      elif not matches and not is_selling_matches:
-        debug_print('No match')
-        message_so_far = ''
-        item = None
-      elif (len(is_selling_matches) == 1 and
-            is_selling_matches[0][0] == message_so_far):
-        debug_print('is selling match')
-        is_selling = is_selling_matches[0][1]
-        message_so_far = ''
-        item = None
-      elif (len(matches) == 1 and matches[0][0] == message_so_far):
-        debug_print('item match')
-        item = Item(matches[0][1], is_selling)
-        all_items.append(item)
-        message_so_far = ''
+    matches = matcher.longest_matches(all_matches, accept)
+    for i, (start, end, item_id) in enumerate(matches):
+      name = lowercase_message[start:end]
+      if name in IS_SELLING_KEYWORDS:
+        is_selling = IS_SELLING_KEYWORDS[name]
+        if events is not None:
+          events.append({
+              'event': 'keyword', 'start': start, 'name': name,
+              'is_selling': is_selling})
+        continue
+      is_alias = is_alias_value(item_id)
+      if is_alias:
+        # alias_value is its own inverse.
+        item_id = alias_value(item_id)
+      if i + 1 < len(matches):
+        next_start = matches[i + 1][0]
+      else:
+        next_start = len(lowercase_message)
+      price_text = lowercase_message[end:next_start]
+      price = parse_price_after_item(price_text)
+      if events is not None:
+        events.append({
+            'event': 'alias' if is_alias else 'item', 'start': start,
+            'name': name, 'item_id': item_id, 'is_selling': is_selling,
+            'price_text': price_text, 'price': price})
+      all_items.append(Item(item_id, is_selling, price))
     return all_items
+
+
+# The parser in each of a Parser's worker processes.
+WORKER_PARSER = None
+
+
+def init_worker(item_matcher):
+  global WORKER_PARSER
+  WORKER_PARSER = Parser(item_matcher=item_matcher)
+
+
+def parse_in_worker(lowercase_messages):
+  """Parses a chunk of messages in a worker process, for parse_many.
+
+  The messages have already missed the cache in the main process, so they skip
+  the worker's cache.
+  """
+  items = WORKER_PARSER.items
+  return [
+      tuple(WORKER_PARSER._parse(items, message))
+      for message in lowercase_messages]
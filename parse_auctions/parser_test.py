@@ -10,6 +10,14 @@ from parse_auctions import parser
 TEST_ITEM_TABLE = {
     'cloak of shadows': 13,
     'ale': 17,
+    'yaulp': 21,
+    'yaulp iv': 22,
+    'ration': 23,
+}
+
+TEST_ALIAS_TABLE = {
+    'cos': 13,
+    'ale': 99,
 }
 
 AUCTION_TEST_CASES = collections.OrderedDict([
@@ -47,13 +55,32 @@ AUCTION_TEST_CASES = collections.OrderedDict([
     ('Ale: 123|Cloak of Shadows',
       [parser.Item(17, True, 123), parser.Item(13, True, None)]),
     ('Ale.', [parser.Item(17, True, None)]),
+    # Messages where one item name is a prefix of another
+    ('WTS Yaulp IV 500', [parser.Item(22, True, 500)]),
+    ('WTS Yaulp 50 Yaulp IV', [
+      parser.Item(21, True, 50), parser.Item(22, True, None)]),
+    # Messages with aliases
+    ('WTS CoS 5k', [parser.Item(13, True, 5000)]),
+    ('WTS CoS|Ale', [parser.Item(13, True, None), parser.Item(17, True, None)]),
+    ('WTB cost 5k', []),
+    # Item names inside other words
+    ('name your price', []),
+    ('stuff for sale', []),
+    ('WTB Small Scale Tunic', []),
+    ('WTS Ale5k', [parser.Item(17, True, 5000)]),
+    # A word made up of item names is still just a word
+    ('WTS rationale', []),
+    ('WTS Ration Ale', [
+      parser.Item(23, True, None), parser.Item(17, True, None)]),
+    ('WTS xCloak of ShadowsAle', []),
 ])
 
 
 class ParserTest(unittest.TestCase):
 
   def setUp(self):
-    self.parser = parser.Parser(test_item_table=TEST_ITEM_TABLE)
+    self.parser = parser.Parser(
+        test_item_table=TEST_ITEM_TABLE, test_alias_table=TEST_ALIAS_TABLE)
 
   def test_split_line(self):
     line = "[Sun Jan 01 13:45:35 2017] Toon auctions, 'WTS Ale'"
@@ -101,6 +128,52 @@ class ParserTest(unittest.TestCase):
           msg='Auction: {}, Expected: {}, Actual:{}'.format(
             auction_message, expected_output, actual_output))
 
+  def test_parse_auction_cached(self):
+    first = self.parser.parse_auction('WTS Ale 5')
+    second = self.parser.parse_auction('wts ale 5')
+    self.assertEqual(first, second)
+    self.assertIsNot(first, second)
+    self.assertEqual(self.parser.cache.hits, 1)
+    self.assertEqual(self.parser.cache.misses, 1)
+    first.append(parser.Item(13, True))
+    self.assertEqual(self.parser.parse_auction('WTS Ale 5'), second)
+    with self.assertRaises(AttributeError):
+      second[0].price = 10
+
+  def test_set_items_clears_cache(self):
+    self.parser.parse_auction('WTS Ale 5')
+    self.parser.set_items({'ale': 99})
+    self.assertEqual(
+        self.parser.parse_auction('WTS Ale 5'), [parser.Item(99, True, 5)])
+    self.assertEqual(self.parser.cache.hits, 0)
+
+  def test_parse_many(self):
+    messages = list(AUCTION_TEST_CASES) * 2 + ['wts ale']
+    expected = [
+        self.parser.parse_auction(message) for message in messages]
+    self.parser.cache.clear()
+    misses = self.parser.cache.misses
+    self.assertEqual(self.parser.parse_many(messages), expected)
+    # Each distinct message is only parsed once.
+    self.assertEqual(
+        self.parser.cache.misses - misses, len(AUCTION_TEST_CASES))
+    self.assertEqual(self.parser.parse_many([]), [])
+
+  def test_parse_many_in_processes(self):
+    auction_parser = parser.Parser(
+        test_item_table=TEST_ITEM_TABLE, test_alias_table=TEST_ALIAS_TABLE,
+        processes=2)
+    self.addCleanup(auction_parser.close)
+    messages = [
+        '{} {}'.format(message, i) for i in range(parser.PARALLEL_THRESHOLD)
+        for message in ('WTS Ale', 'WTB CoS')]
+    expected = [self.parser.parse_auction(message) for message in messages]
+    self.assertEqual(auction_parser.parse_many(messages), expected)
+    # The pool is started again with the new items.
+    auction_parser.set_items({'ale': 99})
+    self.assertEqual(
+        auction_parser.parse_many(messages)[0], [parser.Item(99, True, 0)])
+
 
 if __name__ == '__main__':
   unittest.main()
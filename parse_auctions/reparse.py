@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import json
+import os
+import time
+
+import db
+from parse_auctions import parser
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_PATH = os.path.join(SCRIPT_DIR, '.reparse-checkpoint.json')
+
+# The number of raw auctions parsed and written in each transaction.
+DEFAULT_BATCH_SIZE = 10000
+# How often to print progress.
+REPORT_INTERVAL_SECONDS = 5
+
+
+class Checkpoint(object):
+  """Remembers the last raw auction ID that was reparsed.
+
+  A checkpoint is only used to resume a run that looks for the same names, so
+  that a run for different items starts from the beginning.
+  """
+
+  def __init__(self, path, names):
+    self.path = path
+    self.names = sorted(names)
+    self.last_id = 0
+    if os.path.isfile(path):
+      with open(path, 'r') as f:
+        saved = json.load(f)
+      if saved['names'] == self.names:
+        self.last_id = saved['last_id']
+
+  def save(self, last_id):
+    self.last_id = last_id
+    temp_path = self.path + '.tmp'
+    with open(temp_path, 'w') as f:
+      json.dump({'names': self.names, 'last_id': last_id}, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp_path, self.path)
+
+  def remove(self):
+    if os.path.isfile(self.path):
+      os.remove(self.path)
+
+
+class Stats(object):
+
+  def __init__(self):
+    self.start = time.monotonic()
+    self.last_report = self.start
+    self.raw_auctions = 0
+    self.changed = 0
+    self.deleted = 0
+    self.added = 0
+
+  def maybe_report(self, last_id, force=False):
+    now = time.monotonic()
+    if not force and now - self.last_report < REPORT_INTERVAL_SECONDS:
+      return
+    self.last_report = now
+    elapsed = max(now - self.start, 1e-9)
+    print(
+        'Up to ID {:,}: {:,} auctions ({:,.0f}/sec), {:,} changed, '
+        '{:,} clean rows deleted, {:,} added'.format(
+            last_id, self.raw_auctions, self.raw_auctions / elapsed,
+            self.changed, self.deleted, self.added))
+
+
+def diff_items(old_rows, items):
+  """Compares an auction's clean rows with what it parses to now.
+
+  Returns the old rows to delete, and the (item_id, is_selling, price) of the
+  new items to add.  Items that are already in the db are left alone.
+  """
+  remaining = collections.Counter(
+      (item.item_id, item.is_selling, item.price) for item in items)
+  deleted = []
+  for row in old_rows:
+    key = (row[2], row[4], row[5])
+    if remaining[key]:
+      remaining[key] -= 1
+    else:
+      deleted.append(row)
+  return deleted, list(remaining.elements())
+
+
+def reparse_batch(auction_parser, raw_auctions, stats):
+  """Reparses raw auctions and writes whatever changed in one transaction."""
+  parsed_items = auction_parser.parse_many(
+      [message for _, _, _, message in raw_auctions])
+  with db.transaction() as cur:
+    old_rows = collections.defaultdict(list)
+    for row in db.get_clean_auctions_with_cursor(
+        cur, [raw_id for raw_id, _, _, _ in raw_auctions]):
+      old_rows[row[1]].append(row)
+    deleted = []
+    added = []
+    for (raw_id, timestamp, character_id, _), items in zip(
+        raw_auctions, parsed_items):
+      auction_deleted, auction_added = diff_items(old_rows[raw_id], items)
+      if auction_deleted or auction_added:
+        stats.changed += 1
+      deleted.extend(auction_deleted)
+      for item_id, is_selling, price in auction_added:
+        added.append(
+            (raw_id, character_id, item_id, timestamp, is_selling, price))
+    db.replace_clean_auctions_with_cursor(cur, deleted, added)
+  stats.raw_auctions += len(raw_auctions)
+  stats.deleted += len(deleted)
+  stats.added += len(added)
+
+
+def parse_args():
+  arg_parser = argparse.ArgumentParser(
+      description='Reparses raw auctions with the current parser and items, '
+                  'and fixes up the clean auctions that changed.')
+  arg_parser.add_argument(
+      '--name', action='append', default=[],
+      help='Only reparse messages that mention this item name, like one that '
+           'was added, removed or renamed.  Can be repeated.  By default '
+           'every message is reparsed.')
+  arg_parser.add_argument(
+      '--item-id', type=int, action='append', default=[],
+      help='Like --name, for every current name of this item.')
+  arg_parser.add_argument(
+      '--workers', type=int, default=os.cpu_count(),
+      help='The number of parser processes.')
+  arg_parser.add_argument(
+      '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+      help='The number of raw auctions reparsed per transaction.')
+  arg_parser.add_argument('--checkpoint-file', default=CHECKPOINT_PATH)
+  arg_parser.add_argument(
+      '--restart', action='store_true',
+      help='Start from the first auction even if there is a checkpoint.')
+  return arg_parser.parse_args()
+
+
+def get_item_names(item_ids):
+  """Returns the canonical and alternate names of some items."""
+  item_ids = set(item_ids)
+  names = [name for item_id, name in db.get_all_items() if item_id in item_ids]
+  names.extend(
+      name for item_id, name in db.get_all_item_names() if item_id in item_ids)
+  return names
+
+
+def main():
+  args = parse_args()
+  names = set(name.lower() for name in args.name)
+  names.update(name.lower() for name in get_item_names(args.item_id))
+  if args.item_id and not names:
+    print('No names found for those items')
+    return
+  # The stream of raw auctions holds one connection while batches are written
+  # with another.
+  db.configure_pool(2)
+  checkpoint = Checkpoint(args.checkpoint_file, names)
+  if args.restart:
+    checkpoint.last_id = 0
+  if checkpoint.last_id:
+    print('Resuming after ID {:,}'.format(checkpoint.last_id))
+  auction_parser = parser.Parser(processes=args.workers)
+  stats = Stats()
+  try:
+    for raw_auctions in db.iter_raw_auctions(
+        checkpoint.last_id, names, args.batch_size):
+      reparse_batch(auction_parser, raw_auctions, stats)
+      checkpoint.save(raw_auctions[-1][0])
+      stats.maybe_report(checkpoint.last_id)
+  finally:
+    auction_parser.close()
+  stats.maybe_report(checkpoint.last_id, force=True)
+  checkpoint.remove()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from parse_auctions import parser
+from parse_auctions import reparse
+
+
+NOW = datetime.datetime(2017, 1, 2, 13, 45, 35)
+
+
+class DiffItemsTest(unittest.TestCase):
+
+  def test_unchanged(self):
+    old_rows = [(1, 10, 17, NOW, True, 5), (2, 10, 13, NOW, True, None)]
+    items = [parser.Item(17, True, 5), parser.Item(13, True)]
+    self.assertEqual(reparse.diff_items(old_rows, items), ([], []))
+
+  def test_changed(self):
+    old_rows = [(1, 10, 17, NOW, True, 5), (2, 10, 17, NOW, True, 5)]
+    items = [parser.Item(17, True, 5), parser.Item(13, False, 100)]
+    self.assertEqual(
+        reparse.diff_items(old_rows, items),
+        ([(2, 10, 17, NOW, True, 5)], [(13, False, 100)]))
+
+  def test_new_auction(self):
+    self.assertEqual(
+        reparse.diff_items([], [parser.Item(17, True, 5)]),
+        ([], [(17, True, 5)]))
+
+
+class CheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+    self.path = os.path.join(self.temp_dir.name, 'checkpoint.json')
+
+  def test_resume(self):
+    reparse.Checkpoint(self.path, ['ale']).save(123)
+    self.assertEqual(reparse.Checkpoint(self.path, ['ale']).last_id, 123)
+
+  def test_other_names_start_over(self):
+    reparse.Checkpoint(self.path, ['ale']).save(123)
+    self.assertEqual(reparse.Checkpoint(self.path, ['cos']).last_id, 0)
+
+  def test_remove(self):
+    checkpoint = reparse.Checkpoint(self.path, [])
+    checkpoint.save(123)
+    checkpoint.remove()
+    self.assertEqual(reparse.Checkpoint(self.path, []).last_id, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,16 +1,90 @@
 #!/usr/bin/env python3
 
 
+import argparse
+import collections
+import concurrent.futures
 import datetime
+import hashlib
 import http.server
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+import zlib
 
 import db
+import lru
+import metrics
+import rollups
 from parse_auctions import parser
+from parse_auctions import snapshot
+from parse_auctions import ticker
+from parse_auctions import tracing
 
 
 ISO_FORMAT = '%Y-%m-%dT%H:%M:%S'
+DEFAULT_PORT = 8000
+DEFAULT_WORKERS = 8
+# GET responses are cached for this long, or until an upload mentions their
+# item.  Price history goes stale as time passes even without uploads.
+READ_CACHE_SECONDS = 60
+READ_CACHE_SIZE = 5000
+RECENT_AUCTIONS_LIMIT = 50
+# With --write-behind, uploads are parsed and queued, and these many threads
+# write them in batches.  The queue size is in auctions.
+DEFAULT_QUEUE_SIZE = 50000
+DEFAULT_QUEUE_WORKERS = 2
+QUEUE_BATCH_SIZE = 1000
+# With --processes, how often the supervisor checks for workers that died.
+SUPERVISE_SECONDS = 1
+# How long queue workers wait before retrying when the db is down.
+MIN_RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 30
+# How long queue workers wait, at most, before retrying a batch that lost a
+# deadlock to another writer.  The wait is random so they don't collide again,
+# and its limit doubles after every try.  A batch that still loses after this
+# many tries is dropped, rather than holding up the queue.
+ROLLBACK_RETRY_SECONDS = 0.05
+MAX_ROLLBACK_ATTEMPTS = 8
+# How long a request to /live_auctions waits for a new auction.  At most half
+# of the workers wait at once; once they're all taken, requests are answered
+# right away, so that waiting clients can't starve uploads.
+LIVE_POLL_SECONDS = 25
+# Uploads of an auction that was just written are dropped before parsing.
+# Written auctions are remembered for this long, up to this many of them.
+RECENT_AUCTIONS_SECONDS = 300
+RECENT_AUCTIONS_SIZE = 50000
+# The largest upload body accepted, after it's been decompressed.  Clients
+# send 64KB batches.
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# How far back /price_history goes for each period.
+HISTORY_LENGTHS = {
+    'hour': datetime.timedelta(hours=48),
+    'day': datetime.timedelta(days=30),
+}
 
-PARSER = parser.Parser()
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Set by main, so that importing this module doesn't need the db.
+PARSER = None
+# The Reloader or Watcher that keeps PARSER's items up to date.  Until it has
+# loaded some items, uploads are turned away, since they'd be written without
+# any clean auctions.
+ITEMS_POLLER = None
+# A WriteQueue, when running with --write-behind.
+WRITE_QUEUE = None
+# The newest auctions, for /live_auctions.  None with --processes, since each
+# process would only see the auctions uploaded to it.
+TICKER = ticker.Ticker()
+LIVE_WAITERS = threading.BoundedSemaphore(max(1, DEFAULT_WORKERS // 2))
 
 
 def get_client_time_offset(now, client_time_str):
@@ -32,44 +106,932 @@ def get_client_time_offset(now, client_time_str):
   return now - client_datetime
 
 
+# Per-line statuses returned by /upload_logs.
+STATUS_ADDED = 'added'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_INVALID = 'invalid'
+# With --write-behind, lines are only known to be valid when the server
+# responds.
+STATUS_QUEUED = 'queued'
+
+# Requests to any other path are counted together, to keep the number of
+# metrics bounded.
+KNOWN_PATHS = frozenset([
+    '/upload_log', '/upload_logs', '/price_history', '/recent_auctions',
+    '/live_auctions', '/metrics'])
+
+REQUESTS = metrics.REGISTRY.counter(
+    'p99tunnel_requests_total', 'HTTP requests by path and status.',
+    ['path', 'status'])
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    'p99tunnel_request_seconds', 'Time spent handling HTTP requests.',
+    ['path'])
+STAGE_SECONDS = metrics.REGISTRY.histogram(
+    'p99tunnel_ingest_stage_seconds',
+    'Time spent in each stage of ingesting a batch of log lines.', ['stage'])
+SPLIT_STAGE = STAGE_SECONDS.labels('split_line')
+TIMESTAMP_STAGE = STAGE_SECONDS.labels('parse_timestamp')
+CHARACTER_STAGE = STAGE_SECONDS.labels('characters')
+RAW_AUCTION_STAGE = STAGE_SECONDS.labels('dedup_raw_auctions')
+RECENT_AUCTION_STAGE = STAGE_SECONDS.labels('recent_auctions')
+PARSE_STAGE = STAGE_SECONDS.labels('parse_auction')
+CLEAN_AUCTION_STAGE = STAGE_SECONDS.labels('clean_auctions')
+LINES = metrics.REGISTRY.counter(
+    'p99tunnel_ingested_lines_total',
+    'Uploaded log lines, by whether they were added, duplicates, or not '
+    'auctions.', ['status'])
+RECENT_DUPLICATES = metrics.REGISTRY.counter(
+    'p99tunnel_recent_duplicate_lines_total',
+    'Uploaded duplicates of recently written auctions, which were dropped '
+    'before parsing and the db.  These are also counted as duplicates in '
+    'p99tunnel_ingested_lines_total.')
+SKIPPED_TRANSACTIONS = metrics.REGISTRY.counter(
+    'p99tunnel_skipped_transactions_total',
+    'Uploads that needed no db transaction, since every line was a recent '
+    'duplicate or not an auction.')
+ITEMS_PER_AUCTION = metrics.REGISTRY.histogram(
+    'p99tunnel_items_per_auction', 'Items found in each auction.',
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16))
+metrics.REGISTRY.gauge(
+    'p99tunnel_write_queue_depth', 'Auctions waiting to be written.',
+    lambda: len(WRITE_QUEUE) if WRITE_QUEUE is not None else 0)
+QUEUE_REJECTED = metrics.REGISTRY.counter(
+    'p99tunnel_write_queue_rejected_total',
+    'Auctions turned away because the write queue was full.')
+QUEUE_WRITTEN = metrics.REGISTRY.counter(
+    'p99tunnel_write_queue_written_total',
+    'Auctions written by the write queue.')
+QUEUE_DROPPED = metrics.REGISTRY.counter(
+    'p99tunnel_write_queue_dropped_total',
+    'Auctions the write queue gave up on after an error.')
+QUEUE_ROLLBACKS = metrics.REGISTRY.counter(
+    'p99tunnel_write_queue_rollbacks_total',
+    'Batches the write queue retried after losing a deadlock.')
+QUEUE_BATCH_SECONDS = metrics.REGISTRY.histogram(
+    'p99tunnel_write_queue_batch_seconds',
+    'Time spent writing each batch from the write queue.')
+metrics.REGISTRY.gauge(
+    'p99tunnel_parse_cache_hits_total', 'Auctions parsed from the cache.',
+    lambda: PARSER.cache.hits if PARSER else 0, 'counter')
+metrics.REGISTRY.gauge(
+    'p99tunnel_parse_cache_misses_total', 'Auctions not in the parse cache.',
+    lambda: PARSER.cache.misses if PARSER else 0, 'counter')
+
+
+def parse_lines(client_time_offset, log_messages):
+  """Parses EQ log lines without touching the db.
+
+  Returns (index, normalized_time, character, auction, items) for each line
+  that is an auction, where index is the line's index in log_messages, and the
+  indexes of the lines that are duplicates of recently written auctions.
+  """
+  # Each stage runs over the whole batch, so that timing it costs the same no
+  # matter how many lines there are.
+  with SPLIT_STAGE.time():
+    split_lines = [
+        parser.split_line(log_message) for log_message in log_messages]
+  with TIMESTAMP_STAGE.time():
+    parsed = []
+    for i, (log_timestamp, character, auction) in enumerate(split_lines):
+      if not log_timestamp or not character or not auction:
+        continue
+      try:
+        normalized_time = parser.parse_timestamp_normalized(
+            log_timestamp, client_time_offset)
+      except (ValueError, OverflowError):
+        # Like "Feb 30".  Only this line is invalid.
+        continue
+      parsed.append((i, normalized_time, character, auction))
+  with RECENT_AUCTION_STAGE.time():
+    duplicates = []
+    fresh = []
+    for line in parsed:
+      i, normalized_time, character, auction = line
+      if RECENT_AUCTIONS.contains(normalized_time, character, auction):
+        duplicates.append(i)
+      else:
+        fresh.append(line)
+    parsed = fresh
+  RECENT_DUPLICATES.inc(len(duplicates))
+  LINES.labels(STATUS_DUPLICATE).inc(len(duplicates))
+  # Other duplicates get parsed too, so that lines can be parsed before they're
+  # queued.  Most of them come out of the parse cache, and repeats within the
+  # batch are only parsed once.
+  with PARSE_STAGE.time():
+    parsed_items = PARSER.parse_many(
+        [auction for _, _, _, auction in parsed])
+    auctions = []
+    for (i, normalized_time, character, auction), items in zip(
+        parsed, parsed_items):
+      ITEMS_PER_AUCTION.observe(len(items))
+      auctions.append((i, normalized_time, character, auction, items))
+  LINES.labels(STATUS_INVALID).inc(
+      len(log_messages) - len(auctions) - len(duplicates))
+  return auctions, duplicates
+
+
+def write_auctions(cur, auctions):
+  """Bulk writes auctions from parse_lines with cur.
+
+  Returns the auctions that weren't already in the db.
+  """
+  with CHARACTER_STAGE.time():
+    character_ids = db.get_or_create_characters_with_cursor(
+        cur, [character for _, _, character, _, _ in auctions])
+  with RAW_AUCTION_STAGE.time():
+    raw_ids = db.add_raw_auctions_bulk_with_cursor(
+        cur, [(normalized_time, character_ids[character], auction)
+              for _, normalized_time, character, auction, _ in auctions])
+  clean_rows = []
+  for (_, normalized_time, character, _, items), raw_id in zip(
+      auctions, raw_ids):
+    # If we've already seen this auction, raw_id will be None, signaling that
+    # we don't need to insert a new set of clean IDs.
+    if not raw_id:
+      continue
+    for item in items:
+      clean_rows.append((
+          raw_id, character_ids[character], item.item_id, normalized_time,
+          item.is_selling, item.price))
+  with CLEAN_AUCTION_STAGE.time():
+    db.add_clean_auctions_bulk_with_cursor(cur, clean_rows)
+  new_auctions = [
+      auction for auction, raw_id in zip(auctions, raw_ids) if raw_id]
+  LINES.labels(STATUS_ADDED).inc(len(new_auctions))
+  LINES.labels(STATUS_DUPLICATE).inc(len(auctions) - len(new_auctions))
+  return new_auctions
+
+
+def publish(new_auctions):
+  """Call once new auctions from write_auctions are committed."""
+  RECENT_AUCTIONS.add(new_auctions)
+  READ_CACHE.invalidate(set(
+      item.item_id for _, _, _, _, items in new_auctions for item in items))
+  if TICKER is not None:
+    TICKER.add([
+        (normalized_time, character, auction, items)
+        for _, normalized_time, character, auction, items in new_auctions])
+
+
+def ingest_lines(client_time_offset, log_messages):
+  """Parses EQ log lines and bulk writes them in one transaction.
+
+  Returns a list with one status per line.  When no line needs writing, the
+  db isn't touched at all.
+  """
+  statuses = [STATUS_INVALID] * len(log_messages)
+  auctions, duplicates = parse_lines(client_time_offset, log_messages)
+  for i in duplicates:
+    statuses[i] = STATUS_DUPLICATE
+  if not auctions:
+    SKIPPED_TRANSACTIONS.inc()
+    return statuses
+  for auction in auctions:
+    statuses[auction[0]] = STATUS_DUPLICATE
+  with db.transaction() as cur:
+    new_auctions = write_auctions(cur, auctions)
+  publish(new_auctions)
+  for auction in new_auctions:
+    statuses[auction[0]] = STATUS_ADDED
+  return statuses
+
+
+class WriteQueue(object):
+  """Writes parsed auctions to the db in the background, in batches.
+
+  The queue holds at most max_size auctions, so that a slow db pushes back on
+  uploaders instead of using up memory.
+  """
+
+  def __init__(
+      self, max_size=DEFAULT_QUEUE_SIZE, workers=DEFAULT_QUEUE_WORKERS,
+      batch_size=QUEUE_BATCH_SIZE):
+    self.max_size = max_size
+    self.batch_size = batch_size
+    self._pending = collections.deque()
+    self._condition = threading.Condition()
+    self._closing = False
+    self._threads = [
+        threading.Thread(target=self._run, daemon=True)
+        for _ in range(workers)]
+    for thread in self._threads:
+      thread.start()
+
+  def __len__(self):
+    return len(self._pending)
+
+  def put(self, auctions):
+    """Queues auctions from parse_lines.
+
+    Returns False, without queueing any of them, if they don't all fit.
+    """
+    with self._condition:
+      if self._closing or len(self._pending) + len(auctions) > self.max_size:
+        QUEUE_REJECTED.inc(len(auctions))
+        return False
+      self._pending.extend(auctions)
+      self._condition.notify()
+    return True
+
+  def close(self):
+    """Stops taking auctions and waits for the queued ones to be written."""
+    with self._condition:
+      self._closing = True
+      self._condition.notify_all()
+    for thread in self._threads:
+      thread.join()
+
+  def _take(self):
+    """Waits for a batch.  Returns an empty one once closed and drained."""
+    with self._condition:
+      while not self._pending and not self._closing:
+        self._condition.wait()
+      count = min(self.batch_size, len(self._pending))
+      return [self._pending.popleft() for _ in range(count)]
+
+  def _run(self):
+    while True:
+      batch = self._take()
+      if not batch:
+        return
+      self._write(batch)
+
+  def _write(self, batch):
+    delay = MIN_RETRY_SECONDS
+    rollbacks = 0
+    while True:
+      try:
+        with QUEUE_BATCH_SECONDS.time():
+          with db.transaction() as cur:
+            new_auctions = write_auctions(cur, batch)
+        publish(new_auctions)
+        QUEUE_WRITTEN.inc(len(batch))
+        return
+      except db.ROLLBACK_ERRORS:
+        QUEUE_ROLLBACKS.inc()
+        rollbacks += 1
+        if rollbacks >= MAX_ROLLBACK_ATTEMPTS:
+          traceback.print_exc()
+          break
+        time.sleep(random.uniform(0, ROLLBACK_RETRY_SECONDS * 2 ** rollbacks))
+      except db.CONNECTION_ERRORS:
+        traceback.print_exc()
+        # Wait for the db to come back, unless the server is shutting down.
+        if self._closing and delay >= MAX_RETRY_SECONDS:
+          break
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RETRY_SECONDS)
+      except Exception:
+        traceback.print_exc()
+        break
+    QUEUE_DROPPED.inc(len(batch))
+
+
+class RecentAuctions(object):
+  """Remembers recently written auctions, to drop copies before the db.
+
+  Every uploader in a zone sends the same auctions, with slightly different
+  times.  A line is a duplicate by the same rule as in add_raw_auction: the
+  same character and message as a raw auction within db.DUPLICATE_WINDOW.
+  Only auctions that were committed as new are remembered, so this never
+  drops an auction that the db would have kept, and the db still catches
+  whatever this misses.  Auctions are kept in time buckets like the db's
+  time_bucket, so a lookup only checks three keys.  Each auction is
+  forgotten max_age seconds after it was written, or sooner once there are
+  more than max_size of them.
+  """
+
+  def __init__(self, max_size=RECENT_AUCTIONS_SIZE,
+               max_age=RECENT_AUCTIONS_SECONDS):
+    self.max_size = max_size
+    self.max_age = max_age
+    # (character, message, bucket) to (timestamp, time written), oldest
+    # first.  The db's unique index allows one raw auction per key.
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def contains(self, timestamp, character, message):
+    bucket = time_bucket(timestamp)
+    oldest = time.monotonic() - self.max_age
+    with self._lock:
+      for key in (
+          (character, message, bucket - 1), (character, message, bucket),
+          (character, message, bucket + 1)):
+        entry = self._entries.get(key)
+        if (entry is not None and entry[1] >= oldest and
+            abs(entry[0] - timestamp) < db.DUPLICATE_WINDOW):
+          return True
+    return False
+
+  def add(self, auctions):
+    """Remembers auctions from parse_lines that were committed as new."""
+    now = time.monotonic()
+    oldest = now - self.max_age
+    with self._lock:
+      for _, timestamp, character, message, _ in auctions:
+        key = (character, message, time_bucket(timestamp))
+        self._entries[key] = (timestamp, now)
+        self._entries.move_to_end(key)
+      while self._entries:
+        _, (_, written) = next(iter(self._entries.items()))
+        if len(self._entries) <= self.max_size and written >= oldest:
+          break
+        self._entries.popitem(last=False)
+
+
+def time_bucket(timestamp):
+  """Returns the DUPLICATE_WINDOW-wide time bucket of a timestamp."""
+  return (timestamp - EPOCH) // db.DUPLICATE_WINDOW
+
+
+RECENT_AUCTIONS = RecentAuctions()
+
+
+class ReadCache(object):
+  """Caches GET response bodies, each of which is about one item.
+
+  Every item has a generation that goes up when an upload mentions it.
+  Entries remember the generation they were built at and are ignored once it
+  changes, so invalidating an item doesn't need to find its entries.
+  """
+
+  def __init__(self, max_size=READ_CACHE_SIZE, ttl=READ_CACHE_SECONDS):
+    self.ttl = ttl
+    self._entries = lru.LruCache(max_size)
+    self._generations = {}
+    self._lock = threading.Lock()
+
+  def generation(self, item_id):
+    return self._generations.get(item_id, 0)
+
+  def get(self, key, item_id):
+    """Returns the cached (etag, body) for key, or None."""
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+    generation, expires, etag, body = entry
+    if generation != self.generation(item_id) or expires < time.monotonic():
+      return None
+    return etag, body
+
+  def put(self, key, generation, etag, body):
+    """Caches a body built after reading generation for its item."""
+    self._entries.put(
+        key, (generation, time.monotonic() + self.ttl, etag, body))
+
+  def invalidate(self, item_ids):
+    """Call after committing changes to these items."""
+    with self._lock:
+      for item_id in item_ids:
+        self._generations[item_id] = self.generation(item_id) + 1
+
+
+READ_CACHE = ReadCache()
+
+
+def get_price_history(item_id, period, now):
+  end = now + datetime.timedelta(seconds=1)
+  start = rollups.period_start(now - HISTORY_LENGTHS[period], period)
+  history = []
+  for is_selling, period_start, rollup in db.get_price_rollups(
+      item_id, period, start, end):
+    entry = rollup.to_dict()
+    entry['start'] = period_start.strftime(ISO_FORMAT)
+    entry['is_selling'] = is_selling
+    history.append(entry)
+  return {'item_id': item_id, 'period': period, 'history': history}
+
+
+def get_recent_auctions(item_id):
+  auctions = []
+  for timestamp, character, is_selling, price, message in (
+      db.get_recent_auctions(item_id, RECENT_AUCTIONS_LIMIT)):
+    auctions.append({
+        'time': timestamp.strftime(ISO_FORMAT),
+        'character': character,
+        'is_selling': is_selling,
+        'price': price,
+        'message': message,
+    })
+  return {'item_id': item_id, 'auctions': auctions}
+
+
+def gunzip(data, max_size):
+  """Decompresses gzipped data, without ever holding more than max_size."""
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  result = decompressor.decompress(data, max_size + 1)
+  if len(result) > max_size:
+    raise BodyTooLargeError('The request body is too large')
+  if not decompressor.eof:
+    raise EOFError('Truncated gzip data')
+  return result
+
+
+class BadRequestError(Exception):
+  """Raised when a request body can't be decoded."""
+
+
+class BodyTooLargeError(Exception):
+  """Raised when a request body is bigger than MAX_BODY_BYTES."""
+
+
 class RequestHandler(http.server.BaseHTTPRequestHandler):
 
+  status = None
+
+  def do_GET(self):
+    start = time.perf_counter()
+    url = urllib.parse.urlsplit(self.path)
+    query = urllib.parse.parse_qs(url.query)
+    try:
+      if url.path == '/price_history':
+        self.price_history(query)
+      elif url.path == '/recent_auctions':
+        self.recent_auctions(query)
+      elif url.path == '/live_auctions':
+        self.live_auctions(query)
+      elif url.path == '/metrics':
+        self.send_metrics()
+      else:
+        self.send_error(404)
+    except BadRequestError as e:
+      self.send_error(400, str(e))
+    except db.CONNECTION_ERRORS:
+      self.send_error(503, 'Lost the database connection, please retry')
+    finally:
+      self.record_request(url.path, start)
+
   def do_POST(self):
-    if self.path != '/upload_log':
-      self.send_error(404)
+    start = time.perf_counter()
+    try:
+      if ITEMS_POLLER is not None and ITEMS_POLLER.items_version is None:
+        self.close_connection = True
+        self.send_error(503, 'The items are still loading, please retry')
+      elif self.path == '/upload_log':
+        self.upload_log()
+      elif self.path == '/upload_logs':
+        self.upload_logs()
+      else:
+        self.send_error(404)
+    except BadRequestError as e:
+      self.send_error(400, str(e))
+    except BodyTooLargeError as e:
+      self.send_error(413, str(e))
+    except db.CONNECTION_ERRORS:
+      # The broken connection has been dropped from the pool, so the client can
+      # retry.
+      self.send_error(503, 'Lost the database connection, please retry')
+    finally:
+      self.record_request(self.path, start)
+
+  def send_response(self, code, message=None):
+    self.status = code
+    super().send_response(code, message)
+
+  def record_request(self, path, start):
+    if path not in KNOWN_PATHS:
+      path = 'other'
+    REQUEST_SECONDS.labels(path).observe(time.perf_counter() - start)
+    REQUESTS.labels(path, str(self.status)).inc()
+
+  def send_metrics(self):
+    body = metrics.REGISTRY.render().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def read_body(self):
     content_length = int(self.headers.get('content-length', 0))
-    body = self.rfile.read(content_length).decode('utf-8').strip()
+    if content_length > MAX_BODY_BYTES:
+      self.close_connection = True
+      raise BodyTooLargeError('The request body is too large')
+    body = self.rfile.read(content_length)
+    try:
+      if self.headers.get('content-encoding') == 'gzip':
+        body = gunzip(body, MAX_BODY_BYTES)
+      return body.decode('utf-8').strip()
+    except (OSError, EOFError, UnicodeDecodeError, zlib.error):
+      raise BadRequestError('Could not decode the request body')
+
+  def upload_log(self):
+    """Handles a body of the client's local time and one EQ log line."""
+    body = self.read_body()
     client_time_str, sep, log_message = body.partition(' ')
     now = datetime.datetime.now()
     if not sep or not log_message:
       self.send_error(400, 'Need a timestamp followed by an EQ log message')
       return
-    log_timestamp, character, auction = parser.split_line(log_message)
-    if not log_timestamp or not character or not auction:
+    try:
+      client_time_offset = get_client_time_offset(now, client_time_str)
+    except ValueError:
+      self.send_error(400, 'Need a timestamp in ISO format')
+      return
+    if WRITE_QUEUE is not None:
+      auctions, duplicates = parse_lines(client_time_offset, [log_message])
+      if duplicates:
+        SKIPPED_TRANSACTIONS.inc()
+        self.send_response(200)
+        self.end_headers()
+      elif not auctions:
+        self.send_error(400, 'Need a valid auction message')
+      elif WRITE_QUEUE.put(auctions):
+        self.send_response(202)
+        self.end_headers()
+      else:
+        self.send_queue_full()
+      return
+    (status,) = ingest_lines(client_time_offset, [log_message])
+    if status == STATUS_INVALID:
       self.send_error(400, 'Need a valid auction message')
       return
-    client_time_offset = get_client_time_offset(now, client_time_str)
-    normalized_time = parser.parse_timestamp_normalized(
-        log_timestamp, client_time_offset)
-    character_id = db.get_or_create_character(character)
-    items = PARSER.parse_auction(auction)
-    raw_id = db.add_raw_auction(normalized_time, character_id, auction)
-    # If we've already seen this auction, raw_id will be None, signaling that we
-    # don't need to insert a new set of clean IDs.
-    if raw_id:
-      for item in items:
-        db.add_clean_auction(
-            raw_id, character_id, item.item_id, normalized_time,
-            item.is_selling, item.price)
     self.send_response(200)
     self.end_headers()
 
+  def upload_logs(self):
+    """Handles a body of the client's local time and many EQ log lines.
+
+    The first line of the body is the client's local time and every following
+    line is an EQ log line.  All lines are written in one transaction, and the
+    response is a JSON list with one status per log line.  With
+    --write-behind, the lines are queued instead and the response is a 202.
+    """
+    body = self.read_body()
+    client_time_str, sep, log_messages = body.partition('\n')
+    now = datetime.datetime.now()
+    if not sep or not log_messages:
+      self.send_error(400, 'Need a timestamp followed by EQ log messages')
+      return
+    try:
+      client_time_offset = get_client_time_offset(now, client_time_str.strip())
+    except ValueError:
+      self.send_error(400, 'Need a timestamp in ISO format')
+      return
+    log_messages = [
+        log_message.rstrip('\r') for log_message in log_messages.split('\n')]
+    if WRITE_QUEUE is not None:
+      auctions, duplicates = parse_lines(client_time_offset, log_messages)
+      if auctions and not WRITE_QUEUE.put(auctions):
+        self.send_queue_full()
+        return
+      statuses = [STATUS_INVALID] * len(log_messages)
+      for i in duplicates:
+        statuses[i] = STATUS_DUPLICATE
+      for auction in auctions:
+        statuses[auction[0]] = STATUS_QUEUED
+      code = 202
+    else:
+      statuses = ingest_lines(client_time_offset, log_messages)
+      code = 200
+    response = json.dumps(statuses).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+
+  def send_queue_full(self):
+    self.send_response(503)
+    self.send_header('Retry-After', str(MIN_RETRY_SECONDS))
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def price_history(self, query):
+    """Handles ?item_id=N&period=hour|day with rolled up prices."""
+    item_id = get_item_id(query)
+    period = query.get('period', ['day'])[0]
+    if period not in HISTORY_LENGTHS:
+      raise BadRequestError('period must be hour or day')
+    self.send_cached_json(
+        ('price_history', item_id, period), item_id,
+        lambda: get_price_history(item_id, period, datetime.datetime.now()))
+
+  def recent_auctions(self, query):
+    """Handles ?item_id=N with the newest auctions of the item."""
+    item_id = get_item_id(query)
+    self.send_cached_json(
+        ('recent_auctions', item_id), item_id,
+        lambda: get_recent_auctions(item_id))
+
+  def live_auctions(self, query):
+    """Handles ?after=N with the auctions since sequence number N.
+
+    Waits for a new auction if there isn't one yet.  item_id=N limits the
+    auctions to one item.  Nothing here reads the db.
+    """
+    if TICKER is None:
+      self.send_error(501, 'Live auctions need a server with one process')
+      return
+    after = get_int(query, 'after', 0)
+    item_id = get_int(query, 'item_id', None)
+    if LIVE_WAITERS.acquire(blocking=False):
+      try:
+        last_seq, entries = TICKER.wait(after, item_id, LIVE_POLL_SECONDS)
+      finally:
+        LIVE_WAITERS.release()
+    else:
+      last_seq, entries = TICKER.get(after, item_id)
+    auctions = []
+    for entry in entries:
+      auctions.append({
+          'seq': entry.seq,
+          'time': entry.timestamp.strftime(ISO_FORMAT),
+          'character': entry.character,
+          'message': entry.message,
+          'items': [
+              {'item_id': item.item_id, 'is_selling': item.is_selling,
+               'price': item.price}
+              for item in entry.items],
+      })
+    body = json.dumps(
+        {'last_seq': last_seq, 'auctions': auctions},
+        separators=(',', ':')).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('Cache-Control', 'no-store')
+    self.end_headers()
+    self.wfile.write(body)
+
+  def send_cached_json(self, key, item_id, build):
+    """Sends the JSON of build(), from READ_CACHE when possible."""
+    cached = READ_CACHE.get(key, item_id)
+    if cached:
+      etag, body = cached
+    else:
+      # Read the generation first, so that an upload that lands while this is
+      # being built makes it stale.
+      generation = READ_CACHE.generation(item_id)
+      body = json.dumps(build(), separators=(',', ':')).encode('utf-8')
+      etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+      READ_CACHE.put(key, generation, etag, body)
+    if etag_matches(self.headers.get('if-none-match'), etag):
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', etag)
+    # Let browsers keep the body but check back with If-None-Match.
+    self.send_header('Cache-Control', 'no-cache')
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def get_item_id(query):
+  try:
+    return int(query['item_id'][0])
+  except (KeyError, ValueError):
+    raise BadRequestError('Need a numeric item_id')
+
+
+def get_int(query, name, default):
+  if name not in query:
+    return default
+  try:
+    return int(query[name][0])
+  except ValueError:
+    raise BadRequestError('{} must be a number'.format(name))
+
+
+def etag_matches(if_none_match, etag):
+  if not if_none_match:
+    return False
+  if if_none_match.strip() == '*':
+    return True
+  for candidate in if_none_match.split(','):
+    candidate = candidate.strip()
+    if candidate.startswith('W/'):
+      candidate = candidate[2:]
+    if candidate == etag:
+      return True
+  return False
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+  """An HTTP server that handles requests on a fixed number of threads."""
+
+  # Let connections queue up in the kernel during bursts instead of being
+  # refused.
+  request_queue_size = 128
+
+  def __init__(self, server_address, handler_class, workers, reuse_port=False):
+    # With reuse_port, several processes can listen on the same port, and the
+    # kernel spreads the connections between them.
+    self.reuse_port = reuse_port
+    super().__init__(server_address, handler_class)
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+  def server_bind(self):
+    if self.reuse_port:
+      self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    super().server_bind()
+
+  def process_request(self, request, client_address):
+    self.executor.submit(self.process_request_thread, request, client_address)
+
+  def process_request_thread(self, request, client_address):
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      self.shutdown_request(request)
+
+  def server_close(self):
+    super().server_close()
+    self.executor.shutdown(wait=True)
+
+
+class Supervisor(object):
+  """Runs copies of a worker command, and restarts any that exit."""
+
+  def __init__(self, command, count):
+    self.command = command
+    self.processes = [None] * count
+
+  def start(self):
+    for i in range(len(self.processes)):
+      self.processes[i] = subprocess.Popen(self.command)
+
+  def check(self):
+    """Restarts workers that exited.  Returns how many there were."""
+    restarted = 0
+    for i, process in enumerate(self.processes):
+      returncode = process.poll()
+      if returncode is not None:
+        print('Worker {} exited with {}, restarting'.format(
+            process.pid, returncode))
+        self.processes[i] = subprocess.Popen(self.command)
+        restarted += 1
+    return restarted
+
+  def stop(self):
+    """Asks every worker to finish up, and waits for them."""
+    running = [process for process in self.processes if process is not None]
+    for process in running:
+      if process.poll() is None:
+        process.terminate()
+    for process in running:
+      process.wait()
+
+
+def parse_args():
+  arg_parser = argparse.ArgumentParser(description='Serves the p99tunnel API.')
+  arg_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+  arg_parser.add_argument(
+      '--workers', type=int, default=DEFAULT_WORKERS,
+      help='The number of requests handled at once.')
+  arg_parser.add_argument(
+      '--db-pool-size', type=int, default=None,
+      help='The maximum number of database connections.  Defaults to the '
+           'number of workers.')
+  arg_parser.add_argument(
+      '--snapshot', default=snapshot.DEFAULT_PATH,
+      help='Where to keep the compiled item matcher between restarts.')
+  arg_parser.add_argument(
+      '--reload-seconds', type=float, default=snapshot.DEFAULT_RELOAD_SECONDS,
+      help='How often to check the db for new items.')
+  arg_parser.add_argument(
+      '--trace-file',
+      help='Write a record of how sampled or chosen messages were parsed '
+           'here, for debugging misparses.')
+  arg_parser.add_argument(
+      '--trace-sample-rate', type=float, default=0,
+      help='The fraction of messages to trace, like 0.001.')
+  arg_parser.add_argument(
+      '--trace-message', action='append', default=[],
+      help='Always trace this auction message.  Can be repeated.')
+  arg_parser.add_argument(
+      '--write-behind', action='store_true',
+      help='Respond to uploads once they are parsed and queued, and write '
+           'them to the db in the background.')
+  arg_parser.add_argument(
+      '--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+      help='The most auctions to queue with --write-behind before turning '
+           'uploads away with a 503.')
+  arg_parser.add_argument(
+      '--queue-workers', type=int, default=DEFAULT_QUEUE_WORKERS,
+      help='The number of threads writing queued auctions.')
+  arg_parser.add_argument(
+      '--processes', type=int, default=1,
+      help='Serve from this many processes, which share the port and one '
+           'memory-mapped item matcher.  Dead processes are restarted.  '
+           '/live_auctions is only served with one process.')
+  # Set by the supervisor on the processes that it starts.
+  arg_parser.add_argument(
+      '--worker', action='store_true', help=argparse.SUPPRESS)
+  return arg_parser.parse_args()
+
+
+def handle_sigterm(signum, frame):
+  # Shut down the same way as for Ctrl-C, so that queued auctions get written.
+  raise KeyboardInterrupt
+
+
+def ignore_signals():
+  # Once shutting down, a second Ctrl-C, or the supervisor's SIGTERM after a
+  # Ctrl-C to the whole process group, shouldn't cut the cleanup short.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def serve(args):
+  global PARSER, ITEMS_POLLER, WRITE_QUEUE, TICKER, LIVE_WAITERS
+  queue_workers = args.queue_workers if args.write_behind else 0
+  db.configure_pool(args.db_pool_size or args.workers + queue_workers)
+  PARSER, items_version = snapshot.load_parser(args.snapshot)
+  if args.trace_file:
+    PARSER.tracer = tracing.Tracer(
+        args.trace_file, args.trace_sample_rate, args.trace_message)
+  if args.worker:
+    # The supervisor keeps the snapshot up to date.
+    poller = snapshot.Watcher(PARSER, items_version, args.snapshot)
+  else:
+    poller = snapshot.Reloader(
+        PARSER, items_version, args.snapshot, args.reload_seconds)
+    # Catch up with the db before serving, rather than parsing the first
+    # uploads with a missing or stale snapshot.
+    try:
+      poller.check()
+    except Exception:
+      traceback.print_exc()
+  ITEMS_POLLER = poller
+  poller.start()
+  if args.write_behind:
+    WRITE_QUEUE = WriteQueue(args.queue_size, queue_workers)
+  if args.worker:
+    TICKER = None
+  LIVE_WAITERS = threading.BoundedSemaphore(max(1, args.workers // 2))
+  print('Serving on port {} with {} workers in process {}'.format(
+      args.port, args.workers, os.getpid()))
+  server_address = ('', args.port)
+  httpd = PooledHTTPServer(
+      server_address, RequestHandler, args.workers, reuse_port=args.worker)
+  signal.signal(signal.SIGTERM, handle_sigterm)
+  try:
+    httpd.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    ignore_signals()
+    # Finish the requests in progress, then write whatever they queued.
+    if TICKER is not None:
+      TICKER.close()
+    httpd.server_close()
+    if WRITE_QUEUE is not None:
+      print('Writing {} queued auctions'.format(len(WRITE_QUEUE)))
+      WRITE_QUEUE.close()
+    poller.stop()
+
+
+def supervise(args):
+  """Runs args.processes servers, and rebuilds their matcher as items change.
+
+  Only the supervisor polls the db for new items.  It writes each new matcher
+  to the snapshot, and the workers map the snapshot into memory, so the pages
+  of the matcher are shared between all of them.
+  """
+  items_version, _ = snapshot.load(args.snapshot)
+  reloader = snapshot.Reloader(
+      None, items_version, args.snapshot, args.reload_seconds)
+  # Build a missing or stale snapshot before starting the workers, so that
+  # they don't all start without items.
+  try:
+    reloader.check()
+  except Exception:
+    traceback.print_exc()
+  reloader.start()
+  command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+  supervisor = Supervisor(command + ['--worker'], args.processes)
+  print('Serving on port {} with {} processes'.format(
+      args.port, args.processes))
+  signal.signal(signal.SIGTERM, handle_sigterm)
+  try:
+    supervisor.start()
+    while True:
+      time.sleep(SUPERVISE_SECONDS)
+      supervisor.check()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    ignore_signals()
+    supervisor.stop()
+    reloader.stop()
+
 
 def main():
-  print('Serving /upload_log on port 8000')
-  server_address = ('', 8000)
-  httpd = http.server.HTTPServer(server_address, RequestHandler)
-  httpd.serve_forever()
+  args = parse_args()
+  if args.processes > 1 and not args.worker:
+    supervise(args)
+  else:
+    serve(args)
 
 
 if __name__ == '__main__':
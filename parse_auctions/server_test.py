@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+
+import datetime
+import gzip
+import sys
+import threading
+import unittest
+import unittest.mock
+
+import psycopg2.extensions
+import requests
+
+from parse_auctions import parser
+from parse_auctions import server
+from parse_auctions import ticker
+
+
+NOW = datetime.datetime(2017, 1, 2, 13, 45, 35)
+LOG_LINES = [
+    "[Mon Jan 02 13:45:35 2017] Toon auctions, 'WTS Ale 5'",
+    'Toon says, hi',
+    "[Mon Jan 02 13:45:36 2017] Toon auctions, 'WTB Ale'",
+]
+
+RECENT_AUCTIONS = [
+    (datetime.datetime(2017, 1, 2, 13, 45, 35), 'Toon', True, 5000,
+     'WTS Cloak of Shadows 5k'),
+]
+
+
+class ReadCacheTest(unittest.TestCase):
+
+  def test_get_and_put(self):
+    cache = server.ReadCache()
+    self.assertIsNone(cache.get('key', 17))
+    cache.put('key', cache.generation(17), '"etag"', b'body')
+    self.assertEqual(cache.get('key', 17), ('"etag"', b'body'))
+
+  def test_invalidate(self):
+    cache = server.ReadCache()
+    cache.put('key', cache.generation(17), '"etag"', b'body')
+    cache.invalidate([13])
+    self.assertIsNotNone(cache.get('key', 17))
+    cache.invalidate([17])
+    self.assertIsNone(cache.get('key', 17))
+
+  def test_put_after_invalidate_is_stale(self):
+    cache = server.ReadCache()
+    generation = cache.generation(17)
+    cache.invalidate([17])
+    cache.put('key', generation, '"etag"', b'body')
+    self.assertIsNone(cache.get('key', 17))
+
+  def test_expires(self):
+    cache = server.ReadCache(ttl=-1)
+    cache.put('key', cache.generation(17), '"etag"', b'body')
+    self.assertIsNone(cache.get('key', 17))
+
+  def test_etag_matches(self):
+    self.assertTrue(server.etag_matches('"a"', '"a"'))
+    self.assertTrue(server.etag_matches('"b", W/"a"', '"a"'))
+    self.assertTrue(server.etag_matches('*', '"a"'))
+    self.assertFalse(server.etag_matches('"b"', '"a"'))
+    self.assertFalse(server.etag_matches(None, '"a"'))
+
+
+class RecentAuctionsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.recent = server.RecentAuctions(max_size=2)
+    self.recent.add([(0, NOW, 'Toon', 'WTS Ale', [])])
+
+  def test_contains(self):
+    second = datetime.timedelta(seconds=1)
+    self.assertTrue(self.recent.contains(NOW, 'Toon', 'WTS Ale'))
+    self.assertTrue(self.recent.contains(NOW + 59 * second, 'Toon', 'WTS Ale'))
+    self.assertTrue(self.recent.contains(NOW - 59 * second, 'Toon', 'WTS Ale'))
+    self.assertFalse(
+        self.recent.contains(NOW + 60 * second, 'Toon', 'WTS Ale'))
+    self.assertFalse(self.recent.contains(NOW, 'Other', 'WTS Ale'))
+    self.assertFalse(self.recent.contains(NOW, 'Toon', 'WTS ale'))
+
+  def test_max_size(self):
+    self.recent.add([
+        (0, NOW, 'Toon', 'WTB Ale', []), (0, NOW, 'Toon', 'WTB CoS', [])])
+    self.assertEqual(len(self.recent), 2)
+    self.assertFalse(self.recent.contains(NOW, 'Toon', 'WTS Ale'))
+    self.assertTrue(self.recent.contains(NOW, 'Toon', 'WTB CoS'))
+
+  def test_max_age(self):
+    self.recent.max_age = 0
+    self.assertFalse(self.recent.contains(NOW, 'Toon', 'WTS Ale'))
+    self.recent.add([])
+    self.assertEqual(len(self.recent), 0)
+
+
+class WriteQueueTest(unittest.TestCase):
+
+  def setUp(self):
+    patcher = unittest.mock.patch.object(
+        server, 'PARSER', parser.Parser(test_item_table={'ale': 17}))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.written = []
+    patcher = unittest.mock.patch.object(
+        server, 'write_auctions', self.write_auctions)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = unittest.mock.patch.object(server, 'TICKER', ticker.Ticker())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = unittest.mock.patch.object(
+        server, 'RECENT_AUCTIONS', server.RecentAuctions())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def write_auctions(self, cur, auctions):
+    self.written.extend(auctions)
+    return auctions
+
+  def test_parse_lines(self):
+    auctions, _ = server.parse_lines(datetime.timedelta(), LOG_LINES)
+    self.assertEqual([auction[0] for auction in auctions], [0, 2])
+    self.assertEqual(auctions[0][1], NOW)
+    self.assertEqual(auctions[1][4], [parser.Item(17, False, None)])
+
+  def test_parse_lines_drops_recent_duplicates(self):
+    auctions, duplicates = server.parse_lines(datetime.timedelta(), LOG_LINES)
+    self.assertEqual(duplicates, [])
+    server.publish(auctions[:1])
+    auctions, duplicates = server.parse_lines(
+        datetime.timedelta(seconds=5), LOG_LINES)
+    self.assertEqual(duplicates, [0])
+    self.assertEqual([auction[0] for auction in auctions], [2])
+
+  def test_writes_everything_on_close(self):
+    write_queue = server.WriteQueue(max_size=10, workers=2, batch_size=1)
+    auctions, _ = server.parse_lines(datetime.timedelta(), LOG_LINES)
+    with unittest.mock.patch('db.transaction'):
+      self.assertTrue(write_queue.put(auctions))
+      write_queue.close()
+    self.assertEqual(sorted(self.written), sorted(auctions))
+    self.assertEqual(len(write_queue), 0)
+    last_seq, entries = server.TICKER.get()
+    self.assertEqual(last_seq, 2)
+    self.assertEqual(
+        sorted(entry.message for entry in entries), ['WTB Ale', 'WTS Ale 5'])
+
+  def test_retries_after_deadlock(self):
+    write_queue = server.WriteQueue(max_size=10, workers=1)
+    auctions, _ = server.parse_lines(datetime.timedelta(), LOG_LINES)
+    deadlock = psycopg2.extensions.TransactionRollbackError('deadlock')
+    with unittest.mock.patch('db.transaction') as transaction:
+      transaction.side_effect = [deadlock, deadlock, unittest.mock.DEFAULT]
+      self.assertTrue(write_queue.put(auctions))
+      write_queue.close()
+    self.assertEqual(transaction.call_count, 3)
+    self.assertEqual(sorted(self.written), sorted(auctions))
+
+  def test_gives_up_after_deadlocks(self):
+    write_queue = server.WriteQueue(max_size=10, workers=1)
+    auctions, _ = server.parse_lines(datetime.timedelta(), LOG_LINES)
+    deadlock = psycopg2.extensions.TransactionRollbackError('deadlock')
+    with unittest.mock.patch('db.transaction', side_effect=deadlock) as \
+         transaction, \
+         unittest.mock.patch.object(server, 'MAX_ROLLBACK_ATTEMPTS', 3), \
+         unittest.mock.patch.object(server, 'ROLLBACK_RETRY_SECONDS', 0):
+      self.assertTrue(write_queue.put(auctions))
+      write_queue.close()
+    self.assertEqual(transaction.call_count, 3)
+    self.assertEqual(self.written, [])
+    self.assertEqual(len(write_queue), 0)
+
+  def test_full(self):
+    write_queue = server.WriteQueue(max_size=1, workers=0)
+    auctions, _ = server.parse_lines(datetime.timedelta(), LOG_LINES)
+    self.assertFalse(write_queue.put(auctions))
+    self.assertTrue(write_queue.put(auctions[:1]))
+    self.assertFalse(write_queue.put(auctions[:1]))
+    self.assertEqual(len(write_queue), 1)
+
+  def test_upload_is_queued(self):
+    write_queue = server.WriteQueue(max_size=10, workers=0)
+    patcher = unittest.mock.patch.object(server, 'WRITE_QUEUE', write_queue)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    httpd = server.PooledHTTPServer(('127.0.0.1', 0), server.RequestHandler, 1)
+    threading.Thread(
+        target=httpd.serve_forever, kwargs={'poll_interval': 0.01},
+        daemon=True).start()
+    self.addCleanup(httpd.server_close)
+    self.addCleanup(httpd.shutdown)
+    response = requests.post(
+        'http://127.0.0.1:{}/upload_log'.format(httpd.server_port),
+        data='2017-01-02T13:45:35 ' + LOG_LINES[0])
+    self.assertEqual(response.status_code, 202)
+    self.assertEqual(len(write_queue), 1)
+
+
+class SupervisorTest(unittest.TestCase):
+
+  def test_restarts_workers(self):
+    supervisor = server.Supervisor([sys.executable, '-c', 'pass'], 2)
+    supervisor.start()
+    for process in supervisor.processes:
+      process.wait()
+    self.assertEqual(supervisor.check(), 2)
+    supervisor.stop()
+    self.assertTrue(all(
+        process.returncode is not None for process in supervisor.processes))
+
+
+class UploadApiTest(unittest.TestCase):
+
+  def setUp(self):
+    for name, value in (
+        ('PARSER', parser.Parser(test_item_table={'ale': 17})),
+        ('RECENT_AUCTIONS', server.RecentAuctions()),
+        ('READ_CACHE', server.ReadCache()),
+        ('TICKER', ticker.Ticker()),
+        ('write_auctions', self.write_auctions)):
+      patcher = unittest.mock.patch.object(server, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    patcher = unittest.mock.patch('db.transaction')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.written = set()
+    self.server = server.PooledHTTPServer(
+        ('127.0.0.1', 0), server.RequestHandler, 2)
+    threading.Thread(
+        target=self.server.serve_forever, kwargs={'poll_interval': 0.01},
+        daemon=True).start()
+    self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def write_auctions(self, cur, auctions):
+    # Stands in for the db, which only adds the first copy of an auction.
+    new_auctions = []
+    for auction in auctions:
+      key = (auction[2], auction[3])
+      if key not in self.written:
+        self.written.add(key)
+        new_auctions.append(auction)
+    return new_auctions
+
+  def upload_logs(self, lines, client_time='2017-01-02T13:45:35'):
+    return requests.post(
+        self.url + '/upload_logs', data='\n'.join([client_time] + lines))
+
+  def test_upload_logs_statuses(self):
+    lines = LOG_LINES + [
+        "[Mon Jxn 02 13:45:37 2017] Toon auctions, 'WTS Ale 6'",
+        "[Thu Feb 30 13:45:37 2017] Toon auctions, 'WTS Ale 7'",
+        "[Mon Jan 02 13:45:38 2017] Toon auctions, 'WTS Ale 5'",
+    ]
+    response = self.upload_logs(lines)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+        response.json(),
+        ['added', 'invalid', 'added', 'invalid', 'invalid', 'duplicate'])
+    # The second time, they're caught before the db.
+    response = self.upload_logs(lines)
+    self.assertEqual(
+        response.json(),
+        ['duplicate', 'invalid', 'duplicate', 'invalid', 'invalid',
+         'duplicate'])
+
+  def test_uploads_wait_for_items(self):
+    poller = unittest.mock.Mock(items_version=None)
+    with unittest.mock.patch.object(server, 'ITEMS_POLLER', poller):
+      self.assertEqual(self.upload_logs(LOG_LINES).status_code, 503)
+      self.assertEqual(self.written, set())
+      poller.items_version = 'v1'
+      self.assertEqual(self.upload_logs(LOG_LINES).status_code, 200)
+
+  def test_upload_logs_bad_client_time(self):
+    response = self.upload_logs(LOG_LINES, client_time='yesterday')
+    self.assertEqual(response.status_code, 400)
+
+  def test_upload_logs_gzipped(self):
+    body = '\n'.join(['2017-01-02T13:45:35'] + LOG_LINES).encode('utf-8')
+    response = requests.post(
+        self.url + '/upload_logs', data=gzip.compress(body),
+        headers={'Content-Encoding': 'gzip'})
+    self.assertEqual(response.json(), ['added', 'invalid', 'added'])
+
+  def test_upload_logs_too_large(self):
+    body = gzip.compress(b'2017-01-02T13:45:35\n' + b' ' * 10000)
+    with unittest.mock.patch.object(server, 'MAX_BODY_BYTES', 1000):
+      response = requests.post(
+          self.url + '/upload_logs', data=body,
+          headers={'Content-Encoding': 'gzip'})
+      self.assertEqual(response.status_code, 413)
+      response = requests.post(
+          self.url + '/upload_logs', data=b'x' * 1001)
+      self.assertEqual(response.status_code, 413)
+
+  def test_upload_logs_truncated(self):
+    body = gzip.compress(b'2017-01-02T13:45:35\n' + b' ' * 10000)
+    response = requests.post(
+        self.url + '/upload_logs', data=body[:-10],
+        headers={'Content-Encoding': 'gzip'})
+    self.assertEqual(response.status_code, 400)
+
+  def test_upload_log(self):
+    response = requests.post(
+        self.url + '/upload_log', data='2017-01-02T13:45:35 ' + LOG_LINES[0])
+    self.assertEqual(response.status_code, 200)
+    response = requests.post(
+        self.url + '/upload_log', data='2017-01-02T13:45:35 ' + LOG_LINES[1])
+    self.assertEqual(response.status_code, 400)
+
+  def test_upload_log_bad_timestamps(self):
+    response = requests.post(
+        self.url + '/upload_log', data='yesterday ' + LOG_LINES[0])
+    self.assertEqual(response.status_code, 400)
+    response = requests.post(
+        self.url + '/upload_log',
+        data="2017-01-02T13:45:35 [Thu Feb 30 13:45:37 2017] Toon auctions, "
+             "'WTS Ale 7'")
+    self.assertEqual(response.status_code, 400)
+
+
+class ReadApiTest(unittest.TestCase):
+
+  def setUp(self):
+    patcher = unittest.mock.patch.object(
+        server, 'READ_CACHE', server.ReadCache())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = unittest.mock.patch(
+        'db.get_recent_auctions', return_value=RECENT_AUCTIONS)
+    self.get_recent_auctions = patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = unittest.mock.patch.object(server, 'TICKER', ticker.Ticker())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.server = server.PooledHTTPServer(
+        ('127.0.0.1', 0), server.RequestHandler, 2)
+    threading.Thread(
+        target=self.server.serve_forever, kwargs={'poll_interval': 0.01},
+        daemon=True).start()
+    self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_recent_auctions(self):
+    response = requests.get(self.url + '/recent_auctions?item_id=13')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()['auctions'][0]['price'], 5000)
+    response = requests.get(
+        self.url + '/recent_auctions?item_id=13',
+        headers={'If-None-Match': response.headers['ETag']})
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(self.get_recent_auctions.call_count, 1)
+
+  def test_upload_invalidates(self):
+    requests.get(self.url + '/recent_auctions?item_id=13')
+    server.READ_CACHE.invalidate([13])
+    requests.get(self.url + '/recent_auctions?item_id=13')
+    self.assertEqual(self.get_recent_auctions.call_count, 2)
+
+  def test_metrics(self):
+    requests.get(self.url + '/recent_auctions?item_id=13')
+    response = requests.get(self.url + '/metrics')
+    self.assertEqual(response.status_code, 200)
+    self.assertIn(
+        'p99tunnel_requests_total{path="/recent_auctions",status="200"}',
+        response.text)
+
+  def test_live_auctions(self):
+    server.TICKER.add([
+        (NOW, 'Toon', 'WTS Ale 5', [parser.Item(17, True, 5)]),
+        (NOW, 'Toon', 'WTB CoS', [parser.Item(13, False)])])
+    response = requests.get(self.url + '/live_auctions?item_id=13')
+    self.assertEqual(response.json()['last_seq'], 2)
+    self.assertEqual(
+        [auction['message'] for auction in response.json()['auctions']],
+        ['WTB CoS'])
+    threading.Timer(0.05, server.TICKER.add, [[
+        (NOW, 'Toon', 'WTS CoS 5k', [parser.Item(13, True, 5000)])]]).start()
+    response = requests.get(self.url + '/live_auctions?item_id=13&after=2')
+    self.assertEqual(response.json()['auctions'][0]['seq'], 3)
+    self.assertEqual(
+        response.json()['auctions'][0]['items'],
+        [{'item_id': 13, 'is_selling': True, 'price': 5000}])
+
+  def test_no_live_auctions_with_processes(self):
+    with unittest.mock.patch.object(server, 'TICKER', None), \
+         unittest.mock.patch.object(
+             server, 'RECENT_AUCTIONS', server.RecentAuctions()):
+      response = requests.get(self.url + '/live_auctions')
+      self.assertEqual(response.status_code, 501)
+      server.publish([
+          (0, NOW, 'Toon', 'WTS Ale 5', [parser.Item(17, True, 5)])])
+
+  def test_bad_requests(self):
+    response = requests.get(self.url + '/recent_auctions?item_id=x')
+    self.assertEqual(response.status_code, 400)
+    response = requests.get(
+        self.url + '/price_history?item_id=13&period=week')
+    self.assertEqual(response.status_code, 400)
+    response = requests.get(self.url + '/live_auctions?after=x')
+    self.assertEqual(response.status_code, 400)
+    response = requests.get(self.url + '/nothing')
+    self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+  unittest.main()
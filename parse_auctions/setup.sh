@@ -2,4 +2,3 @@
 set -euxo pipefail
 
 sudo apt-get install -y python3-dateutil
-sudo pip3 install pytrie
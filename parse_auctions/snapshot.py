@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import struct
+import threading
+import traceback
+
+import db
+from parse_auctions import matcher
+from parse_auctions import parser
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(SCRIPT_DIR, '.matcher-snapshot')
+# A snapshot is this header, then the items version padded to a multiple of 4
+# bytes, then the matcher's tables.  Bump FORMAT_VERSION whenever build_matcher
+# changes, so that old snapshots get rebuilt instead of loaded.
+MAGIC = b'P99S'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('=4sII')
+# How often to check the db for new items.
+DEFAULT_RELOAD_SECONDS = 60
+# How often processes that share a snapshot check it for new items.
+DEFAULT_WATCH_SECONDS = 1
+
+
+def save(path, items_version, item_matcher):
+  """Atomically writes a compiled matcher to path."""
+  temp_path = '{}.{}.tmp'.format(path, os.getpid())
+  version_bytes = items_version.encode('utf-8')
+  with open(temp_path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(version_bytes)))
+    f.write(version_bytes + b'\0' * (-len(version_bytes) % 4))
+    f.write(item_matcher.to_bytes())
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(temp_path, path)
+
+
+def load(path):
+  """Returns (items_version, matcher) from a snapshot at path.
+
+  The matcher uses the file's pages directly, so every process that loads the
+  same snapshot shares one copy of it in memory.  Returns (None, None) if
+  there's no usable snapshot.
+  """
+  try:
+    with open(path, 'rb') as f:
+      # The map stays open for as long as the matcher uses it, even after the
+      # file is closed or replaced by a newer snapshot.
+      buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, format_version, version_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+      return None, None
+    offset = HEADER.size
+    items_version = buffer[offset:offset + version_size].decode('utf-8')
+    offset += version_size + -version_size % 4
+    item_matcher = matcher.Matcher.from_buffer(memoryview(buffer)[offset:])
+  except (OSError, ValueError, struct.error, UnicodeDecodeError):
+    return None, None
+  return items_version, item_matcher
+
+
+class Poller(object):
+  """Calls check every interval seconds on a background thread."""
+
+  def __init__(self, interval):
+    self.interval = interval
+    self._stop = threading.Event()
+    self._thread = None
+
+  def check(self):
+    raise NotImplementedError
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self._thread:
+      self._thread.join()
+
+  def _run(self):
+    # Check right away, in case the snapshot was stale or missing.
+    while True:
+      try:
+        if self.check():
+          print('Reloaded items, version ' + self.items_version)
+      except Exception:
+        # Keep serving with the current items, and try again later.
+        traceback.print_exc()
+      if self._stop.wait(self.interval):
+        return
+
+
+class Reloader(Poller):
+  """Keeps a snapshot, and optionally a parser, up to date with the db.
+
+  Whenever the items or item_names tables change, a new matcher is built in
+  the background, written to the snapshot, and then swapped into the parser.
+  """
+
+  def __init__(self, auction_parser, items_version, path=DEFAULT_PATH,
+               interval=DEFAULT_RELOAD_SECONDS):
+    super().__init__(interval)
+    self.parser = auction_parser
+    self.items_version = items_version
+    self.path = path
+
+  def check(self):
+    """Rebuilds the matcher if the items changed.  Returns True if it did."""
+    items_version = db.get_items_version()
+    if items_version == self.items_version:
+      return False
+    item_matcher = parser.load_matcher()
+    save(self.path, items_version, item_matcher)
+    if self.parser is not None:
+      self.parser.set_matcher(item_matcher)
+    self.items_version = items_version
+    return True
+
+
+class Watcher(Poller):
+  """Keeps a parser up to date with a snapshot that a Reloader writes.
+
+  This lets many processes share one Reloader, so that only one of them polls
+  the db and builds matchers.
+  """
+
+  def __init__(self, auction_parser, items_version, path=DEFAULT_PATH,
+               interval=DEFAULT_WATCH_SECONDS):
+    super().__init__(interval)
+    self.parser = auction_parser
+    self.items_version = items_version
+    self.path = path
+
+  def check(self):
+    """Loads the snapshot if it has new items.  Returns True if it did."""
+    items_version, item_matcher = load(self.path)
+    if item_matcher is None or items_version == self.items_version:
+      return False
+    self.parser.set_matcher(item_matcher)
+    self.items_version = items_version
+    return True
+
+
+def load_parser(path=DEFAULT_PATH):
+  """Returns a parser and its items version, without touching the db.
+
+  The parser starts with the items in the snapshot, or with no items at all if
+  there isn't one, until a Reloader catches it up.
+  """
+  items_version, item_matcher = load(path)
+  if item_matcher is None:
+    item_matcher = parser.build_matcher({})
+  return parser.Parser(item_matcher=item_matcher), items_version
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from parse_auctions import parser
+from parse_auctions import snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.temp_dir.name, 'snapshot')
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def test_save_and_load(self):
+    snapshot.save(self.path, 'v1', parser.build_matcher({'ale': 17}))
+    items_version, item_matcher = snapshot.load(self.path)
+    self.assertEqual(items_version, 'v1')
+    auction_parser = parser.Parser(item_matcher=item_matcher)
+    self.assertEqual(
+        auction_parser.parse_auction('WTS Ale 5'), [parser.Item(17, True, 5)])
+
+  def test_load_missing(self):
+    self.assertEqual(snapshot.load(self.path), (None, None))
+
+  def test_load_corrupt(self):
+    with open(self.path, 'wb') as f:
+      f.write(b'not a snapshot')
+    self.assertEqual(snapshot.load(self.path), (None, None))
+
+  def test_load_old_format(self):
+    with unittest.mock.patch.object(snapshot, 'FORMAT_VERSION', 0):
+      snapshot.save(self.path, 'v1', parser.build_matcher({'ale': 17}))
+    self.assertEqual(snapshot.load(self.path), (None, None))
+
+  def test_load_parser_without_snapshot(self):
+    auction_parser, items_version = snapshot.load_parser(self.path)
+    self.assertIsNone(items_version)
+    self.assertEqual(auction_parser.parse_auction('WTS Ale 5'), [])
+
+  def test_reloader(self):
+    auction_parser, items_version = snapshot.load_parser(self.path)
+    reloader = snapshot.Reloader(auction_parser, items_version, self.path)
+    with unittest.mock.patch('db.get_items_version', return_value='v2'), \
+        unittest.mock.patch.object(
+            parser, 'load_matcher',
+            return_value=parser.build_matcher({'ale': 17})):
+      self.assertTrue(reloader.check())
+      self.assertFalse(reloader.check())
+    self.assertEqual(
+        auction_parser.parse_auction('WTS Ale 5'), [parser.Item(17, True, 5)])
+    self.assertEqual(snapshot.load(self.path)[0], 'v2')
+
+  def test_reloader_without_parser(self):
+    reloader = snapshot.Reloader(None, None, self.path)
+    with unittest.mock.patch('db.get_items_version', return_value='v2'), \
+        unittest.mock.patch.object(
+            parser, 'load_matcher',
+            return_value=parser.build_matcher({'ale': 17})):
+      self.assertTrue(reloader.check())
+    self.assertEqual(snapshot.load(self.path)[0], 'v2')
+
+  def test_watcher(self):
+    auction_parser, items_version = snapshot.load_parser(self.path)
+    watcher = snapshot.Watcher(auction_parser, items_version, self.path)
+    self.assertFalse(watcher.check())
+    snapshot.save(self.path, 'v1', parser.build_matcher({'ale': 17}))
+    self.assertTrue(watcher.check())
+    self.assertFalse(watcher.check())
+    self.assertEqual(watcher.items_version, 'v1')
+    self.assertEqual(
+        auction_parser.parse_auction('WTS Ale 5'), [parser.Item(17, True, 5)])
+
+
+if __name__ == '__main__':
+  unittest.main()
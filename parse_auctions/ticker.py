@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+
+import lru
+
+
+# The most auctions kept for the feed of every item, and for each item's own
+# feed.  Only the items auctioned most recently have feeds of their own.
+DEFAULT_SIZE = 1000
+DEFAULT_ITEM_SIZE = 50
+DEFAULT_MAX_ITEMS = 2000
+
+
+Entry = collections.namedtuple(
+    'Entry', ['seq', 'timestamp', 'character', 'message', 'items'])
+
+
+class Ticker(object):
+  """Keeps the newest auctions in memory, for live feeds.
+
+  Each auction gets a sequence number, so that clients can ask for the
+  auctions after the last one they saw.  Memory use is fixed: at most size
+  auctions in the feed of every item, and item_size in each of max_items item
+  feeds.  The feeds share their entries.
+  """
+
+  def __init__(
+      self, size=DEFAULT_SIZE, item_size=DEFAULT_ITEM_SIZE,
+      max_items=DEFAULT_MAX_ITEMS):
+    self.item_size = item_size
+    self.last_seq = 0
+    self._all = collections.deque(maxlen=size)
+    self._items = lru.LruCache(max_items)
+    self._condition = threading.Condition()
+    self._closed = False
+
+  def add(self, auctions):
+    """Adds (timestamp, character, message, items) tuples, newest last."""
+    if not auctions:
+      return
+    with self._condition:
+      for timestamp, character, message, items in auctions:
+        self.last_seq += 1
+        entry = Entry(self.last_seq, timestamp, character, message, items)
+        self._all.append(entry)
+        for item_id in set(item.item_id for item in items):
+          feed = self._items.get(item_id)
+          if feed is None:
+            feed = collections.deque(maxlen=self.item_size)
+            self._items.put(item_id, feed)
+          feed.append(entry)
+      self._condition.notify_all()
+
+  def get(self, after=0, item_id=None):
+    """Returns the last sequence number and the entries after after.
+
+    The entries are for every item, or only for item_id, oldest first.  Pass
+    the returned sequence number as after to get only newer entries next time.
+    """
+    with self._condition:
+      return self.last_seq, self._get(after, item_id)
+
+  def wait(self, after=0, item_id=None, timeout=None):
+    """Like get, but waits up to timeout seconds if there are no entries."""
+    entries = []
+
+    def ready():
+      entries[:] = self._get(after, item_id)
+      return entries or self._closed
+
+    with self._condition:
+      self._condition.wait_for(ready, timeout)
+      return self.last_seq, entries
+
+  def close(self):
+    """Wakes up every waiter, so that the server can shut down."""
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+
+  def _get(self, after, item_id):
+    if after > self.last_seq:
+      # The client saw sequence numbers from before a restart.
+      after = 0
+    if item_id is None:
+      feed = self._all
+    else:
+      feed = self._items.get(item_id, ())
+    entries = []
+    for entry in reversed(feed):
+      if entry.seq <= after:
+        break
+      entries.append(entry)
+    entries.reverse()
+    return entries
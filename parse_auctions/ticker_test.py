@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import datetime
+import threading
+import unittest
+
+from parse_auctions import parser
+from parse_auctions import ticker
+
+
+NOW = datetime.datetime(2017, 1, 2, 13, 45, 35)
+ALE = parser.Item(17, True, 5)
+COS = parser.Item(13, False)
+
+
+class TickerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.ticker = ticker.Ticker(size=3, item_size=2, max_items=2)
+
+  def add(self, message, items):
+    self.ticker.add([(NOW, 'Toon', message, items)])
+
+  def messages(self, after=0, item_id=None):
+    last_seq, entries = self.ticker.get(after, item_id)
+    return [entry.message for entry in entries]
+
+  def test_get(self):
+    self.add('WTS Ale', [ALE])
+    self.add('WTB CoS', [COS])
+    self.add('WTS Ale WTB CoS', [ALE, COS])
+    self.assertEqual(
+        self.messages(), ['WTS Ale', 'WTB CoS', 'WTS Ale WTB CoS'])
+    self.assertEqual(self.messages(after=2), ['WTS Ale WTB CoS'])
+    self.assertEqual(self.messages(item_id=13), ['WTB CoS', 'WTS Ale WTB CoS'])
+    self.assertEqual(self.messages(item_id=99), [])
+    self.assertEqual(self.ticker.get(after=3), (3, []))
+
+  def test_bounded(self):
+    for i in range(5):
+      self.add('WTS Ale {}'.format(i), [ALE])
+    self.add('WTB CoS', [COS])
+    self.add('WTS Yaulp', [parser.Item(21, True)])
+    self.assertEqual(self.messages(), ['WTS Ale 4', 'WTB CoS', 'WTS Yaulp'])
+    self.assertEqual(self.messages(item_id=21), ['WTS Yaulp'])
+    # Ale had the oldest feed, so it was dropped.
+    self.assertEqual(self.messages(item_id=17), [])
+
+  def test_after_restart(self):
+    self.add('WTS Ale', [ALE])
+    self.assertEqual(self.messages(after=100), ['WTS Ale'])
+
+  def test_wait(self):
+    threading.Timer(0.05, self.add, ['WTS Ale', [ALE]]).start()
+    last_seq, entries = self.ticker.wait(item_id=17, timeout=5)
+    self.assertEqual(last_seq, 1)
+    self.assertEqual(entries[0].items, [ALE])
+
+  def test_wait_timeout(self):
+    self.assertEqual(self.ticker.wait(timeout=0.01), (0, []))
+
+  def test_close_wakes_waiters(self):
+    threading.Timer(0.05, self.ticker.close).start()
+    self.assertEqual(self.ticker.wait(timeout=5), (0, []))
+
+
+if __name__ == '__main__':
+  unittest.main()
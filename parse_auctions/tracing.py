@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import logging
+import logging.handlers
+import random
+
+
+# Trace files are rotated at this size, keeping this many old ones.
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+
+class Tracer(object):
+  """Writes a record of how the parser handled some auction messages.
+
+  Messages are traced if they are one of the given messages (ignoring case),
+  or otherwise with probability sample_rate.  Each trace is one JSON object
+  per line, with the message, the parser's decisions, and the items found.
+  """
+
+  def __init__(
+      self, path, sample_rate=0, messages=(), max_bytes=DEFAULT_MAX_BYTES,
+      backup_count=DEFAULT_BACKUP_COUNT):
+    self.sample_rate = sample_rate
+    self.messages = frozenset(message.lower() for message in messages)
+    # A logger of its own, so that traces don't end up in the root logger's
+    # output too.  The handler does the locking for concurrent writes.
+    self._logger = logging.Logger('p99tunnel.trace')
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    self._logger.addHandler(handler)
+
+  def should_trace(self, lowercase_message):
+    if lowercase_message in self.messages:
+      return True
+    return self.sample_rate > 0 and random.random() < self.sample_rate
+
+  def write(self, message, events, items):
+    self._logger.info(json.dumps({
+        'time': datetime.datetime.now().isoformat(),
+        'message': message,
+        'events': events,
+        'items': [list(item) for item in items],
+    }))
+
+  def close(self):
+    for handler in self._logger.handlers:
+      handler.close()
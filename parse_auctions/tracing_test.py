@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+
+from parse_auctions import parser
+from parse_auctions import tracing
+
+
+class TracingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.temp_dir.name, 'trace.log')
+    self.parser = parser.Parser(
+        test_item_table={'ale': 17, 'cloak of shadows': 13},
+        test_alias_table={'cos': 13})
+
+  def tearDown(self):
+    if self.parser.tracer:
+      self.parser.tracer.close()
+    self.temp_dir.cleanup()
+
+  def read_traces(self):
+    with open(self.path, 'r') as f:
+      return [json.loads(line) for line in f]
+
+  def test_traces_chosen_messages(self):
+    self.parser.tracer = tracing.Tracer(self.path, messages=['WTB Ale 5'])
+    self.parser.parse_auction('WTS Ale 10')
+    self.parser.parse_auction('wtb ale 5')
+    trace, = self.read_traces()
+    self.assertEqual(trace['message'], 'wtb ale 5')
+    self.assertEqual(trace['items'], [[17, False, 5]])
+    self.assertEqual(
+        [event['event'] for event in trace['events']], ['keyword', 'item'])
+    self.assertEqual(trace['events'][1]['price_text'], ' 5')
+
+  def test_sampling(self):
+    self.parser.tracer = tracing.Tracer(self.path, sample_rate=1)
+    self.parser.parse_auction('WTS cost CoS')
+    self.parser.parse_auction('WTS cost CoS')
+    traces = self.read_traces()
+    self.assertEqual(len(traces), 2)
+    self.assertEqual(
+        [event['event'] for event in traces[0]['events']],
+        ['alias_in_word', 'keyword', 'alias'])
+
+  def test_no_tracing(self):
+    self.parser.tracer = tracing.Tracer(self.path)
+    self.parser.parse_auction('WTS Ale 10')
+    self.assertEqual(self.read_traces(), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import math
+
+
+PERIODS = ('hour', 'day')
+# Prices are counted in a histogram of geometrically growing buckets, which is
+# enough for percentiles that are within about 10% of the real ones.  Bucket 0
+# holds prices under 1pp, bucket i holds prices in
+# [HISTOGRAM_RATIO ** (i - 1), HISTOGRAM_RATIO ** i), and the last bucket also
+# holds everything above that, which is a bit over 30 million pp.  Histograms
+# are kept sparse, as a dict of bucket to count, since an item's prices only
+# fall into a few buckets.
+HISTOGRAM_RATIO = 1.2
+HISTOGRAM_SIZE = 96
+
+
+def period_start(timestamp, period):
+  """Returns the start of the hour or day that timestamp is in."""
+  if period == 'hour':
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+  if period == 'day':
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+  raise ValueError('Unknown period: ' + period)
+
+
+def histogram_bucket(price):
+  if price < 1:
+    return 0
+  return min(int(math.log(price, HISTOGRAM_RATIO)) + 1, HISTOGRAM_SIZE - 1)
+
+
+def bucket_price(bucket):
+  """Returns a typical price for a histogram bucket."""
+  if bucket == 0:
+    return 0
+  return HISTOGRAM_RATIO ** (bucket - 0.5)
+
+
+class Rollup(object):
+  """Summarizes the auctions for one item and side over some time."""
+
+  def __init__(
+      self, auction_count=0, price_count=0, min_price=None, max_price=None,
+      price_sum=0, price_histogram=None):
+    self.auction_count = auction_count
+    self.price_count = price_count
+    self.min_price = min_price
+    self.max_price = max_price
+    self.price_sum = price_sum
+    self.price_histogram = dict(price_histogram or {})
+
+  def add(self, price):
+    self.auction_count += 1
+    if price is None:
+      return
+    self.price_count += 1
+    if self.min_price is None or price < self.min_price:
+      self.min_price = price
+    if self.max_price is None or price > self.max_price:
+      self.max_price = price
+    self.price_sum += price
+    bucket = histogram_bucket(price)
+    self.price_histogram[bucket] = self.price_histogram.get(bucket, 0) + 1
+
+  def merge(self, other):
+    self.auction_count += other.auction_count
+    self.price_count += other.price_count
+    for price in (other.min_price, other.max_price):
+      if price is not None:
+        if self.min_price is None or price < self.min_price:
+          self.min_price = price
+        if self.max_price is None or price > self.max_price:
+          self.max_price = price
+    self.price_sum += other.price_sum
+    for bucket, count in other.price_histogram.items():
+      self.price_histogram[bucket] = (
+          self.price_histogram.get(bucket, 0) + count)
+
+  def percentile(self, fraction):
+    """Returns the approximate price below which fraction of prices fall."""
+    if not self.price_count:
+      return None
+    rank = fraction * (self.price_count - 1)
+    seen = 0
+    for bucket, count in sorted(self.price_histogram.items()):
+      seen += count
+      if seen > rank:
+        price = bucket_price(bucket)
+        return int(round(min(max(price, self.min_price), self.max_price)))
+    return self.max_price
+
+  def to_dict(self):
+    mean = None
+    if self.price_count:
+      mean = int(round(self.price_sum / self.price_count))
+    return {
+        'count': self.auction_count,
+        'price_count': self.price_count,
+        'min': self.min_price,
+        'max': self.max_price,
+        'mean': mean,
+        'p25': self.percentile(0.25),
+        'median': self.percentile(0.5),
+        'p75': self.percentile(0.75),
+        'p90': self.percentile(0.9),
+    }
+
+
+def aggregate(auctions):
+  """Rolls up (item_id, timestamp, is_selling, price) tuples.
+
+  Returns a dict of (item_id, is_selling, period, period_start) to Rollup, with
+  a key for every period in PERIODS.
+  """
+  rollups = {}
+  for item_id, timestamp, is_selling, price in auctions:
+    for period in PERIODS:
+      key = (item_id, is_selling, period, period_start(timestamp, period))
+      rollup = rollups.get(key)
+      if rollup is None:
+        rollup = rollups[key] = Rollup()
+      rollup.add(price)
+  return rollups
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import datetime
+import unittest
+
+import rollups
+
+
+class RollupsTest(unittest.TestCase):
+
+  def test_period_start(self):
+    timestamp = datetime.datetime(2017, 1, 2, 13, 45, 35)
+    self.assertEqual(
+        rollups.period_start(timestamp, 'hour'),
+        datetime.datetime(2017, 1, 2, 13))
+    self.assertEqual(
+        rollups.period_start(timestamp, 'day'), datetime.datetime(2017, 1, 2))
+
+  def test_histogram_bucket(self):
+    self.assertEqual(rollups.histogram_bucket(0), 0)
+    self.assertEqual(rollups.histogram_bucket(1), 1)
+    self.assertEqual(
+        rollups.histogram_bucket(10 ** 12), rollups.HISTOGRAM_SIZE - 1)
+    for price in (5, 100, 2500, 60000):
+      typical = rollups.bucket_price(rollups.histogram_bucket(price))
+      self.assertAlmostEqual(typical / price, 1, delta=0.1)
+
+  def test_rollup(self):
+    rollup = rollups.Rollup()
+    for price in [None] + list(range(100, 1100, 100)):
+      rollup.add(price)
+    summary = rollup.to_dict()
+    self.assertEqual(summary['count'], 11)
+    self.assertEqual(summary['price_count'], 10)
+    self.assertEqual((summary['min'], summary['max']), (100, 1000))
+    self.assertEqual(summary['mean'], 550)
+    self.assertAlmostEqual(summary['median'], 500, delta=50)
+    self.assertAlmostEqual(summary['p90'], 900, delta=90)
+
+  def test_rollup_without_prices(self):
+    rollup = rollups.Rollup()
+    rollup.add(None)
+    self.assertEqual(rollup.to_dict()['median'], None)
+
+  def test_merge(self):
+    first = rollups.Rollup()
+    first.add(100)
+    second = rollups.Rollup()
+    second.add(None)
+    second.add(300)
+    first.merge(second)
+    self.assertEqual(first.auction_count, 3)
+    self.assertEqual((first.min_price, first.max_price), (100, 300))
+    self.assertEqual(first.price_sum, 400)
+    self.assertEqual(sum(first.price_histogram.values()), 2)
+
+  def test_aggregate(self):
+    timestamp = datetime.datetime(2017, 1, 2, 13, 45, 35)
+    aggregated = rollups.aggregate([
+        (17, timestamp, True, 100),
+        (17, timestamp + datetime.timedelta(hours=1), True, 200),
+        (17, timestamp, False, None),
+    ])
+    hour = datetime.datetime(2017, 1, 2, 13)
+    day = datetime.datetime(2017, 1, 2)
+    self.assertEqual(aggregated[(17, True, 'hour', hour)].auction_count, 1)
+    self.assertEqual(aggregated[(17, True, 'day', day)].auction_count, 2)
+    self.assertEqual(aggregated[(17, False, 'day', day)].price_count, 0)
+    self.assertEqual(len(aggregated), 5)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,12 +4,38 @@
 import db
 
 
+# Maintained by db.add_clean_auction and friends.  period is 'hour' or 'day',
+# prices are in pp, and the histogram buckets are described in rollups.py.
+PRICE_ROLLUPS_STATEMENTS = [
+  """CREATE TABLE IF NOT EXISTS price_rollups (
+    item_id integer REFERENCES items(id),
+    is_selling bool,
+    period varchar(4),
+    period_start timestamp,
+    auction_count integer,
+    price_count integer,
+    min_price integer,
+    max_price integer,
+    price_sum bigint,
+    PRIMARY KEY (item_id, period, period_start, is_selling)
+  );""",
+  """CREATE TABLE IF NOT EXISTS price_histograms (
+    item_id integer REFERENCES items(id),
+    is_selling bool,
+    period varchar(4),
+    period_start timestamp,
+    bucket smallint,
+    price_count integer,
+    PRIMARY KEY (item_id, period, period_start, is_selling, bucket)
+  );""",
+]
+
 # The limits on character fields were determined by looking at a sample of logs
 # and figuring out how big things could be.
 CREATE_TABLE_STATEMENTS = [
   """CREATE TABLE characters (
     id SERIAL PRIMARY KEY,
-    name varchar(16)
+    name varchar(16) UNIQUE
   );""",
   """CREATE TABLE items (
     id SERIAL PRIMARY KEY,
@@ -21,12 +47,17 @@ CREATE_TABLE_STATEMENTS = [
     item_id integer REFERENCES items(id),
     name varchar(128)
   );""",
+  # message_hash and time_bucket back the index that add_raw_auction uses to
+  # find duplicates.
   """CREATE TABLE raw_auctions (
     id SERIAL PRIMARY KEY,
     timestamp timestamp,
     character_id integer REFERENCES characters(id),
-    message varchar(1024)
-  );""",
+    message varchar(1024),
+    message_hash uuid GENERATED ALWAYS AS (md5(message)::uuid) STORED,
+    time_bucket bigint GENERATED ALWAYS AS ({time_bucket}) STORED,
+    UNIQUE (character_id, message_hash, time_bucket)
+  );""".format(time_bucket=db.time_bucket_sql('timestamp')),
   """CREATE TABLE clean_auctions (
     id SERIAL PRIMARY KEY,
     raw_auction_id integer REFERENCES raw_auctions(id),
@@ -36,7 +67,10 @@ CREATE_TABLE_STATEMENTS = [
     is_selling bool,
     price integer
   );""",
-]
+  # For the newest auctions of an item.
+  """CREATE INDEX clean_auctions_item_id_timestamp
+    ON clean_auctions (item_id, timestamp);""",
+] + PRICE_ROLLUPS_STATEMENTS
 
 
 def main():
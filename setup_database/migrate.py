@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+
+import db
+from setup_database import create_tables
+
+
+# Brings a database made by an older create_tables up to date.  Every
+# statement can be run again, so this is safe on a database that's already
+# current.  Copies of a row that the new unique indexes would reject are
+# merged into the oldest one first.
+MIGRATION_STATEMENTS = [
+  # characters.name became UNIQUE, for the upsert in
+  # get_or_create_characters_with_cursor.
+  """UPDATE raw_auctions SET character_id = copies.keep_id
+    FROM (SELECT id, min(id) OVER (PARTITION BY name) AS keep_id
+          FROM characters) copies
+    WHERE raw_auctions.character_id = copies.id AND
+          copies.id <> copies.keep_id;""",
+  """UPDATE clean_auctions SET character_id = copies.keep_id
+    FROM (SELECT id, min(id) OVER (PARTITION BY name) AS keep_id
+          FROM characters) copies
+    WHERE clean_auctions.character_id = copies.id AND
+          copies.id <> copies.keep_id;""",
+  """DELETE FROM characters USING characters kept
+    WHERE characters.name = kept.name AND characters.id > kept.id;""",
+  """CREATE UNIQUE INDEX IF NOT EXISTS characters_name_key
+    ON characters (name);""",
+  # raw_auctions got message_hash and time_bucket, and a unique index on them
+  # that add_raw_auction uses to find duplicates.  This rewrites the table.
+  """ALTER TABLE raw_auctions ADD COLUMN IF NOT EXISTS message_hash uuid
+    GENERATED ALWAYS AS (md5(message)::uuid) STORED;""",
+  """ALTER TABLE raw_auctions ADD COLUMN IF NOT EXISTS time_bucket bigint
+    GENERATED ALWAYS AS ({time_bucket}) STORED;""".format(
+        time_bucket=db.time_bucket_sql('timestamp')),
+  # The kept copy has its own clean auctions.  Rebuild the rollups afterwards
+  # with rebuild_rollups, since they counted the dropped ones.
+  """DELETE FROM clean_auctions
+    USING raw_auctions copy, raw_auctions kept
+    WHERE clean_auctions.raw_auction_id = copy.id AND
+          copy.character_id = kept.character_id AND
+          copy.message_hash = kept.message_hash AND
+          copy.time_bucket = kept.time_bucket AND copy.id > kept.id;""",
+  """DELETE FROM raw_auctions USING raw_auctions kept
+    WHERE raw_auctions.character_id = kept.character_id AND
+          raw_auctions.message_hash = kept.message_hash AND
+          raw_auctions.time_bucket = kept.time_bucket AND
+          raw_auctions.id > kept.id;""",
+  """CREATE UNIQUE INDEX IF NOT EXISTS
+    raw_auctions_character_id_message_hash_time_bucket_key
+    ON raw_auctions (character_id, message_hash, time_bucket);""",
+  # For the newest auctions of an item.
+  """CREATE INDEX IF NOT EXISTS clean_auctions_item_id_timestamp
+    ON clean_auctions (item_id, timestamp);""",
+]
+# Every write of clean auctions updates the price rollups, so their tables
+# have to exist.  Fill them in for older auctions with rebuild_rollups.
+MIGRATION_STATEMENTS += create_tables.PRICE_ROLLUPS_STATEMENTS
+
+
+def main():
+  with db.transaction() as cur:
+    for statement in MIGRATION_STATEMENTS:
+      cur.execute(statement)
+
+
+if __name__ == '__main__':
+  main()
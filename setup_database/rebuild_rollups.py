@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+
+import db
+from setup_database import create_tables
+
+
+def parse_date(date_str):
+  return datetime.datetime.strptime(date_str, '%Y-%m-%d')
+
+
+def parse_args():
+  arg_parser = argparse.ArgumentParser(
+      description='Recomputes the price rollups for a range of days, for '
+                  'auctions that were loaded without updating them.')
+  arg_parser.add_argument('start', type=parse_date, help='Like 2017-01-01.')
+  arg_parser.add_argument(
+      'end', type=parse_date, help='The day after the last day to rebuild.')
+  arg_parser.add_argument(
+      '--days-per-transaction', type=int, default=1,
+      help='Uploads wait while each transaction runs.')
+  return arg_parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  with db.transaction() as cur:
+    for statement in create_tables.PRICE_ROLLUPS_STATEMENTS:
+      cur.execute(statement)
+  step = datetime.timedelta(days=args.days_per_transaction)
+  start = args.start
+  while start < args.end:
+    end = min(start + step, args.end)
+    count = db.rebuild_rollups(start, end)
+    print('{}: {:,} auctions'.format(start.date(), count))
+    start = end
+
+
+if __name__ == '__main__':
+  main()
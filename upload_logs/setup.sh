@@ -2,3 +2,5 @@
 
 sudo pip3 install python-dateutil
 sudo pip3 install requests
+
+echo NOTE: you'll need to add your p99tunnel directory to your PYTHONPATH.
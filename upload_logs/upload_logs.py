@@ -1,67 +1,189 @@
 #!/usr/bin/env python3
 
+import ctypes
+import ctypes.util
 import datetime
+import gzip
 import http
 import io
+import json
+import mmap
 import os
 import pickle
 import re
+import select
+import struct
+import sys
 import time
 
-import dateutil.parser
 import requests
+import urllib3
 
+import eqtime
 
-API_ENDPOINT = 'https://p99tunnel.com/upload_log'
+
+API_ENDPOINT = 'https://p99tunnel.com/upload_logs'
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINTS_PATH = os.path.join(SCRIPT_DIR, '.checkpoints.json')
+# Batches that couldn't be uploaded wait here until the server is reachable.
+SPOOL_PATH = os.path.join(SCRIPT_DIR, '.spool')
+# Where checkpoints were kept before they recorded byte offsets.
 PROCESSED_LINES_PATH = os.path.join(SCRIPT_DIR, '.processed-lines')
 CACHED_LOG_DIR_PATH = os.path.join(SCRIPT_DIR, '.log-dir')
 
-LOG_NAMES_REGEX = re.compile(r'eqlog_(.*)_project1999.txt')
 TIMESTAMP_REGEX = re.compile(r'^\[[^ ]+ ([^]]+)]')
 MY_AUCTION_REGEX = re.compile(r"^\[[^ ]+ [^]]+] You auction, '.+'$")
 OTHER_AUCTION_REGEX = re.compile(r"^\[[^ ]+ [^]]+] [^ ]+ auctions, '.+'$")
 
-UTF8_HEADER = {'Content-Encoding': 'utf-8'}
+UTF8_HEADER = {'Content-Type': 'text/plain; charset=utf-8'}
+GZIP_HEADER = {'Content-Encoding': 'gzip'}
+
+# How much of a log file to read at a time.
+READ_CHUNK_SIZE = 1024 * 1024
+# How often the polling watcher checks whether any log files have grown.
+POLL_INTERVAL_SECONDS = 1
+# A batch of auctions is uploaded once it gets this big or this old.
+MAX_BATCH_BYTES = 64 * 1024
+MAX_BATCH_SECONDS = 2
+# How long to wait before retrying spooled batches.  The wait doubles after
+# every failure.
+MIN_RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 5 * 60
+# A batch that the server has failed on this many times is moved aside to the
+# failed file, so that it doesn't hold up the ones behind it.  Only failures
+# where the server got the batch count, so an outage never sets anything aside.
+# Set aside batches are tried again the next time the uploader starts.
+MAX_SEND_ATTEMPTS = 20
+
+# What BatchUploader.send returns: the batch was accepted, or rejected for
+# good; the server couldn't be reached, or is too busy; or the server got the
+# batch and failed on it.
+SEND_DONE = 'done'
+SEND_UNAVAILABLE = 'unavailable'
+SEND_FAILED = 'failed'
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_STRUCT = struct.Struct('iIII')
+
 
 class NamedStream(object):
+  """A log file opened in binary mode that keeps track of how far it's read.
+
+  offset is the byte offset just past the last complete line read so far.
+  """
 
   def __init__(self, name, stream):
     self.name = name
     self.stream = stream
+    self.offset = 0
+    self.partial_line = b''
 
   def __repr__(self):
     return self.name
 
-  def readline(self):
-    return self.stream.readline()
-
-  def tell(self):
-    return self.stream.tell()
+  def stat(self):
+    return os.fstat(self.stream.fileno())
 
   def seek(self, offset):
+    self.offset = offset
+    self.partial_line = b''
     return self.stream.seek(offset)
 
+  def read_lines(self):
+    """Yields the complete lines written since the last read.
 
-class ProcessedLines(object):
+    The file is read in big chunks.  A line that the game is still in the
+    middle of writing is held back until the rest of it shows up.
+    """
+    while True:
+      chunk = self.stream.read(READ_CHUNK_SIZE)
+      if not chunk:
+        return
+      lines = (self.partial_line + chunk).split(b'\n')
+      self.partial_line = lines.pop()
+      for line in lines:
+        self.offset += len(line) + 1
+        yield decode_line(line)
 
-  def __init__(self, path=PROCESSED_LINES_PATH):
-    self.already_processed = {}
-    if os.path.isfile(path):
-      with open(path, 'rb') as f:
-        self.already_processed = pickle.load(f)
-        print('Starting at these lines for these characters:')
-        print(str(self.already_processed))
 
-  def update_in_memory(self, stream, last_line):
-    self.already_processed[stream.name] = last_line
+def decode_line(line):
+  return line.decode(eqtime.LOG_ENCODING, errors='replace').rstrip('\r')
+
+
+class Checkpoints(object):
+  """Remembers how far into each character's log we've gotten.
+
+  Each checkpoint holds the log file's inode, its size and the byte offset
+  just past the last line we processed, so resuming is a single seek.  The time
+  of the last line is kept too, for when the log has been replaced or
+  truncated since the checkpoint was saved.
+  """
 
-  def save_to_disk(self, path=PROCESSED_LINES_PATH):
-    with open(path, 'wb') as f:
-      pickle.dump(self.already_processed, f, protocol=0)
+  def __init__(self, path=CHECKPOINTS_PATH):
+    self.path = path
+    self.checkpoints = {}
+    self.changed = False
+    if os.path.isfile(path):
+      with open(path, 'r') as f:
+        self.checkpoints = json.load(f)
+    elif os.path.isfile(PROCESSED_LINES_PATH):
+      self.load_processed_lines(PROCESSED_LINES_PATH)
+    if self.checkpoints:
+      print('Starting at these checkpoints for these characters:')
+      print(str(self.checkpoints))
+
+  def load_processed_lines(self, path):
+    """Converts the last lines saved by older versions into checkpoints."""
+    with open(path, 'rb') as f:
+      already_processed = pickle.load(f)
+    for name, last_line in already_processed.items():
+      last_time = get_time_or_none(last_line)
+      if last_time:
+        self.checkpoints[name] = {'last_time': last_time.isoformat()}
+
+  def position(self, stream, last_line, previous=None):
+    """Returns a checkpoint for how far the stream has been read.
+
+    previous is the stream's last checkpoint, if it isn't the saved one.
+    """
+    if previous is None:
+      previous = self.checkpoints.get(stream.name, {})
+    checkpoint = dict(previous)
+    stat = stream.stat()
+    checkpoint['inode'] = stat.st_ino
+    checkpoint['size'] = stat.st_size
+    checkpoint['offset'] = stream.offset
+    last_time = get_time_or_none(last_line)
+    if last_time:
+      checkpoint['last_time'] = last_time.isoformat()
+    return checkpoint
+
+  def set(self, stream_name, checkpoint):
+    if self.checkpoints.get(stream_name) != checkpoint:
+      self.checkpoints[stream_name] = checkpoint
+      self.changed = True
+
+  def save_to_disk(self):
+    # Write to a temporary file and rename it over the old one, so a crash
+    # part way through never leaves a half-written checkpoint behind.
+    temp_path = self.path + '.tmp'
+    with open(temp_path, 'w') as f:
+      json.dump(self.checkpoints, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp_path, self.path)
+    self.changed = False
+
+  def save_if_changed(self):
+    if self.changed:
+      self.save_to_disk()
 
   def get(self, stream_name):
-    return self.already_processed.get(stream_name)
+    return self.checkpoints.get(stream_name)
 
 
 def get_log_directory():
@@ -81,63 +203,388 @@ def get_log_directory():
 
 
 def get_log_streams(log_dir):
+  """Returns a dict of log file name to NamedStream for every p99 log."""
   print('Opening up log streams...')
-  names = os.listdir(log_dir)
-  streams = []
-  for name in names:
-    match = LOG_NAMES_REGEX.match(name)
-    if match:
-      print('  Opening a stream for: ' + name)
-      character_name = match.group(1)
-      path = os.path.join(log_dir, name)
-      streams.append(NamedStream(name=character_name, stream=io.open(path)))
+  streams = {}
+  for name in os.listdir(log_dir):
+    stream = open_log_stream(log_dir, name)
+    if stream:
+      streams[name] = stream
     else:
       print('  Not a p99 log: ' + name)
   return streams
 
 
+def open_log_stream(log_dir, name):
+  match = eqtime.LOG_NAMES_REGEX.match(name)
+  if not match:
+    return None
+  print('  Opening a stream for: ' + name)
+  character_name = match.group(1)
+  path = os.path.join(log_dir, name)
+  return NamedStream(name=character_name, stream=io.open(path, 'rb'))
+
+
+class InotifyWatcher(object):
+  """Waits for log files to change using Linux's inotify."""
+
+  def __init__(self, log_dir):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self.fd = libc.inotify_init1(IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    watch = libc.inotify_add_watch(
+        self.fd, os.fsencode(log_dir), IN_MODIFY | IN_CREATE | IN_MOVED_TO)
+    if watch < 0:
+      os.close(self.fd)
+      raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+  def wait(self, timeout=None):
+    """Blocks until some log files change and returns their names.
+
+    Returns an empty set if nothing changed within timeout seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      remaining = None if deadline is None else deadline - time.monotonic()
+      if remaining is not None and remaining <= 0:
+        return set()
+      readable, _, _ = select.select([self.fd], [], [], remaining)
+      if not readable:
+        return set()
+      data = os.read(self.fd, 64 * 1024)
+      changed = set()
+      offset = 0
+      while offset < len(data):
+        _, _, _, name_length = INOTIFY_EVENT_STRUCT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT_STRUCT.size
+        name = data[offset:offset + name_length].rstrip(b'\0')
+        offset += name_length
+        name = os.fsdecode(name)
+        if eqtime.LOG_NAMES_REGEX.match(name):
+          changed.add(name)
+      if changed:
+        return changed
+
+
+class PollingWatcher(object):
+  """Waits for log files to change by checking their sizes every so often."""
+
+  def __init__(self, log_dir, interval=POLL_INTERVAL_SECONDS):
+    self.log_dir = log_dir
+    self.interval = interval
+    self.sizes = {}
+
+  def wait(self, timeout=None):
+    """Blocks until some log files change and returns their names.
+
+    Returns an empty set if nothing changed within timeout seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      interval = self.interval
+      if deadline is not None:
+        interval = min(interval, max(deadline - time.monotonic(), 0))
+      time.sleep(interval)
+      changed = set()
+      for entry in os.scandir(self.log_dir):
+        if not eqtime.LOG_NAMES_REGEX.match(entry.name):
+          continue
+        size = entry.stat().st_size
+        if self.sizes.get(entry.name) != size:
+          self.sizes[entry.name] = size
+          changed.add(entry.name)
+      if changed or (deadline is not None and time.monotonic() >= deadline):
+        return changed
+
+
+def make_watcher(log_dir):
+  if sys.platform.startswith('linux'):
+    try:
+      return InotifyWatcher(log_dir)
+    except (AttributeError, OSError) as e:
+      print('Could not use inotify, polling instead: ' + str(e))
+  return PollingWatcher(log_dir)
+
+
 def get_time(log_line):
   match = TIMESTAMP_REGEX.match(log_line)
   timestamp_str = match.group(1)
-  return dateutil.parser.parse(timestamp_str)
+  return eqtime.parse_timestamp(timestamp_str)
 
 
-def consume_up_to(stream, last_line):
+def get_time_or_none(log_line):
+  if not log_line or not TIMESTAMP_REGEX.match(log_line):
+    return None
+  try:
+    return get_time(log_line)
+  except ValueError:
+    return None
+
+
+def consume_up_to(stream, checkpoint):
   print('Getting to the new stuff in stream: ' + stream.name)
-  if last_line is None:
+  if checkpoint is None:
     return
-  last_time = get_time(last_line)
-  last_old_offset = stream.tell()
-  while True:
-    line = stream.readline()
-    # We got to the end of the file without finding a time after the last line
-    if not line:
-      return
-    time = get_time(line)
-    if time > last_time:
-      stream.seek(last_old_offset)
-      return
-    last_old_offset = stream.tell()
+  stat = stream.stat()
+  offset = checkpoint.get('offset')
+  if (offset is not None and checkpoint.get('inode') == stat.st_ino and
+      checkpoint.get('size', offset) <= stat.st_size):
+    stream.seek(offset)
+    return
+  # The log has been replaced or truncated since the checkpoint, so the best
+  # we can do is skip everything that happened before the last line we saw.
+  print('  Log changed since the checkpoint, searching by time instead')
+  last_time = checkpoint.get('last_time')
+  if last_time is None or stat.st_size == 0:
+    return
+  last_time = datetime.datetime.strptime(last_time, '%Y-%m-%dT%H:%M:%S')
+  with mmap.mmap(
+      stream.stream.fileno(), stat.st_size, access=mmap.ACCESS_READ) as data:
+    stream.seek(find_first_line_after(data, last_time))
+
+
+def find_first_line_after(data, last_time):
+  """Binary searches data for the first line whose time is after last_time.
+
+  Returns the byte offset of that line, or len(data) if there isn't one.
+  Lines without a timestamp are treated as old.
+  """
+  def next_line_start(position):
+    if position == 0:
+      return 0
+    newline = data.find(b'\n', position - 1)
+    return len(data) if newline == -1 else newline + 1
+
+  low = 0
+  high = len(data)
+  while low < high:
+    middle = (low + high) // 2
+    start = next_line_start(middle)
+    if start < len(data):
+      end = data.find(b'\n', start)
+      line_time = get_time_or_none(
+          decode_line(data[start:end if end != -1 else len(data)]))
+      if line_time is None or line_time <= last_time:
+        low = middle + 1
+        continue
+    high = middle
+  return next_line_start(low)
 
 
 def get_local_time_str():
   return datetime.datetime.now().replace(microsecond=0).isoformat()
 
 
-def upload_auction(session, auction):
-  now_str = get_local_time_str()
-  post_body = '{} {}'.format(now_str, auction).encode('utf-8')
-  response = session.post(API_ENDPOINT, data=post_body)
-  if response.status_code != 200:
+class BatchUploader(object):
+  """Collects auction lines into gzipped batches and uploads them.
+
+  A batch is sent once it reaches max_batch_bytes or is max_batch_seconds old.
+  Batches that can't be uploaded are appended to a spool file and retried with
+  exponential backoff, oldest first.  A batch that the server fails on
+  MAX_SEND_ATTEMPTS times is moved to a file of failed batches, which go back
+  into the spool when the uploader restarts.  Each batch carries the
+  checkpoints of the streams its lines came from, and those checkpoints are
+  only saved once the server has acknowledged the batch, or once it's been
+  set aside.
+  """
+
+  def __init__(
+      self, session, checkpoints, endpoint=API_ENDPOINT, spool_path=SPOOL_PATH,
+      max_batch_bytes=MAX_BATCH_BYTES, max_batch_seconds=MAX_BATCH_SECONDS):
+    self.session = session
+    self.checkpoints = checkpoints
+    self.endpoint = endpoint
+    self.spool_path = spool_path
+    self.failed_path = spool_path + '.failed'
+    self.max_batch_bytes = max_batch_bytes
+    self.max_batch_seconds = max_batch_seconds
+    self.lines = []
+    self.size = 0
+    self.positions = {}
+    self.batch_started = None
+    self.retry_delay = MIN_RETRY_SECONDS
+    self.retry_at = time.monotonic()
+    self.spool = []
+    if os.path.isfile(spool_path):
+      with open(spool_path, 'r') as f:
+        self.spool = [json.loads(line) for line in f if line.strip()]
+      print('{} batches waiting to be uploaded'.format(len(self.spool)))
+    self.retry_set_aside()
+
+  def add(self, line):
+    if not self.lines:
+      self.batch_started = time.monotonic()
+    self.lines.append(line)
+    self.size += len(line) + 1
+    if self.size >= self.max_batch_bytes:
+      self.flush()
+
+  def set_position(self, stream, last_line):
+    """Records how far the stream has been read, as of the current batch."""
+    previous = self.positions.get(stream.name) or self.spooled_position(
+        stream.name)
+    self.positions[stream.name] = self.checkpoints.position(
+        stream, last_line, previous)
+
+  def spooled_position(self, stream_name):
+    """Returns the newest checkpoint for stream_name that's in the spool."""
+    for batch in reversed(self.spool):
+      if stream_name in batch['positions']:
+        return batch['positions'][stream_name]
+    return None
+
+  def seconds_until_due(self):
+    """Returns how long until flush_if_due has work to do, or None."""
+    now = time.monotonic()
+    deadlines = []
+    if self.lines:
+      deadlines.append(self.batch_started + self.max_batch_seconds)
+    if self.spool:
+      deadlines.append(self.retry_at)
+    if not deadlines:
+      return None
+    return max(min(deadlines) - now, 0)
+
+  def flush_if_due(self):
+    now = time.monotonic()
+    if self.spool and now >= self.retry_at:
+      self.replay_spool()
+    if self.lines and now >= self.batch_started + self.max_batch_seconds:
+      self.flush()
+    elif not self.lines and self.positions:
+      self.flush()
+
+  def flush(self):
+    if not self.lines and self.spool:
+      # There's nothing to send, and the positions can't be saved ahead of
+      # the spooled batches.  They go out with the next batch, or once the
+      # spool is empty.
+      return
+    batch = {'lines': self.lines, 'positions': self.positions}
+    self.lines = []
+    self.size = 0
+    self.positions = {}
+    self.batch_started = None
+    # Keep batches in order: while older ones are waiting in the spool, new
+    # ones have to wait behind them.
+    if self.spool:
+      self.spool_batch(batch)
+    elif not batch['lines']:
+      self.acknowledge(batch)
+    else:
+      result = self.send(batch)
+      if result == SEND_DONE:
+        self.acknowledge(batch)
+      else:
+        batch['attempts'] = 1 if result == SEND_FAILED else 0
+        self.spool_batch(batch)
+
+  def send(self, batch):
+    """Uploads a batch and returns one of the SEND_ results."""
+    now_str = get_local_time_str()
+    body = '\n'.join([now_str] + batch['lines']).encode('utf-8')
+    try:
+      response = self.session.post(
+          self.endpoint, data=gzip.compress(body), headers=GZIP_HEADER)
+    except requests.RequestException as e:
+      print('Could not upload auctions: ', e)
+      # The server closed the connection after getting the batch, without
+      # answering, like when it crashes on it.
+      if e.args and isinstance(e.args[0], urllib3.exceptions.ProtocolError):
+        return SEND_FAILED
+      return SEND_UNAVAILABLE
+    # The server answers 202 when it has queued the lines to be written.
+    if 200 <= response.status_code < 300:
+      return SEND_DONE
     print('Bad response: ', response)
-
-
-def consume_log_output(session, stream, last_line):
-  while True:
-    line = stream.readline()
-    # The stream doesn't have any more output for us to consume
-    if not line:
-      return last_line
+    # The server will never accept a batch it says is malformed, so give up on
+    # it instead of retrying forever.
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+      return SEND_DONE
+    if response.status_code == 500:
+      return SEND_FAILED
+    return SEND_UNAVAILABLE
+
+  def acknowledge(self, batch):
+    for stream_name, checkpoint in batch['positions'].items():
+      self.checkpoints.set(stream_name, checkpoint)
+    self.checkpoints.save_if_changed()
+
+  def spool_batch(self, batch):
+    if not self.spool:
+      self.retry_at = time.monotonic() + self.retry_delay
+    self.spool.append(batch)
+    with open(self.spool_path, 'a') as f:
+      f.write(json.dumps(batch) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+
+  def replay_spool(self):
+    sent = 0
+    failed = False
+    while sent < len(self.spool):
+      batch = self.spool[sent]
+      result = self.send(batch)
+      if result == SEND_UNAVAILABLE:
+        break
+      if result == SEND_FAILED:
+        failed = True
+        batch['attempts'] = batch.get('attempts', 0) + 1
+        if batch['attempts'] < MAX_SEND_ATTEMPTS:
+          break
+        # The lines are safe in the failed file, so the checkpoint can move
+        # past them.
+        self.set_aside(batch)
+      self.acknowledge(batch)
+      sent += 1
+    if sent or failed:
+      self.spool = self.spool[sent:]
+      self.save_spool()
+    if self.spool:
+      self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_SECONDS)
+      self.retry_at = time.monotonic() + self.retry_delay
+    else:
+      self.retry_delay = MIN_RETRY_SECONDS
+
+  def set_aside(self, batch):
+    """Moves a batch that keeps failing out of the way of newer ones."""
+    print('Giving up on a batch of {} lines after {} attempts, see {}'.format(
+        len(batch['lines']), batch['attempts'], self.failed_path))
+    with open(self.failed_path, 'a') as f:
+      f.write(json.dumps(batch) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+
+  def retry_set_aside(self):
+    """Puts the batches that were set aside back at the front of the spool."""
+    if not os.path.isfile(self.failed_path):
+      return
+    with open(self.failed_path, 'r') as f:
+      failed = [json.loads(line) for line in f if line.strip()]
+    print('Retrying {} batches that failed before'.format(len(failed)))
+    for batch in failed:
+      # Their checkpoints were saved when they were set aside.
+      batch['positions'] = {}
+      batch['attempts'] = 0
+    self.spool = failed + self.spool
+    self.save_spool()
+    os.remove(self.failed_path)
+
+  def save_spool(self):
+    temp_path = self.spool_path + '.tmp'
+    with open(temp_path, 'w') as f:
+      for batch in self.spool:
+        f.write(json.dumps(batch) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp_path, self.spool_path)
+
+
+def consume_log_output(uploader, stream):
+  """Queues the auctions in the stream's new lines for upload."""
+  last_line = None
+  for line in stream.read_lines():
     last_line = line
     # I auctioned something, which means I need to reformat the line to look
     # like a generic auction
@@ -148,27 +595,54 @@ def consume_log_output(session, stream, last_line):
     # The line is a valid auction
     match = OTHER_AUCTION_REGEX.match(line)
     if match:
-      upload_auction(session, line)
+      uploader.add(line)
+  # The stream doesn't have any more output for us to consume.  Everything read
+  # so far is either uploaded, spooled or in the current batch, so the
+  # checkpoint can move up to here once the current batch is acknowledged.
+  uploader.set_position(stream, last_line)
+
+
+def consume_streams(uploader, streams):
+  for stream in streams:
+    consume_log_output(uploader, stream)
+  uploader.flush_if_due()
+
+
+def resume_stream(stream, uploader, checkpoints):
+  """Skips over the part of the stream that's been uploaded or spooled."""
+  checkpoint = (
+      uploader.spooled_position(stream.name) or checkpoints.get(stream.name))
+  consume_up_to(stream, checkpoint)
 
 
 def main():
   log_dir = get_log_directory()
   log_streams = get_log_streams(log_dir)
-  processed_lines = ProcessedLines()
-  for stream in log_streams:
-    consume_up_to(stream, processed_lines.get(stream.name))
-  print('Streaming log updates...')
+  checkpoints = Checkpoints()
   # Use a request session so that only one TCP connection gets opened.
   # Opening and closing oodles of connections would probably slow things down.
   session = requests.Session()
   session.headers.update(UTF8_HEADER)
+  uploader = BatchUploader(session, checkpoints)
+  uploader.flush_if_due()
+  for stream in log_streams.values():
+    resume_stream(stream, uploader, checkpoints)
+  print('Streaming log updates...')
+  # Start watching before the first pass so that nothing written in between
+  # gets missed.
+  watcher = make_watcher(log_dir)
+  consume_streams(uploader, log_streams.values())
   while True:
-    for stream in log_streams:
-      last_line = consume_log_output(
-          session, stream, processed_lines.get(stream.name))
-      processed_lines.update_in_memory(stream, last_line)
-    processed_lines.save_to_disk()
-    time.sleep(10)
+    changed = watcher.wait(uploader.seconds_until_due())
+    for name in changed - log_streams.keys():
+      # A character we haven't seen before just logged in.
+      stream = open_log_stream(log_dir, name)
+      if stream:
+        resume_stream(stream, uploader, checkpoints)
+        log_streams[name] = stream
+    changed_streams = [
+        log_streams[name] for name in changed if name in log_streams]
+    consume_streams(uploader, changed_streams)
 
 
 if __name__ == '__main__':
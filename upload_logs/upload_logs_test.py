@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import datetime
+import gzip
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import requests
+
+import upload_logs
+
+
+LOG_LINES = [
+    "[Sat Jan 07 17:43:44 2017] You say, 'Hail'",
+    "[Sat Jan 07 17:46:44 2017] Junque auctions, 'WTS Swarmcaller'",
+    "[Sat Jan 07 17:46:44 2017] You auction, 'WTS Ale 5k'",
+    "[Sat Jan 07 17:47:00 2017] Toon auctions, 'WTB Ale'",
+]
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+  """Records uploaded lines, or fails while the server is marked as down.
+
+  Batches with the server's poison string in them get the connection closed
+  without a response, like a server that crashes on them.
+  """
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['content-length']))
+    if self.server.status >= 300:
+      self.send_error(self.server.status)
+      return
+    lines = gzip.decompress(body).decode('utf-8').split('\n')
+    poison = self.server.poison
+    if poison and any(poison in line for line in lines[1:]):
+      self.close_connection = True
+      return
+    self.server.uploaded += lines[1:]
+    self.send_response(self.server.status)
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+
+class UploadLogsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.log_path = os.path.join(self.temp_dir, 'eqlog_Me_project1999.txt')
+    self.write_log(LOG_LINES)
+    self.server = http.server.HTTPServer(('127.0.0.1', 0), StandInHandler)
+    self.server.status = 200
+    self.server.poison = None
+    self.server.uploaded = []
+    threading.Thread(
+        target=self.server.serve_forever, kwargs={'poll_interval': 0.01},
+        daemon=True).start()
+    self.session = requests.Session()
+    self.checkpoints = upload_logs.Checkpoints(
+        os.path.join(self.temp_dir, 'checkpoints.json'))
+    self.uploader = self.make_uploader()
+
+  def tearDown(self):
+    self.session.close()
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.temp_dir)
+
+  @property
+  def uploaded(self):
+    return self.server.uploaded
+
+  def make_uploader(self):
+    endpoint = 'http://127.0.0.1:{}/upload_logs'.format(
+        self.server.server_port)
+    return upload_logs.BatchUploader(
+        self.session, self.checkpoints, endpoint=endpoint,
+        spool_path=os.path.join(self.temp_dir, 'spool'), max_batch_seconds=0)
+
+  def write_log(self, lines, mode='w'):
+    with open(self.log_path, mode) as f:
+      f.write(''.join(line + '\n' for line in lines))
+
+  def open_stream(self):
+    stream = upload_logs.open_log_stream(
+        self.temp_dir, os.path.basename(self.log_path))
+    self.addCleanup(stream.stream.close)
+    return stream
+
+  def consume(self):
+    stream = self.open_stream()
+    upload_logs.resume_stream(stream, self.uploader, self.checkpoints)
+    upload_logs.consume_streams(self.uploader, [stream])
+
+  def test_consume_uploads_auctions(self):
+    self.consume()
+    self.assertEqual(self.uploaded, [
+        "[Sat Jan 07 17:46:44 2017] Junque auctions, 'WTS Swarmcaller'",
+        "[Sat Jan 07 17:46:44 2017] Me auctions, 'WTS Ale 5k'",
+        "[Sat Jan 07 17:47:00 2017] Toon auctions, 'WTB Ale'",
+    ])
+
+  def test_resume_from_offset(self):
+    self.consume()
+    self.write_log(["[Sat Jan 07 17:47:00 2017] Bob auctions, 'WTS Fish'"], 'a')
+    self.server.uploaded = []
+    self.checkpoints = upload_logs.Checkpoints(self.checkpoints.path)
+    self.uploader = self.make_uploader()
+    self.consume()
+    # Same second as the previous last line, which a search by time would skip.
+    self.assertEqual(
+        self.uploaded, ["[Sat Jan 07 17:47:00 2017] Bob auctions, 'WTS Fish'"])
+
+  def test_resume_after_log_replaced(self):
+    self.consume()
+    os.remove(self.log_path)
+    self.write_log(LOG_LINES + [
+        "[Sat Jan 07 17:48:00 2017] Bob auctions, 'WTS Fish'"])
+    self.server.uploaded = []
+    self.consume()
+    self.assertEqual(
+        self.uploaded, ["[Sat Jan 07 17:48:00 2017] Bob auctions, 'WTS Fish'"])
+
+  def test_failed_batches_are_spooled_and_replayed(self):
+    self.server.status = 503
+    self.consume()
+    self.assertEqual(self.uploaded, [])
+    self.assertEqual(len(self.uploader.spool), 1)
+    # Nothing has been acknowledged, so the checkpoint hasn't moved.
+    self.assertEqual(self.checkpoints.get('Me'), None)
+    # A restarted uploader picks the spool back up and doesn't read the
+    # spooled lines from the log again.
+    self.write_log(["[Sat Jan 07 17:48:00 2017] Bob auctions, 'WTS Fish'"], 'a')
+    self.uploader = self.make_uploader()
+    self.consume()
+    self.assertEqual(len(self.uploader.spool), 2)
+    self.server.status = 200
+    self.uploader.retry_at = 0
+    self.uploader.flush_if_due()
+    self.assertEqual(self.uploader.spool, [])
+    self.assertEqual(len(self.uploaded), 4)
+    self.assertEqual(
+        self.checkpoints.get('Me')['offset'], os.path.getsize(self.log_path))
+
+  def test_batches_that_keep_failing_are_set_aside(self):
+    self.server.poison = 'Swarmcaller'
+    self.consume()
+    self.write_log(["[Sat Jan 07 17:48:00 2017] Bob auctions, 'WTS Fish'"], 'a')
+    self.consume()
+    self.assertEqual(len(self.uploader.spool), 2)
+    for _ in range(upload_logs.MAX_SEND_ATTEMPTS - 1):
+      self.uploader.retry_at = 0
+      self.uploader.flush_if_due()
+    self.assertEqual(self.uploader.spool, [])
+    self.assertEqual(
+        self.uploaded, ["[Sat Jan 07 17:48:00 2017] Bob auctions, 'WTS Fish'"])
+    self.assertEqual(
+        self.checkpoints.get('Me')['offset'], os.path.getsize(self.log_path))
+    with open(self.uploader.failed_path, 'r') as f:
+      failed = [json.loads(line) for line in f]
+    self.assertEqual(len(failed), 1)
+    self.assertEqual(len(failed[0]['lines']), 3)
+    # The next run tries them again, without moving the checkpoint back.
+    self.server.poison = None
+    self.uploader = self.make_uploader()
+    self.assertFalse(os.path.exists(self.uploader.failed_path))
+    self.uploader.flush_if_due()
+    self.assertEqual(self.uploader.spool, [])
+    self.assertEqual(len(self.uploaded), 4)
+    self.assertEqual(
+        self.checkpoints.get('Me')['offset'], os.path.getsize(self.log_path))
+
+  def test_positions_wait_behind_the_spool(self):
+    self.server.status = 503
+    self.consume()
+    self.write_log(["[Sat Jan 07 17:48:00 2017] Bob says, 'Hail'"], 'a')
+    self.consume()
+    self.consume()
+    # No empty batches just to record how far the log has been read.
+    self.assertEqual(len(self.uploader.spool), 1)
+    self.server.status = 200
+    self.uploader.retry_at = 0
+    self.uploader.flush_if_due()
+    self.assertEqual(self.uploader.spool, [])
+    self.assertEqual(len(self.uploaded), 3)
+    self.assertEqual(
+        self.checkpoints.get('Me')['offset'], os.path.getsize(self.log_path))
+
+  def test_outages_never_set_batches_aside(self):
+    self.server.status = 503
+    self.consume()
+    for _ in range(upload_logs.MAX_SEND_ATTEMPTS + 1):
+      self.uploader.retry_at = 0
+      self.uploader.flush_if_due()
+    self.assertEqual(len(self.uploader.spool), 1)
+    self.assertFalse(os.path.exists(self.uploader.failed_path))
+    self.assertEqual(self.checkpoints.get('Me'), None)
+
+  def test_rejected_batches_are_dropped(self):
+    self.server.status = 400
+    self.consume()
+    self.assertEqual(self.uploader.spool, [])
+    self.assertEqual(
+        self.checkpoints.get('Me')['offset'], os.path.getsize(self.log_path))
+
+  def test_queued_batches_are_done(self):
+    self.server.status = 202
+    self.consume()
+    self.assertEqual(len(self.uploaded), 3)
+    self.assertEqual(self.uploader.spool, [])
+    self.assertEqual(
+        self.checkpoints.get('Me')['offset'], os.path.getsize(self.log_path))
+
+  def test_partial_line_is_held_back(self):
+    with open(self.log_path, 'a') as f:
+      f.write("[Sat Jan 07 17:48:00 2017] Bob auc")
+    stream = self.open_stream()
+    self.assertEqual(list(stream.read_lines()), LOG_LINES)
+    with open(self.log_path, 'a') as f:
+      f.write("tions, 'WTS Fish'\n")
+    self.assertEqual(
+        list(stream.read_lines()),
+        ["[Sat Jan 07 17:48:00 2017] Bob auctions, 'WTS Fish'"])
+
+  def test_find_first_line_after(self):
+    data = ''.join(line + '\n' for line in LOG_LINES).encode('utf-8')
+    def find(*args):
+      offset = upload_logs.find_first_line_after(
+          data, datetime.datetime(2017, 1, 7, *args))
+      return data[offset:].decode('utf-8').split('\n')[0]
+    self.assertEqual(find(17, 40), LOG_LINES[0])
+    self.assertEqual(find(17, 43, 44), LOG_LINES[1])
+    self.assertEqual(find(17, 46, 44), LOG_LINES[3])
+    self.assertEqual(find(17, 50), '')
+
+
+class WatcherTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.append('eqlog_Me_project1999.txt', LOG_LINES[0])
+
+  def append(self, name, line):
+    with open(os.path.join(self.temp_dir, name), 'a') as f:
+      f.write(line + '\n')
+
+  def wait_for(self, watcher, names):
+    changed = set()
+    for _ in range(20):
+      changed |= watcher.wait(0.1)
+      if changed >= names:
+        break
+    return changed
+
+  def check_watcher(self, watcher):
+    self.append('eqlog_Me_project1999.txt', LOG_LINES[1])
+    self.append('eqlog_Alt_project1999.txt', LOG_LINES[2])
+    self.append('notes.txt', LOG_LINES[3])
+    self.assertEqual(
+        self.wait_for(
+            watcher, {'eqlog_Me_project1999.txt', 'eqlog_Alt_project1999.txt'}),
+        {'eqlog_Me_project1999.txt', 'eqlog_Alt_project1999.txt'})
+    self.assertEqual(watcher.wait(0.1), set())
+
+  @unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+  def test_inotify_watcher(self):
+    watcher = upload_logs.InotifyWatcher(self.temp_dir)
+    self.addCleanup(os.close, watcher.fd)
+    self.check_watcher(watcher)
+
+  def test_polling_watcher(self):
+    watcher = upload_logs.PollingWatcher(self.temp_dir, interval=0.01)
+    # The first check reports every log, since it hasn't seen their sizes.
+    self.assertEqual(watcher.wait(0), {'eqlog_Me_project1999.txt'})
+    self.check_watcher(watcher)
+
+  def test_make_watcher(self):
+    watcher = upload_logs.make_watcher(self.temp_dir)
+    if isinstance(watcher, upload_logs.InotifyWatcher):
+      self.addCleanup(os.close, watcher.fd)
+    else:
+      watcher.interval = 0.01
+      watcher.wait(0)
+    self.check_watcher(watcher)
+
+
+if __name__ == '__main__':
+  unittest.main()